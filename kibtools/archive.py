@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compression codecs for the dashboard tarballs
+
+The tarballs are written and read in stream mode through one of the codecs
+below, rather than tarfile's own compression, so that the codec and its level
+can be chosen, and gzip can be compressed in parallel across all cores. When
+reading, the codec is detected from the magic bytes of the stream.
+"""
+
+import io
+import os
+import glob
+import gzip
+import time
+import zlib
+import config
+import argparse
+import functools
+import importlib
+import multiprocessing
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    # Python 2 has no importlib.util
+    from pkgutil import find_loader as find_spec
+
+# Libraries of the optional codecs, imported on first use, so that they are
+# not paid for by runs that do not use them
+LIBRARIES = {
+    'xz': 'lzma',
+    'zst': 'zstandard',
+}
+
+def library(codec):
+    """
+    Import the library of an optional codec
+
+    :param codec: name of the codec: xz, zst
+    :return: module
+    """
+    try:
+        return importlib.import_module(LIBRARIES[codec])
+    except ImportError:
+        raise ValueError('Unavailable codec: {0}'.format(codec))
+
+# Magic bytes at the start of the stream of each codec
+MAGIC = [
+    ('gz', b'\x1f\x8b'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('zst', b'\x28\xb5\x2f\xfd'),
+]
+
+# File extension of the tarballs of each codec
+EXTENSIONS = {
+    'gz': '.tar.gz',
+    'pgz': '.tar.gz',
+    'xz': '.tar.xz',
+    'zst': '.tar.zst',
+}
+
+def available_codecs():
+    """
+    Codecs that can be used, depending on the libraries installed
+
+    :return: list of names
+    """
+    codecs = ['gz', 'pgz']
+    for codec in ['xz', 'zst']:
+        # Found without importing it
+        if find_spec(LIBRARIES[codec]) is not None:
+            codecs.append(codec)
+    return codecs
+
+def extension(codec):
+    """
+    File extension of the tarballs of a codec
+
+    :param codec: name of the codec
+    :return: extension, e.g., .tar.gz
+    """
+    return EXTENSIONS[codec]
+
+def compress_member(block, level):
+    """
+    Compress a block as a complete gzip member
+
+    :param block: bytes
+    :param level: gzip compression level
+    :return: bytes
+    """
+    # A window of 16 + 15 bits writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+class ParallelGzipWriter(object):
+    """
+    File-like object compressing what is written to it as gzip, in blocks
+    compressed in parallel on a pool of processes. Each block is a complete
+    gzip member, and a series of members is a valid gzip stream that any gzip
+    reader decompresses. Blocks are written out in order, and only a bounded
+    number are in flight at once.
+    """
+    def __init__(self, fileobj, level=None, workers=None, block_size=None):
+        """
+        Constructor
+        :param fileobj: file-like object the compressed stream is written to
+        :param level: gzip compression level
+        :param workers: number of processes, one per core by default
+        :param block_size: size of the blocks compressed independently
+        """
+        self.fileobj = fileobj
+        self.block_size = block_size or config.ARCHIVE_BLOCK_SIZE
+        self.workers = workers or multiprocessing.cpu_count()
+        self.compress = functools.partial(
+            compress_member,
+            level=9 if level is None else level
+        )
+        from concurrent.futures import ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = []
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        """
+        Write data, queueing every block that is filled for compression
+
+        :param data: bytes
+        :return: number of bytes written
+        """
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            self._queue(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _queue(self, block):
+        """
+        Queue a block for compression, writing out the oldest ones once too
+        many are in flight
+
+        :param block: bytes
+        """
+        self.pending.append(self.executor.submit(self.compress, block))
+        while len(self.pending) > 2 * self.workers:
+            self.fileobj.write(self.pending.pop(0).result())
+
+    def close(self):
+        """
+        Compress what is left and write out every block, without closing the
+        underlying file-like object
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or not self.pending:
+                self._queue(bytes(self.buffer))
+            for future in self.pending:
+                self.fileobj.write(future.result())
+        finally:
+            self.pending = []
+            self.buffer = bytearray()
+            self.executor.shutdown()
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.close()
+
+def open_writer(codec, fileobj, level=None, workers=None):
+    """
+    Open a compressing file-like object, that writes to another one and does
+    not close it when it is closed
+
+    :param codec: name of the codec: gz, pgz, xz, zst
+    :param fileobj: file-like object the compressed stream is written to
+    :param level: compression level, the codec's default if None
+    :param workers: number of processes or threads compressing in parallel,
+    for pgz and zst
+    :return: file-like object
+    """
+    if codec not in available_codecs():
+        raise ValueError('Unavailable codec: {0}'.format(codec))
+
+    if codec == 'gz':
+        return gzip.GzipFile(
+            fileobj=fileobj,
+            mode='wb',
+            compresslevel=9 if level is None else level
+        )
+    if codec == 'pgz':
+        return ParallelGzipWriter(fileobj, level=level, workers=workers)
+    if codec == 'xz':
+        return library('xz').LZMAFile(
+            fileobj,
+            mode='wb',
+            preset=6 if level is None else level
+        )
+    return library('zst').ZstdCompressor(
+        level=3 if level is None else level,
+        threads=workers or -1
+    ).stream_writer(fileobj, closefd=False)
+
+class PeekReader(object):
+    """
+    File-like object that reads the first bytes of another one ahead, so
+    they can be looked at before the whole stream is read
+    """
+    def __init__(self, fileobj, size):
+        """
+        Constructor
+        :param fileobj: file-like object to read from
+        :param size: number of bytes to read ahead
+        """
+        self.fileobj = fileobj
+        self.head = fileobj.read(size)
+        self.position = 0
+
+    def read(self, size=-1):
+        """
+        Read from the stream, starting with the bytes read ahead
+
+        :param size: number of bytes to read, all that is left if negative
+        :return: bytes
+        """
+        if not self.head:
+            data = self.fileobj.read(size)
+        elif 0 <= size <= len(self.head):
+            data, self.head = self.head[:size], self.head[size:]
+        else:
+            data, self.head = self.head, b''
+            data += self.fileobj.read(-1 if size < 0 else size - len(data))
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        """
+        Number of bytes read from the stream so far
+        """
+        return self.position
+
+class GzipReader(object):
+    """
+    File-like object decompressing a gzip stream as it is read, member after
+    member, without seeking back and forth in it as gzip.GzipFile does on
+    Python 2, where it cannot read a stream from S3
+    """
+    def __init__(self, fileobj, read_size=None):
+        """
+        Constructor
+        :param fileobj: file-like object of the compressed stream
+        :param read_size: bytes of the compressed stream read at a time
+        """
+        self.fileobj = fileobj
+        self.read_size = read_size or config.S3_READ_SIZE
+        self.decompressor = zlib.decompressobj(31)
+        self.buffer = bytearray()
+        self.eof = False
+
+    def _decompress(self, data):
+        """
+        Decompress data, starting a new member where the previous one ends
+
+        :param data: bytes of the compressed stream
+        """
+        while data:
+            self.buffer.extend(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = zlib.decompressobj(31)
+
+    def _member_ended(self):
+        """
+        Check if the last member was read to its end
+        """
+        if hasattr(self.decompressor, 'eof'):
+            return self.decompressor.eof
+
+        # Python 2 does not tell, but leaves data past the end unused
+        probe = self.decompressor.copy()
+        try:
+            probe.decompress(b'\x00')
+        except zlib.error:
+            return False
+        return probe.unused_data == b'\x00'
+
+    def read(self, size=-1):
+        """
+        Read decompressed data
+
+        :param size: number of bytes to read, all that is left if negative
+        :return: bytes
+        """
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.fileobj.read(self.read_size)
+            if data:
+                self._decompress(data)
+                continue
+            self.eof = True
+            ended = self._member_ended()
+            self.buffer.extend(self.decompressor.flush())
+            if not ended:
+                raise EOFError('Compressed file ended before the '
+                               'end-of-stream marker was reached')
+
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        """
+        Close the reader, without closing the underlying file-like object
+        """
+        self.buffer = bytearray()
+
+def detect_codec(head):
+    """
+    Detect the codec of a stream from its first bytes
+
+    :param head: first bytes of the stream
+    :return: name of the codec, or None if it is not compressed
+    """
+    for codec, magic in MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+def open_reader(fileobj):
+    """
+    Open a decompressing file-like object over a stream, with the codec
+    detected from its magic bytes
+
+    :param fileobj: file-like object of the compressed stream
+    :return: file-like object
+    """
+    peek = PeekReader(fileobj, max(len(magic) for _, magic in MAGIC))
+    codec = detect_codec(peek.head)
+
+    if codec == 'gz':
+        return GzipReader(peek)
+    if codec == 'xz':
+        return library('xz').LZMAFile(peek, mode='rb')
+    if codec == 'zst':
+        return library('zst').ZstdDecompressor().stream_reader(
+            peek,
+            read_across_frames=True
+        )
+    return peek
+
+class CountingWriter(object):
+    """
+    File-like object that only counts the bytes written to it
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.bytes = 0
+
+    def write(self, data):
+        """
+        Count the bytes written
+
+        :param data: bytes
+        :return: number of bytes written
+        """
+        self.bytes += len(data)
+        return len(data)
+
+def benchmark_codecs(input_directory, codecs=None, level=None):
+    """
+    Compress an export with each codec, and measure the compression ratio
+    and speed. The tarball is made once in memory, so only the codecs are
+    timed.
+
+    :param input_directory: directory that contains all types
+    :param codecs: names of the codecs, all the available ones by default
+    :param level: compression level, each codec's default if None
+    :return: list of dictionaries of the codec, compressed size, ratio and
+    the MB/s of compression and decompression
+    """
+    import tarfile
+
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode='w|') as out_tar:
+        for folder in sorted(glob.glob('{0}/*'.format(input_directory))):
+            out_tar.add(folder, arcname=os.path.basename(folder))
+    raw = raw.getvalue()
+    megabytes = len(raw) / 1024.0 / 1024.0
+
+    results = []
+    for codec in codecs or available_codecs():
+        compressed = io.BytesIO()
+        started = time.time()
+        with open_writer(codec, compressed, level=level) as writer:
+            writer.write(raw)
+        compress_seconds = time.time() - started
+
+        started = time.time()
+        compressed.seek(0)
+        reader = open_reader(compressed)
+        while reader.read(config.S3_READ_SIZE):
+            pass
+        decompress_seconds = time.time() - started
+
+        size = len(compressed.getvalue())
+        results.append(dict(
+            codec=codec,
+            bytes=size,
+            ratio=len(raw) / float(size) if size else 0.0,
+            compress_rate=megabytes / compress_seconds
+            if compress_seconds > 0 else 0.0,
+            decompress_rate=megabytes / decompress_seconds
+            if decompress_seconds > 0 else 0.0
+        ))
+
+    return results
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the compression codecs on a saved dashboard.'
+    )
+    parser.add_argument(
+        '-d',
+        '--directory',
+        dest='directory',
+        required=True,
+        help='directory the dashboard was saved to',
+        type=str
+    )
+    parser.add_argument(
+        '--level',
+        dest='level',
+        default=None,
+        help='compression level, each codec\'s default if not given',
+        type=int
+    )
+
+    args = parser.parse_args()
+
+    print('{0:<6}{1:>14}{2:>8}{3:>14}{4:>16}'.format(
+        'codec', 'bytes', 'ratio', 'compress MB/s', 'decompress MB/s'
+    ))
+    for result in benchmark_codecs(args.directory, level=args.level):
+        print('{codec:<6}{bytes:>14}{ratio:>8.2f}{compress_rate:>14.1f}'
+              '{decompress_rate:>16.1f}'.format(**result))
@@ -0,0 +1,812 @@
+# encoding: utf-8
+"""
+Benchmark of saving, loading and archiving dashboards at scale
+
+A synthetic corpus of searches, visualizations and dashboards is served by a
+local stand-in for elasticsearch, running in a thread with a configurable
+latency, and AWS S3 is mocked with moto. Each phase reports the objects per
+second, bytes, requests and peak RSS of the process, so that regressions are
+visible:
+
+    python kibtools/benchmark.py --objects 10000 --latency 0.002
+
+The start of the command line is measured with -X importtime, against a
+budget, as it is run once per tenant from shell loops:
+
+    python kibtools/benchmark.py --startup
+"""
+
+import os
+import sys
+import json
+import time
+import boto3
+import config
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import metrics
+import subprocess
+import threading
+import dashboard
+
+from moto import mock_s3
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+logger = logging.getLogger()
+
+# Modules too slow to import for the command line to pay for them on every run
+HEAVY_MODULES = ('boto3', 'botocore', 'requests', 'moto', 'aiohttp')
+
+def generate_corpus(objects=10000, panels=10, seed=0):
+    """
+    Generate saved objects that look like a real kibana index: a fifth are
+    searches, three fifths visualizations, half of them built on a saved
+    search, and a fifth dashboards, each with panels of visualizations and
+    searches
+
+    :param objects: number of objects
+    :param panels: mean number of panels of a dashboard
+    :param seed: seed of the random generator, for repeatable runs
+    :return: list of (type, name, source), in load order
+    """
+    rand = random.Random(seed)
+    n_searches = max(1, objects // 5)
+    n_dashboards = max(1, objects // 5)
+    n_visualizations = max(1, objects - n_searches - n_dashboards)
+
+    corpus = []
+    searches = ['search-{0:06d}'.format(i) for i in range(n_searches)]
+    for name in searches:
+        corpus.append(('search', name, {
+            'title': name,
+            'description': '',
+            'hits': 0,
+            'columns': rand.sample(
+                ['host', 'status', 'bytes', 'path', 'agent', 'referer'], 3
+            ),
+            'sort': ['@timestamp', 'desc'],
+            'version': 1,
+            'kibanaSavedObjectMeta': {
+                'searchSourceJSON': json.dumps({
+                    'index': 'logstash-*',
+                    'query': {'query_string': {
+                        'query': 'status:{0}'.format(rand.choice(
+                            [200, 301, 404, 500]
+                        )),
+                        'analyze_wildcard': True
+                    }},
+                    'filter': []
+                })
+            }
+        }))
+
+    visualizations = ['visualization-{0:06d}'.format(i)
+                      for i in range(n_visualizations)]
+    for name in visualizations:
+        source = {
+            'title': name,
+            'description': '',
+            'version': 1,
+            'visState': json.dumps({
+                'title': name,
+                'type': rand.choice(['histogram', 'line', 'pie', 'table']),
+                'params': {'shareYAxis': True, 'addTooltip': True,
+                           'addLegend': True, 'mode': 'stacked'},
+                'aggs': [
+                    {'id': '1', 'type': 'count', 'schema': 'metric',
+                     'params': {}},
+                    {'id': '2', 'type': 'date_histogram', 'schema': 'segment',
+                     'params': {'field': '@timestamp', 'interval': 'auto',
+                                'min_doc_count': 1}},
+                    {'id': '3', 'type': 'terms', 'schema': 'group',
+                     'params': {'field': rand.choice(['host', 'status']),
+                                'size': 5, 'order': 'desc'}}
+                ],
+                'listeners': {}
+            }),
+            'uiStateJSON': '{}',
+            'kibanaSavedObjectMeta': {'searchSourceJSON': json.dumps({
+                'filter': [], 'query': {'query_string': {'query': '*'}}
+            })}
+        }
+        if rand.random() < 0.5:
+            source['savedSearchId'] = rand.choice(searches)
+        corpus.append(('visualization', name, source))
+
+    for i in range(n_dashboards):
+        name = 'dashboard-{0:06d}'.format(i)
+        dashboard_panels = []
+        for panel in range(max(1, int(rand.expovariate(1.0 / panels)))):
+            if rand.random() < 0.1:
+                panel_type, panel_id = 'search', rand.choice(searches)
+            else:
+                panel_type, panel_id = 'visualization', \
+                    rand.choice(visualizations)
+            dashboard_panels.append({
+                'id': panel_id,
+                'type': panel_type,
+                'panelIndex': panel + 1,
+                'col': 1 + 6 * (panel % 2),
+                'row': 1 + 3 * (panel // 2),
+                'size_x': 6,
+                'size_y': 3
+            })
+        corpus.append(('dashboard', name, {
+            'title': name,
+            'description': '',
+            'hits': 0,
+            'version': 1,
+            'timeRestore': False,
+            'panelsJSON': json.dumps(dashboard_panels),
+            'optionsJSON': json.dumps({'darkTheme': False}),
+            'uiStateJSON': '{}',
+            'kibanaSavedObjectMeta': {'searchSourceJSON': json.dumps({
+                'filter': [{'query': {'query_string': {'query': '*'}}}]
+            })}
+        }))
+
+    return corpus
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server answering each request in its own thread
+    """
+    daemon_threads = True
+
+class StubElasticsearch(object):
+    """
+    Local stand-in for the parts of elasticsearch that are used: searches
+    and scrolls, _mget, _bulk, _cat/indices and the indexing of objects. It
+    runs in a thread, waits a fixed latency before answering each request,
+    and counts the requests and bytes it receives and sends.
+    """
+    def __init__(self, objects=(), latency=0.0, index='.kibana'):
+        """
+        Constructor
+        :param objects: iterable of (type, name, source) held by the index
+        :param latency: seconds to wait before answering each request
+        :param index: name of the kibana index
+        """
+        self.index = index
+        self.latency = latency
+        self.objects = {}
+        self.versions = {}
+        self.scrolls = {}
+        self.lock = threading.Lock()
+        self.reset(objects)
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Answer at once, as elasticsearch does, rather than waiting on
+            # delayed ACKs of kept-alive connections
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                status, response = stub.answer(self.command, self.path, body)
+                data = json.dumps(response).encode('utf-8')
+                with stub.lock:
+                    stub.bytes_in += length
+                    stub.bytes_out += len(data)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.cluster = dict(
+            ip_address='127.0.0.1',
+            port=str(self.server.server_address[1]),
+            index=index
+        )
+
+    def reset(self, objects=()):
+        """
+        Replace the objects of the index, and zero the counters
+
+        :param objects: iterable of (type, name, source)
+        """
+        with self.lock:
+            self.objects = dict(
+                ((object_type, name), source)
+                for object_type, name, source in objects
+            )
+            self.versions = dict((key, 1) for key in self.objects)
+            self.scrolls = {}
+            self.requests = Counter()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def hit(self, key, source_filter=True):
+        """
+        Hit of an object, as returned by searches and _mget
+
+        :param key: (type, name) of the object
+        :param source_filter: True, False, or the list of fields to return
+        :return: dictionary
+        """
+        found = {
+            '_index': self.index,
+            '_type': key[0],
+            '_id': key[1],
+            '_version': self.versions[key]
+        }
+        if source_filter is True:
+            found['_source'] = self.objects[key]
+        elif source_filter:
+            found['_source'] = dict(
+                (field, value) for field, value in self.objects[key].items()
+                if field in source_filter
+            )
+        return found
+
+    def answer(self, method, url, body):
+        """
+        Answer a request
+
+        :param method: HTTP method
+        :param url: path and query string of the request
+        :param body: bytes of the body
+        :return: (status code, response)
+        """
+        parsed = urlparse(url)
+        path = parsed.path
+        params = parse_qs(parsed.query)
+        parts = path.strip('/').split('/')
+
+        if path.startswith('/_cat/indices'):
+            self.count('cat')
+            return 200, [{'index': self.index,
+                          'docs.count': str(len(self.objects))}]
+
+        if path == '/_bulk':
+            self.count('bulk')
+            return 200, self.bulk(body)
+
+        body = json.loads(body.decode('utf-8')) if body else {}
+
+        if path == '/_search/scroll':
+            if method == 'DELETE':
+                self.count('clear_scroll')
+                with self.lock:
+                    for scroll_id in body.get('scroll_id', []):
+                        self.scrolls.pop(scroll_id, None)
+                return 200, {'succeeded': True}
+            self.count('scroll')
+            return 200, self.page(body['scroll_id'])
+
+        if parts[-1] == '_search':
+            self.count('search')
+            return 200, self.search(parts[1:-1], body, 'scroll' in params)
+
+        if parts[-1] == '_mget':
+            self.count('mget')
+            docs = []
+            for doc in body['docs']:
+                key = (doc['_type'], doc['_id'])
+                if key in self.objects:
+                    docs.append(dict(self.hit(key), found=True))
+                else:
+                    docs.append(dict(doc, found=False))
+            return 200, {'docs': docs}
+
+        if len(parts) == 3 and method in ('POST', 'PUT'):
+            self.count('index')
+            return 200, self.store((parts[1], parts[2]), body)
+
+        return 404, {'error': 'no handler for {0} {1}'.format(method, path)}
+
+    def count(self, kind):
+        """
+        Count a request
+
+        :param kind: kind of the request, e.g., search
+        """
+        with self.lock:
+            self.requests[kind] += 1
+
+    def store(self, key, source):
+        """
+        Index an object
+
+        :param key: (type, name) of the object
+        :param source: source of the object
+        :return: response of elasticsearch
+        """
+        with self.lock:
+            version = self.versions.get(key, 0) + 1
+            self.objects[key] = source
+            self.versions[key] = version
+        return {'_version': version, 'created': version == 1}
+
+    def bulk(self, body):
+        """
+        Index the objects of a _bulk request
+
+        :param body: NDJSON bytes
+        :return: response of elasticsearch
+        """
+        lines = body.decode('utf-8').strip().split('\n')
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            action = json.loads(action)['index']
+            key = (action['_type'], action['_id'])
+            result = self.store(key, json.loads(source))
+            items.append({'index': dict(
+                action,
+                _version=result['_version'],
+                status=201 if result['created'] else 200
+            )})
+        return {'errors': False, 'items': items}
+
+    def search(self, search_type, body, scroll):
+        """
+        Start a search, filtered on the type in the path or in a terms query
+        on _type, opening a scroll context if asked
+
+        :param search_type: list holding the type searched, if any
+        :param body: body of the search
+        :param scroll: if a scroll context should be opened
+        :return: first page of hits
+        """
+        types = search_type or body.get('query', {}).get(
+            'terms', {}).get('_type')
+        source_filter = body.get('_source', True)
+        with self.lock:
+            hits = [
+                self.hit(key, source_filter)
+                for key in sorted(self.objects)
+                if not types or key[0] in types
+            ]
+            scroll_id = None
+            if scroll:
+                scroll_id = str(len(self.scrolls) + 1)
+                self.scrolls[scroll_id] = [hits, 0, body.get('size', 10)]
+
+        if scroll_id is None:
+            return {'hits': {'total': len(hits),
+                             'hits': hits[:body.get('size', 10)]}}
+        return self.page(scroll_id)
+
+    def page(self, scroll_id):
+        """
+        Next page of hits of a scroll context
+
+        :param scroll_id: id of the scroll context
+        :return: page of hits
+        """
+        with self.lock:
+            hits, offset, size = self.scrolls[scroll_id]
+            self.scrolls[scroll_id][1] = offset + size
+        return {
+            '_scroll_id': scroll_id,
+            'hits': {'total': len(hits), 'hits': hits[offset:offset + size]}
+        }
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process to its current size, so
+    that the peak of a phase is not hidden by an earlier, bigger one. Only
+    Linux allows it, through /proc/self/clear_refs.
+
+    :return: if it was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def peak_rss():
+    """
+    Peak resident set size of the process since it was last reset
+
+    :return: bytes, or None where it cannot be measured
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+def directory_size(directory):
+    """
+    Size of the files of a directory
+
+    :param directory: path of the directory
+    :return: bytes
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+def measure(phase, function, objects, stub=None):
+    """
+    Run a phase and measure it
+
+    :param phase: name of the phase
+    :param function: function running the phase, that returns the number of
+    bytes it moved
+    :param objects: number of objects the phase handles
+    :param stub: StubElasticsearch whose requests are counted, if any
+    :return: dictionary of the phase, seconds, objects, objects per second,
+    bytes, requests by kind, peak RSS of the phase, or None where it cannot
+    be told apart from the earlier phases, and the metrics of the phases of
+    the run it is made of
+    """
+    if stub is not None:
+        stub.requests.clear()
+    metrics.reset()
+    reset = reset_peak_rss()
+    started = time.time()
+    moved = function()
+    seconds = time.time() - started
+
+    result = dict(
+        phase=phase,
+        seconds=seconds,
+        objects=objects,
+        objects_per_second=objects / seconds if seconds > 0 else 0.0,
+        bytes=moved,
+        requests=dict(stub.requests) if stub is not None else {},
+        peak_rss=peak_rss() if reset else None,
+        metrics=metrics.report()['phases']
+    )
+    logger.warning('{phase}: {objects} objects in {seconds:.2f}s, '
+                   '{objects_per_second:.0f} objects/s'.format(**result))
+    return result
+
+def parse_importtime(output):
+    """
+    Parse the imports reported by python -X importtime
+
+    :param output: what the interpreter wrote to stderr
+    :return: list of (name, self microseconds, cumulative microseconds,
+    depth), in the order reported, where depth is 0 for modules imported by
+    the top-level code
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        imports.append((
+            name.strip(),
+            int(fields[0]),
+            int(fields[1]),
+            (len(name) - len(name.lstrip())) // 2
+        ))
+    return imports
+
+def time_imports(arguments):
+    """
+    Run the interpreter once with -X importtime
+
+    :param arguments: arguments of the interpreter, e.g., a script and its
+    options
+    :return: tuple of the imports, as parse_importtime, and the wall time of
+    the process in seconds
+    """
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime'] + list(arguments),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    _, stderr = process.communicate()
+    seconds = time.time() - started
+    return parse_importtime(stderr.decode('utf-8', 'replace')), seconds
+
+def measure_startup(arguments=None, runs=5, top=10):
+    """
+    Measure the start of the command line: the time spent importing its
+    modules, less what the interpreter imports on its own, and the wall time
+    of the process. The median of a few runs is taken, as the first ones
+    can be slowed down by a cold disk cache.
+
+    :param arguments: arguments of the interpreter, dashboard.py --help by
+    default
+    :param runs: number of runs
+    :param top: number of the slowest modules reported
+    :return: dictionary of the command, import and wall seconds, the import
+    seconds of the interpreter alone, the slowest modules imported by the
+    command, and the heavy modules it imported
+    """
+    if arguments is None:
+        arguments = [os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'dashboard.py'), '--help']
+
+    def median(values):
+        return sorted(values)[len(values) // 2]
+
+    def total(imports):
+        return sum(cumulative for _, _, cumulative, depth in imports
+                   if depth == 0) / 1e6
+
+    interpreter = [time_imports(['-c', 'pass'])[0] for _ in range(runs)]
+    command = [time_imports(arguments) for _ in range(runs)]
+    baseline = set(name for name, _, _, _ in interpreter[0])
+
+    imports, _ = command[-1]
+    imported = set(name for name, _, _, _ in imports)
+    slowest = sorted(
+        ((name, cumulative / 1e6) for name, _, cumulative, depth in imports
+         if depth == 0 and name not in baseline),
+        key=lambda module: -module[1]
+    )
+
+    interpreter_seconds = median([total(i) for i in interpreter])
+    return dict(
+        command=' '.join(arguments),
+        seconds=max(0.0, median([total(i) for i, _ in command]) -
+                    interpreter_seconds),
+        wall=median([wall for _, wall in command]),
+        interpreter=interpreter_seconds,
+        slowest=slowest[:top],
+        heavy=[name for name in HEAVY_MODULES if name in imported]
+    )
+
+def run_benchmark(objects=10000, panels=10, latency=0.0, bulk=False,
+                  workers=None, page_size=None, s3_details=None, seed=0,
+                  raw=False):
+    """
+    Benchmark save_all_types, push_all_from_disk, push_to_s3 and
+    pull_from_s3 on a synthetic corpus
+
+    :param objects: number of objects of the corpus
+    :param panels: mean number of panels of a dashboard
+    :param latency: seconds the stub elasticsearch waits before answering
+    :param bulk: if the load should use the _bulk API
+    :param workers: number of concurrent pushes of the load
+    :param page_size: number of hits requested per page when saving
+    :param s3_details: details about AWS S3, with a bucket mocked by moto
+    :param seed: seed of the corpus
+    :param raw: if the load should send the objects as they were saved
+    :return: list of the measures of each phase
+    """
+    corpus = generate_corpus(objects=objects, panels=panels, seed=seed)
+    s3_details = s3_details or dict(bucket='kibtools-benchmark')
+    directory = tempfile.mkdtemp()
+    output_directory = os.path.join(directory, 'save')
+    pulled_directory = os.path.join(directory, 'pull')
+    results = []
+
+    try:
+        with StubElasticsearch(corpus, latency=latency) as stub:
+            def save():
+                dashboard.save_all_types(
+                    cluster=stub.cluster,
+                    output_directory=output_directory,
+                    page_size=page_size
+                )
+                return directory_size(output_directory)
+            results.append(measure('save_all_types', save, len(corpus), stub))
+
+            stub.reset()
+
+            def load():
+                dashboard.load_objects(
+                    cluster=stub.cluster,
+                    objects=dashboard.iter_objects_from_disk(output_directory,
+                                                             raw=raw),
+                    bulk=bulk,
+                    workers=workers
+                )
+                return stub.bytes_in
+            results.append(measure('push_all_from_disk', load, len(corpus),
+                                   stub))
+
+        with mock_s3():
+            boto3.resource('s3').create_bucket(Bucket=s3_details['bucket'])
+
+            def push():
+                key = dashboard.push_to_s3(
+                    input_directory=output_directory,
+                    s3_details=s3_details
+                )
+                return boto3.client('s3').head_object(
+                    Bucket=s3_details['bucket'],
+                    Key=key
+                )['ContentLength']
+            results.append(measure('push_to_s3', push, len(corpus)))
+
+            def pull():
+                dashboard.pull_from_s3(
+                    output_directory=pulled_directory,
+                    s3_details=s3_details
+                )
+                return directory_size(pulled_directory)
+            results.append(measure('pull_from_s3', pull, len(corpus)))
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark saving, loading and archiving dashboards.'
+    )
+    parser.add_argument(
+        '--objects',
+        dest='objects',
+        default=10000,
+        help='number of saved objects of the synthetic corpus',
+        type=int
+    )
+    parser.add_argument(
+        '--panels',
+        dest='panels',
+        default=10,
+        help='mean number of panels of a dashboard',
+        type=int
+    )
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        default=0.0,
+        help='seconds the stub elasticsearch waits before each response',
+        type=float
+    )
+    parser.add_argument(
+        '--bulk',
+        default=False,
+        dest='bulk',
+        action='store_true',
+        help='load with the _bulk API'
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        default=None,
+        help='number of concurrent pushes of the load',
+        type=int
+    )
+    parser.add_argument(
+        '--page-size',
+        dest='page_size',
+        default=None,
+        help='number of hits requested per page when saving',
+        type=int
+    )
+    parser.add_argument(
+        '--raw',
+        default=False,
+        dest='raw',
+        action='store_true',
+        help='load the objects as the JSON they were saved as'
+    )
+    parser.add_argument(
+        '--codec',
+        dest='codec',
+        default=None,
+        help='compression of the tarball pushed to S3',
+        type=str
+    )
+    parser.add_argument(
+        '--startup',
+        default=False,
+        dest='startup',
+        action='store_true',
+        help='measure the start of dashboard.py --help instead, and fail if '
+             'its imports take longer than the budget'
+    )
+    parser.add_argument(
+        '--budget',
+        dest='budget',
+        default=config.STARTUP_BUDGET,
+        help='seconds the imports of the command line may take',
+        type=float
+    )
+    parser.add_argument(
+        '--json',
+        dest='json',
+        default=None,
+        help='also write the results as JSON to this file, to compare runs',
+        type=str
+    )
+
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = measure_startup()
+        print('{command}\n  imports {0:.1f}ms (budget {1:.1f}ms), wall '
+              '{2:.1f}ms, interpreter imports {3:.1f}ms'.format(
+                  startup['seconds'] * 1e3, args.budget * 1e3,
+                  startup['wall'] * 1e3, startup['interpreter'] * 1e3,
+                  **startup
+              ))
+        for name, seconds in startup['slowest']:
+            print('  {0:<30}{1:>8.1f}ms'.format(name, seconds * 1e3))
+        if startup['heavy']:
+            print('  heavy modules imported: {0}'.format(
+                ', '.join(startup['heavy'])))
+
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(startup, json_file, indent=2)
+        if startup['seconds'] > args.budget or startup['heavy']:
+            sys.exit(1)
+        sys.exit(0)
+
+    # The objects are logged one by one at INFO, which would be measured too
+    dashboard.configure_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run_benchmark(
+        objects=args.objects,
+        panels=args.panels,
+        latency=args.latency,
+        bulk=args.bulk,
+        workers=args.workers,
+        page_size=args.page_size,
+        s3_details=dict(bucket='kibtools-benchmark', codec=args.codec),
+        raw=args.raw
+    )
+
+    print('{0:<20}{1:>10}{2:>10}{3:>12}{4:>14}{5:>12}{6:>10}'.format(
+        'phase', 'objects', 'seconds', 'objects/s', 'bytes', 'peak RSS',
+        'requests'
+    ))
+    for result in results:
+        print('{phase:<20}{objects:>10}{seconds:>10.2f}'
+              '{objects_per_second:>12.0f}{bytes:>14}{0:>12}{1:>10}'.format(
+                  '{0:.1f}MB'.format(result['peak_rss'] / 1024.0 / 1024.0)
+                  if result['peak_rss'] else '-',
+                  sum(result['requests'].values()) or '-',
+                  **result
+              ))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
@@ -0,0 +1,198 @@
+# encoding: utf-8
+"""
+Single-file NDJSON bundle of saved objects
+
+A bundle holds a whole export in one file, rather than one small JSON file per
+object: a header line describing the bundle, followed by one line per object
+with its type, name and source. It is written and read as a stream, and can be
+compressed with any of the archive codecs, chosen from the extension of the
+file, e.g., dashboard.ndjson.gz.
+"""
+
+import config
+import archive
+import jsoncodec
+import logging
+import datetime
+
+logger = logging.getLogger()
+
+# Format and version written in the header of every bundle
+FORMAT = 'kibtools-bundle'
+VERSION = 1
+
+# Codec of the bundles, from the extension of their file
+CODECS = {
+    '.gz': 'gz',
+    '.xz': 'xz',
+    '.zst': 'zst',
+}
+
+def bundle_codec(path):
+    """
+    Codec a bundle is compressed with, from the extension of its file
+
+    :param path: path of the bundle
+    :return: name of the codec, or None if it is not compressed
+    """
+    for ext, codec in CODECS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+def iter_lines(fileobj, size=None):
+    """
+    Split a stream into lines, reading it in chunks, so that it works on any
+    of the decompressing file-like objects
+
+    :param fileobj: file-like object
+    :param size: size of the chunks read
+    :return: generator of lines, as bytes, without their newline
+    """
+    size = size or config.S3_READ_SIZE
+    remainder = b''
+    while True:
+        chunk = fileobj.read(size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if remainder:
+        yield remainder
+
+class BundleWriter(object):
+    """
+    Writes the objects of an export to a bundle, one line at a time
+    """
+    def __init__(self, path, codec=None, level=None, index=None):
+        """
+        Constructor
+        :param path: path of the bundle
+        :param codec: codec to compress with, from the extension by default
+        :param level: compression level, the codec's default if None
+        :param index: name of the index the objects were exported from
+        """
+        self.path = path
+        self.codec = codec or bundle_codec(path)
+        self.objects = 0
+        self.file = open(path, 'wb')
+        if self.codec:
+            self.stream = archive.open_writer(self.codec, self.file,
+                                              level=level)
+        else:
+            self.stream = self.file
+
+        self._write_line(dict(
+            format=FORMAT,
+            version=VERSION,
+            created=datetime.datetime.utcnow().isoformat() + 'Z',
+            index=index,
+            types=config.SAVED_OBJECT_TYPES
+        ))
+
+    def _write_line(self, document):
+        """
+        Write a document as a line of JSON
+
+        :param document: dictionary
+        """
+        self.stream.write(jsoncodec.dumps(document) + b'\n')
+
+    def write(self, object_type, name, source):
+        """
+        Write an object
+
+        :param object_type: type of the object: dashboard, visualization,
+        search
+        :param name: name of the object
+        :param source: source of the object, or RawJSON copied in as it is
+        """
+        source = jsoncodec.dumps(source)
+        if b'\n' in source:
+            source = jsoncodec.dumps(jsoncodec.loads(source))
+
+        # The source is spliced in, rather than decoded to be encoded again
+        line = jsoncodec.dumps(dict(type=object_type, name=name))
+        self.stream.write(line[:-1] + b',"source":' + source + b'}\n')
+        self.objects += 1
+
+    def close(self):
+        """
+        Flush the compressed stream and close the file
+        """
+        try:
+            if self.stream is not self.file:
+                self.stream.close()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.close()
+
+def write_bundle(path, objects, codec=None, level=None, index=None):
+    """
+    Write a stream of objects to a bundle
+
+    :param path: path of the bundle
+    :param objects: iterable of (type, name, source)
+    :param codec: codec to compress with, from the extension by default
+    :param level: compression level, the codec's default if None
+    :param index: name of the index the objects were exported from
+    :return: number of objects written
+    """
+    with BundleWriter(path, codec=codec, level=level, index=index) as writer:
+        for object_type, name, source in objects:
+            writer.write(object_type, name, source)
+
+    logger.info('Wrote {0} objects to bundle: {1}'.format(writer.objects, path))
+    return writer.objects
+
+def read_header(lines):
+    """
+    Read and check the header of a bundle
+
+    :param lines: iterator of the lines of the bundle
+    :return: dictionary of the header
+    """
+    try:
+        header = jsoncodec.loads(next(lines))
+    except StopIteration:
+        raise ValueError('Empty bundle')
+
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise ValueError('Not a bundle')
+    if header.get('version', 0) > VERSION:
+        raise ValueError(
+            'Unsupported bundle version: {0}'.format(header['version'])
+        )
+    return header
+
+def iter_bundle(path):
+    """
+    Read the objects out of a bundle, in the order they were written, with
+    its codec detected from its first bytes
+
+    :param path: path of the bundle
+    :return: generator of (type, name, source)
+    """
+    with open(path, 'rb') as bundle_file:
+        lines = iter_lines(archive.open_reader(bundle_file))
+        header = read_header(lines)
+        logger.info('Reading bundle: {0}, created {1}'
+                    .format(path, header.get('created')))
+
+        for line in lines:
+            document = jsoncodec.loads(line)
+            yield document['type'], document['name'], document['source']
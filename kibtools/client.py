@@ -0,0 +1,174 @@
+# encoding: utf-8
+"""
+Elasticsearch cluster client
+"""
+
+import copy
+import time
+import config
+import metrics
+
+class ClusterClient(object):
+    """
+    Client for the kibana index of one elasticsearch cluster. It owns a pooled
+    HTTP session, so that connections are kept alive and re-used between
+    requests, rather than opening a new one per request.
+    """
+    def __init__(self, cluster, pool_size=None, timeout=None):
+        """
+        Constructor
+        :param cluster: cluster details
+        :param pool_size: maximum number of pooled connections
+        :param timeout: seconds to wait for elasticsearch, either a number or a
+        (connect, read) tuple
+        """
+        self.cluster = cluster
+        self.index = cluster['index']
+        self.pool_size = pool_size or config.ES_POOL_SIZE
+        self.timeout = timeout or (
+            config.ES_CONNECT_TIMEOUT,
+            config.ES_READ_TIMEOUT
+        )
+
+        self.base_url = 'http://{ip_address}:{port}'.format(
+            ip_address=cluster['ip_address'],
+            port=cluster['port'],
+        )
+        self.index_url = '{base_url}/{index}'.format(
+            base_url=self.base_url,
+            index=self.index
+        )
+
+        # Imported here rather than on import of the module, so that the
+        # command line starts without it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/json'
+        })
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size
+        )
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_cluster(cls, cluster):
+        """
+        Return a client for the cluster, re-using it if it is already one
+
+        :param cluster: cluster details or client
+        :return: ClusterClient
+        """
+        if isinstance(cluster, cls):
+            return cluster
+        return cls(cluster)
+
+    def for_index(self, index):
+        """
+        Return a client for another index of the same cluster, that shares the
+        pooled session of this one
+
+        :param index: name of the index
+        :return: ClusterClient
+        """
+        client = copy.copy(self)
+        client.cluster = dict(self.cluster, index=index)
+        client.index = index
+        client.index_url = '{base_url}/{index}'.format(
+            base_url=self.base_url,
+            index=index
+        )
+        return client
+
+    def url(self, path):
+        """
+        Build the URL for a path on the cluster
+
+        :param path: path relative to the cluster, e.g., _search/scroll
+        :return: URL
+        """
+        return '{0}/{1}'.format(self.base_url, path.lstrip('/'))
+
+    def index_path(self, *parts):
+        """
+        Build the path of something inside the kibana index
+
+        :param parts: parts of the path, e.g., type and name of an object
+        :return: path relative to the cluster
+        """
+        return '/'.join((self.index,) + parts)
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to the cluster through the pooled session, and record
+        its latency and size in the metrics of the current phase
+
+        :param method: HTTP method
+        :param path: path relative to the cluster
+        :param kwargs: extra arguments for requests
+        :return: response from elasticsearch
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        sent = len(kwargs.get('data') or b'')
+
+        started = time.time()
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+        except IOError:
+            # Every exception of requests is an IOError
+            metrics.observe_request(time.time() - started, sent=sent,
+                                    error=True)
+            raise
+
+        # The body of a streamed response is not read here
+        if kwargs.get('stream'):
+            received = int(response.headers.get('Content-Length') or 0)
+        else:
+            received = len(response.content)
+        metrics.observe_request(
+            time.time() - started,
+            sent=sent,
+            received=received,
+            error=response.status_code >= 400
+        )
+        return response
+
+    def get(self, path, **kwargs):
+        """
+        GET a path on the cluster
+        """
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """
+        POST to a path on the cluster
+        """
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        """
+        DELETE a path on the cluster
+        """
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        """
+        Close the pooled connections
+        """
+        self.session.close()
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.close()
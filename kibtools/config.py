@@ -34,3 +34,105 @@ LOGGING = {
         },
     },
 }
+
+# Saved object types, in the order they must be loaded so that the objects
+# they refer to already exist
+SAVED_OBJECT_TYPES = ['search', 'visualization', 'dashboard']
+
+# Number of hits requested per page when extracting saved objects
+ES_PAGE_SIZE = 500
+
+# How long elasticsearch keeps a scroll context alive between pages
+ES_SCROLL_KEEPALIVE = '1m'
+
+# Maximum number of pooled, kept-alive connections to elasticsearch
+ES_POOL_SIZE = 10
+
+# Seconds to wait to connect to, and to read from, elasticsearch
+ES_CONNECT_TIMEOUT = 5
+ES_READ_TIMEOUT = 60
+
+# Maximum number of objects, and bytes, sent in one _bulk request
+ES_BULK_SIZE = 500
+ES_BULK_BYTES = 5 * 1024 * 1024
+
+# Number of objects pushed to elasticsearch at once by the concurrent loader
+LOAD_WORKERS = 8
+
+# Writes in flight when loading starts; this grows while elasticsearch
+# accepts writes and halves when it rejects them
+WRITE_INITIAL_IN_FLIGHT = 2
+
+# Retries of a rejected write, with a jittered exponential backoff between
+# BACKOFF and MAX_BACKOFF seconds
+WRITE_MAX_RETRIES = 5
+WRITE_BACKOFF = 0.1
+WRITE_MAX_BACKOFF = 10
+
+# Maximum number of objects fetched in one _mget request
+ES_MGET_SIZE = 500
+
+# File, in the output directory, recording the version and content hash of
+# each saved object for incremental saves
+MANIFEST_FILE = '.manifest.json'
+
+# Size of the parts, and number of them sent at once, when transferring
+# archives to and from AWS S3
+S3_PART_SIZE = 8 * 1024 * 1024
+S3_CONCURRENCY = 4
+
+# Size of the reads from the body of an archive downloaded from AWS S3
+S3_READ_SIZE = 1024 * 1024
+
+# Prefix, in the AWS S3 bucket, of the content-addressed snapshot store
+STORE_PREFIX = 'store'
+
+# Prefix, in the AWS S3 bucket, of the timestamped dashboard tarballs, and
+# the key of the pointer to the latest one
+S3_SNAPSHOT_PREFIX = 'snapshots/'
+S3_LATEST_KEY = 'snapshots/latest'
+
+# Key of the single tarball written by earlier versions, still loaded when
+# there is no pointer to the latest snapshot
+S3_LEGACY_KEY = 'dashboard.tar.gz'
+
+# Compression of the dashboard tarballs: gz, pgz (gzip compressed in
+# parallel blocks), xz or zst, and its level, the codec's default if None
+ARCHIVE_CODEC = 'gz'
+ARCHIVE_LEVEL = None
+
+# Size of the blocks compressed in parallel by the pgz codec
+ARCHIVE_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Number of bulk requests in flight to each cluster when a load is fanned out
+# to many clusters at once
+FANOUT_CONCURRENCY = 4
+
+# Number of kibana indices, e.g., of tenants, saved at once
+INDEX_WORKERS = 4
+
+# Upper bounds, in seconds, of the buckets of the histograms of the latency of
+# requests, and the prefix of the metrics written for Prometheus
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                           10)
+METRICS_PREFIX = 'kibtools'
+
+# Number of frames kept for each allocation traced with --trace-malloc, and
+# number of allocation sites reported for each phase
+TRACEMALLOC_FRAMES = 1
+TRACEMALLOC_TOP = 10
+
+# Number of functions listed, sorted by cumulative time, with --profile
+PROFILE_LIMIT = 30
+
+# Most seconds the command line may spend importing its modules on top of the
+# interpreter's own start, measured by benchmark.py --startup
+STARTUP_BUDGET = 0.1
+
+# Library decoding and encoding the saved objects: orjson, ujson or json, the
+# fastest one installed if None
+JSON_CODEC = None
+
+# Bytes of the responses of elasticsearch read, and parsed, at a time, so that
+# pages of hits are never held whole in memory
+ES_STREAM_CHUNK = 64 * 1024
@@ -26,174 +26,780 @@ http://docs.aws.amazon.com/AmazonS3/latest/dev/using-iam-policies.html
 import os
 import glob
 import json
-import boto3
+import fnmatch
+import hashlib
 import config
-import tarfile
 import logging
-import logging.config
+import itertools
+import bundle
+import archive
+import metrics
+import jsoncodec
 import argparse
-import requests
+import searchstream
+import transfer
+import snapshots
 
-logging.config.dictConfig(config.LOGGING)
+from client import ClusterClient
+from scheduler import WriteScheduler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# boto3, requests, tarfile and the profilers are imported by the code that
+# uses them, so that the command line, and loads that do not touch AWS S3,
+# start without paying for them
 logger = logging.getLogger()
 
+# Saved object types, in the order they must be loaded
+SAVED_OBJECT_TYPES = config.SAVED_OBJECT_TYPES
+
+def configure_logging():
+    """
+    Configure logging for the command line. It is left to the entry points,
+    rather than done on import, so importing the module stays cheap and
+    does not override the logging of the code that imports it.
+    """
+    import logging.config
+    logging.config.dictConfig(config.LOGGING)
+
 def parse_visualizations(dashboard):
     """
     Parse the visualizations from a dashboard
     :param dashboard: JSON dashboard response
     :return: list of visualization names
     """
-    return [panel['id'] for panel in json.loads(dashboard['panelsJSON'])]
+    return [panel['id'] for panel in jsoncodec.loads(dashboard['panelsJSON'])]
 
-def get_dashboards(cluster):
+def parse_panels(dashboard):
     """
-    GET all the saved dashboards
+    Parse the objects shown in the panels of a dashboard, which are mostly
+    visualizations but can also be saved searches
+    :param dashboard: JSON dashboard response
+    :return: list of (type, name)
+    """
+    return [
+        (panel.get('type', 'visualization'), panel['id'])
+        for panel in jsoncodec.loads(dashboard.get('panelsJSON', '[]'))
+    ]
 
-    :param cluster: cluster details
-    :return: list of dictionaries
+def raise_for_status(response):
     """
-    url = 'http://{ip_address}:{port}/{index}/dashboard/_search'.format(
-        ip_address=cluster['ip_address'],
-        port=cluster['port'],
-        index=cluster['index'],
-    )
+    Raise for a response that failed, closing it first, as the body of a
+    streamed response is not read
 
-    response = requests.get(url)
-    dashboards = json.loads(response.text).get('hits', {}).get('hits', {})
+    :param response: response from elasticsearch
+    """
+    if response.status_code >= 400:
+        response.close()
+        response.raise_for_status()
 
-    dashboards = [
-        dict(name=db['_id'],
-             source=db['_source'],
-             visualizations=parse_visualizations(db['_source'])
-             ) for db in dashboards
-        ]
+def search_total(fields):
+    """
+    Exact number of hits of a search, from the first page of its response
 
-    return dashboards
+    :param fields: scalars of the response, as kept by StreamParser
+    :return: number of hits, or None if it is not known exactly
+    """
+    total = fields.get('hits.total', fields.get('hits.total.value'))
+    if fields.get('hits.total.relation', 'eq') != 'eq' or \
+            not isinstance(total, int):
+        return None
+    return total
+
+def scroll_search(cluster, search_type=None, page_size=None, query=None,
+                  source=True, version=False):
+    """
+    Search the kibana index and iterate over every hit, fetching them page by
+    page with the scroll API rather than relying on the default page of hits
+    returned by elasticsearch. Each page is parsed as it is received, so only
+    one hit of it is held in memory at a time.
+
+    :param cluster: cluster details or client
+    :param search_type: type to search: dashboard, visualization, search. The
+    whole index is searched if it is not given
+    :param page_size: number of hits requested per page
+    :param query: optional query to filter the hits
+    :param source: if the _source of the hits should be returned, or the list
+    of its fields to return
+    :param version: if the _version of the hits should be returned
+    :return: generator of hits
+    """
+    client = ClusterClient.from_cluster(cluster)
+    page_size = page_size or config.ES_PAGE_SIZE
+
+    path = client.index_path('_search')
+    if search_type:
+        path = client.index_path(search_type, '_search')
+
+    body = {'size': page_size}
+    if query:
+        body['query'] = query
+    if source is not True:
+        body['_source'] = source
+    if version:
+        body['version'] = True
+
+    with metrics.phase('fetch'):
+        response = client.post(
+            path,
+            params={'scroll': config.ES_SCROLL_KEEPALIVE},
+            data=jsoncodec.dumps(body),
+            stream=True
+        )
+    # A failed search must not pass for an index without objects
+    raise_for_status(response)
+
+    scroll_id, total, found = None, None, 0
+    try:
+        while True:
+            page = searchstream.StreamParser()
+            for hit in page.iterate(response):
+                scroll_id = page.fields.get('_scroll_id', scroll_id)
+                metrics.count_objects(hit.get('_type', search_type),
+                                      phase='fetch')
+                yield hit
+            scroll_id = page.fields.get('_scroll_id', scroll_id)
+            found += page.items
+            if total is None:
+                total = search_total(page.fields)
+
+            # A short page means there is nothing left to scroll through
+            if page.items < page_size or not scroll_id:
+                break
+
+            with metrics.phase('fetch'):
+                response = client.post(
+                    '_search/scroll',
+                    data=jsoncodec.dumps({
+                        'scroll': config.ES_SCROLL_KEEPALIVE,
+                        'scroll_id': scroll_id
+                    }),
+                    stream=True
+                )
+            # Nor an expired scroll context for the end of the hits
+            raise_for_status(response)
+
+        # Nor must a scroll that ended early pass for every hit
+        if total is not None and found != total:
+            raise IOError('The scroll ended after {0} of {1} hits'
+                          .format(found, total))
+    finally:
+        # Free the scroll context rather than waiting for it to time out
+        if scroll_id:
+            with metrics.phase('fetch'):
+                client.delete(
+                    '_search/scroll',
+                    data=jsoncodec.dumps({'scroll_id': [scroll_id]})
+                )
+
+def mget_objects(cluster, objects, batch_size=None):
+    """
+    GET many objects by their type and name, in batches with the _mget API
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name)
+    :param batch_size: maximum number of objects fetched per request
+    :return: generator of the hits that were found
+    """
+    client = ClusterClient.from_cluster(cluster)
+    batch_size = batch_size or config.ES_MGET_SIZE
+
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, batch_size))
+        if not batch:
+            break
+
+        with metrics.phase('fetch'):
+            response = client.post(
+                client.index_path('_mget'),
+                data=jsoncodec.dumps({
+                    'docs': [
+                        {'_type': object_type, '_id': name}
+                        for object_type, name in batch
+                    ]
+                }),
+                stream=True
+            )
+        # A failed request must not pass for objects that do not exist
+        raise_for_status(response)
+        docs = searchstream.StreamParser(path=('docs',))
+        for doc in docs.iterate(response):
+            if doc.get('found'):
+                yield doc
+
+def content_hash(source):
+    """
+    Hash the content of an object, independently of the order of its keys
+
+    :param source: source of object, or RawJSON
+    :return: hexadecimal digest
+    """
+    # Always the standard library, so that the hashes kept in the manifests
+    # do not change with the JSON codec installed
+    content = json.dumps(jsoncodec.decoded(source), sort_keys=True,
+                         separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
 
-def get_visualizations(cluster):
+def format_object(object_type, hit):
     """
-    GET all the saved visualizations
+    Convert a hit from elasticsearch into the dictionary used for its type
 
-    :param cluster: cluster details
-    :return: list of dictionaries
+    :param object_type: type of the object: dashboard, visualization, search
+    :param hit: hit returned by elasticsearch
+    :return: dictionary
     """
-    url = 'http://{ip_address}:{port}/{index}/visualization/_search'.format(
-        ip_address=cluster['ip_address'],
-        port=cluster['port'],
-        index=cluster['index'],
+    formatted = dict(
+        name=hit['_id'],
+        source=hit['_source']
     )
+    if object_type == 'dashboard':
+        formatted['visualizations'] = parse_visualizations(hit['_source'])
+    elif object_type == 'visualization':
+        formatted['searches'] = hit['_source'].get('savedSearchId', '')
 
-    response = requests.get(url)
-    visualizations = json.loads(response.text).get('hits', {}).get('hits', {})
+    return formatted
 
-    visualizations = [
-        dict(name=viz['_id'],
-             source=viz['_source'],
-             searches=viz['_source'].get('savedSearchId', '')
-             ) for viz in visualizations
-        ]
+def get_dashboards(cluster, page_size=None):
+    """
+    GET all the saved dashboards, page by page
 
-    return visualizations
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of dictionaries
+    """
+    for db in scroll_search(cluster, 'dashboard', page_size=page_size):
+        yield format_object('dashboard', db)
 
-def get_searches(cluster):
+def get_visualizations(cluster, page_size=None):
     """
-    GET all the saved searches
+    GET all the saved visualizations, page by page
 
-    :param cluster: cluster details
-    :return: list of dictionaries
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of dictionaries
     """
-    url = 'http://{ip_address}:{port}/{index}/search/_search'.format(
-        ip_address=cluster['ip_address'],
-        port=cluster['port'],
-        index=cluster['index'],
-    )
+    for viz in scroll_search(cluster, 'visualization', page_size=page_size):
+        yield format_object('visualization', viz)
 
-    response = requests.get(url)
-    searches = json.loads(response.text).get('hits', {}).get('hits', {})
+def get_searches(cluster, page_size=None):
+    """
+    GET all the saved searches, page by page
 
-    searches = [
-        dict(name=search['_id'],
-             source=search['_source']
-             ) for search in searches
-        ]
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of dictionaries
+    """
+    for search in scroll_search(cluster, 'search', page_size=page_size):
+        yield format_object('search', search)
 
-    return searches
+def iter_saved_hits(cluster, page_size=None):
+    """
+    GET the hits of the dashboards, visualizations and searches together,
+    with a single search of the index filtered on their types rather than one
+    search per type
 
-def save_all_types(cluster, output_directory):
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of hits
     """
-    Collect all the relevants types and save them to an output directory
+    query = {'terms': {'_type': SAVED_OBJECT_TYPES}}
+    for hit in scroll_search(cluster, page_size=page_size, query=query):
+        if hit['_type'] in SAVED_OBJECT_TYPES:
+            yield hit
 
-    :param cluster: cluster details
+def iter_all_types(cluster, page_size=None):
+    """
+    GET the dashboards, visualizations and searches together, with a single
+    search of the index
+
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of (type, dictionary)
+    """
+    for hit in iter_saved_hits(cluster, page_size=page_size):
+        yield hit['_type'], format_object(hit['_type'], hit)
+
+def get_all_types(cluster, page_size=None):
+    """
+    GET all the dashboards, visualizations and searches in one pass
+
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: dictionary of lists of dictionaries, keyed by type
+    """
+    save_all = dict((save_type, []) for save_type in SAVED_OBJECT_TYPES)
+    for save_type, objects in iter_all_types(cluster, page_size=page_size):
+        save_all[save_type].append(objects)
+
+    return save_all
+
+def save_all_types(cluster, output_directory, page_size=None):
+    """
+    Collect all the relevants types and save them to an output directory. The
+    objects are written as they are fetched, so only one of them is held in
+    memory at a time.
+
+    :param cluster: cluster details or client
     :param output_directory: path to output directory
+    :param page_size: number of hits requested per page
     """
 
     # Make the output directory
     if not os.path.isdir(output_directory):
         os.mkdir(output_directory)
 
-    save_all = dict(
-        dashboard=get_dashboards(cluster=cluster),
-        visualization=get_visualizations(cluster=cluster),
-        search=get_searches(cluster=cluster)
+    logger.info('Saving dashboard content to: {0}'.format(output_directory))
+    client = ClusterClient.from_cluster(cluster)
+    for hit in iter_saved_hits(client, page_size=page_size):
+        write_object(
+            output_directory,
+            hit['_type'],
+            dict(name=hit['_id'], source=hit['_source'])
+        )
+
+def iter_types_in_load_order(cluster, page_size=None):
+    """
+    GET the searches, visualizations and dashboards with one search per
+    type, so that they come out in the order they must be loaded
+
+    :param cluster: cluster details or client
+    :param page_size: number of hits requested per page
+    :return: generator of (type, name, source)
+    """
+    for save_type in SAVED_OBJECT_TYPES:
+        for hit in scroll_search(cluster, save_type, page_size=page_size):
+            yield save_type, hit['_id'], hit['_source']
+
+def save_bundle(cluster, output_file, page_size=None, codec=None, level=None):
+    """
+    Collect all the relevant types and save them to a single bundle file,
+    rather than one file per object. The objects are streamed into the
+    bundle as they are fetched, in load order.
+
+    :param cluster: cluster details or client
+    :param output_file: path of the bundle, compressed according to its
+    extension, e.g., .ndjson.gz
+    :param page_size: number of hits requested per page
+    :param codec: codec to compress with, from the extension by default
+    :param level: compression level, the codec's default if None
+    :return: number of objects saved
+    """
+    logger.info('Saving dashboard content to bundle: {0}'.format(output_file))
+    client = ClusterClient.from_cluster(cluster)
+    return bundle.write_bundle(
+        output_file,
+        iter_types_in_load_order(client, page_size=page_size),
+        codec=codec,
+        level=level,
+        index=client.index
     )
 
-    logger.info('Saving dashboard content to: {0}'.format(output_directory))
-    for save_type in save_all:
+def pack_bundle(input_directory, output_file, codec=None, level=None):
+    """
+    Convert a directory of saved objects into a bundle
+
+    :param input_directory: directory that contains all types
+    :param output_file: path of the bundle
+    :param codec: codec to compress with, from the extension by default
+    :param level: compression level, the codec's default if None
+    :return: number of objects packed
+    """
+    if not os.path.isdir(input_directory):
+        raise IOError('Folder does not exist')
+
+    def iter_files():
+        for save_type in SAVED_OBJECT_TYPES:
+            files = glob.glob('{0}/{1}/*.json'.format(input_directory,
+                                                      save_type))
+            for file_object in sorted(files):
+                with open(file_object, 'rb') as input_json_file:
+                    source = jsoncodec.loads(input_json_file.read())
+                name = os.path.basename(file_object)[:-len('.json')]
+                yield save_type, name, source
+
+    return bundle.write_bundle(output_file, iter_files(), codec=codec,
+                               level=level)
+
+def unpack_bundle(input_file, output_directory):
+    """
+    Convert a bundle into a directory of saved objects, laid out as
+    save_all_types does
+
+    :param input_file: path of the bundle
+    :param output_directory: path to output directory
+    :return: number of objects unpacked
+    """
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
 
-        # Skip this if there are no objects
-        if len(save_all[save_type]) == 0:
+    unpacked = 0
+    for save_type, name, source in bundle.iter_bundle(input_file):
+        write_object(output_directory, save_type, dict(name=name,
+                                                       source=source))
+        unpacked += 1
+    return unpacked
+
+def discover_indices(cluster, patterns):
+    """
+    Find the kibana indices matching names or patterns with _cat/indices,
+    e.g., the .kibana_<tenant> index of every tenant. Each name or pattern is
+    listed on its own, as elasticsearch answers 404 for the whole request if
+    any index it names does not exist.
+
+    :param cluster: cluster details or client
+    :param patterns: list of names or patterns of indices, e.g., .kibana_*
+    :return: list of index names, the biggest first
+    """
+    client = ClusterClient.from_cluster(cluster)
+    rows = {}
+    for pattern in patterns:
+        with metrics.phase('fetch'):
+            response = client.get(
+                '_cat/indices/{0}'.format(pattern),
+                params={'format': 'json', 'h': 'index,docs.count'}
+            )
+
+        # An index named rather than matched by a pattern may not exist
+        if response.status_code == 404:
+            logger.warning('No index matches: {0}'.format(pattern))
             continue
+        response.raise_for_status()
+
+        for row in jsoncodec.loads(response.content):
+            rows[row['index']] = int(row.get('docs.count') or 0)
+
+    return sorted(rows, key=lambda index: (-rows[index], index))
+
+def save_indices(cluster, output_directory, indices, page_size=None,
+                 workers=None, incremental=False):
+    """
+    Save the types of many kibana indices in parallel, each to its own
+    subtree of the output directory, named after the index. The indices are
+    started biggest first, so the run takes about as long as the biggest.
+
+    :param cluster: cluster details or client
+    :param output_directory: path to output directory
+    :param indices: list of index names
+    :param page_size: number of hits requested per page
+    :param workers: number of indices saved at once
+    :param incremental: if only the objects that changed should be saved
+    :return: dictionary of the indices saved and the errors by index
+    """
+    from requests.exceptions import RequestException
+
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
 
-        # If the folder does not exist
-        sub_folder = '{path}/{sub_path}'.format(
-            path=output_directory,
-            sub_path=save_type
+    client = ClusterClient.from_cluster(cluster)
+    save = save_changed_types if incremental else save_all_types
+    summary = dict(saved=[], failed={})
+
+    logger.info('Saving {0} indices'.format(len(indices)))
+    with ThreadPoolExecutor(
+            max_workers=workers or config.INDEX_WORKERS) as executor:
+        futures = dict(
+            (executor.submit(
+                save,
+                client.for_index(index),
+                os.path.join(output_directory, index),
+                page_size
+            ), index)
+            for index in indices
         )
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                future.result()
+                summary['saved'].append(index)
+            except (RequestException, IOError, ValueError) as error:
+                logger.warning('Could not save index {0}: {1}'
+                               .format(index, error))
+                summary['failed'][index] = str(error)
+
+    summary['saved'].sort()
+    logger.info('Saved {0} indices, {1} failed'.format(
+        len(summary['saved']),
+        len(summary['failed'])
+    ))
+    return summary
+
+def object_path(output_directory, save_type, name):
+    """
+    Path of the file an object is saved to
+
+    :param output_directory: path to output directory
+    :param save_type: type of the object: dashboard, visualization, search
+    :param name: name of object
+    :return: path
+    """
+    return '{path}/{sub_path}/{file}.json'.format(
+        path=output_directory,
+        sub_path=save_type,
+        file=name
+    )
 
-        if not os.path.isdir(sub_folder):
-            os.mkdir(sub_folder)
+def write_object(output_directory, save_type, objects):
+    """
+    Save an object to its file in the output directory
+
+    :param output_directory: path to output directory
+    :param save_type: type of the object: dashboard, visualization, search
+    :param objects: dictionary of the object, with its name and source
+    """
 
+    # If the folder does not exist, only made once there are objects
+    sub_folder = '{path}/{sub_path}'.format(
+        path=output_directory,
+        sub_path=save_type
+    )
+    if not os.path.isdir(sub_folder):
         logger.info('Saving files for type: {0}'.format(save_type))
-        for objects in save_all[save_type]:
-            output_file = '{path}{sub_path}/{file}.json'.format(
-                path=output_directory,
-                sub_path=save_type,
-                file=objects['name']
+        os.mkdir(sub_folder)
+
+    output_file = object_path(output_directory, save_type, objects['name'])
+    with metrics.phase('write'):
+        content = jsoncodec.dumps(objects['source'])
+        with open(output_file, 'wb') as output_json:
+            output_json.write(content)
+        metrics.count_objects(save_type)
+        metrics.add_bytes('disk', len(content))
+
+    logger.info('...... file object: {0}'.format(objects['name']))
+
+def read_manifest(output_directory):
+    """
+    Read the manifest of the objects saved in the output directory
+
+    :param output_directory: path to output directory
+    :return: dictionary of version and hash, keyed by type/name
+    """
+    manifest_file = os.path.join(output_directory, config.MANIFEST_FILE)
+    if not os.path.isfile(manifest_file):
+        return {}
+
+    with open(manifest_file, 'r') as manifest_json:
+        return json.load(manifest_json)
+
+def write_manifest(output_directory, manifest):
+    """
+    Write the manifest of the objects saved in the output directory. It is
+    replaced in one step, so an interrupted save never leaves half of it.
+
+    :param output_directory: path to output directory
+    :param manifest: dictionary of version and hash, keyed by type/name
+    """
+    manifest_file = os.path.join(output_directory, config.MANIFEST_FILE)
+    with open(manifest_file + '.tmp', 'w') as manifest_json:
+        json.dump(manifest, manifest_json, sort_keys=True)
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+def save_changed_types(cluster, output_directory, page_size=None):
+    """
+    Incrementally save all the relevant types to an output directory. Only
+    the versions of the objects are searched for, and compared against the
+    manifest of the previous save; the new or changed objects are then
+    fetched with _mget, and the ones deleted in the cluster are removed from
+    disk.
+
+    :param cluster: cluster details or client
+    :param output_directory: path to output directory
+    :param page_size: number of hits requested per page
+    :return: dictionary of the number of new, changed, deleted and unchanged
+    objects
+    """
+
+    # Make the output directory
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
+
+    logger.info('Updating dashboard content in: {0}'.format(output_directory))
+    client = ClusterClient.from_cluster(cluster)
+    manifest = read_manifest(output_directory)
+    summary = dict(new=0, changed=0, deleted=0, unchanged=0)
+
+    versions = {}
+    for hit in scroll_search(
+            client,
+            page_size=page_size,
+            query={'terms': {'_type': SAVED_OBJECT_TYPES}},
+            source=False,
+            version=True):
+        if hit['_type'] in SAVED_OBJECT_TYPES:
+            key = '{0}/{1}'.format(hit['_type'], hit['_id'])
+            versions[key] = hit.get('_version')
+
+    fetch = []
+    for key, version in versions.items():
+        save_type, name = key.split('/', 1)
+        saved = manifest.get(key)
+        if saved is None or version is None or \
+                saved['version'] != version or \
+                not os.path.isfile(object_path(output_directory, save_type,
+                                               name)):
+            fetch.append((save_type, name))
+        else:
+            summary['unchanged'] += 1
+
+    for hit in mget_objects(client, fetch):
+        key = '{0}/{1}'.format(hit['_type'], hit['_id'])
+        digest = content_hash(hit['_source'])
+        saved = manifest.get(key)
+
+        if saved is None:
+            summary['new'] += 1
+        elif saved['hash'] == digest and os.path.isfile(
+                object_path(output_directory, hit['_type'], hit['_id'])):
+            # Only the version was bumped, the file is still up to date
+            summary['unchanged'] += 1
+            manifest[key] = dict(version=hit.get('_version'), hash=digest)
+            continue
+        else:
+            summary['changed'] += 1
+
+        write_object(
+            output_directory,
+            hit['_type'],
+            dict(name=hit['_id'], source=hit['_source'])
+        )
+        manifest[key] = dict(version=hit.get('_version'), hash=digest)
+
+    for key in [key for key in manifest if key not in versions]:
+        save_type, name = key.split('/', 1)
+        output_file = object_path(output_directory, save_type, name)
+        if os.path.isfile(output_file):
+            os.remove(output_file)
+        del manifest[key]
+        summary['deleted'] += 1
+        logger.info('...... removed object: {0}'.format(name))
+
+    write_manifest(output_directory, manifest)
+    logger.info('Saved {new} new and {changed} changed objects, removed '
+                '{deleted}, {unchanged} unchanged'.format(**summary))
+    return summary
+
+def export_dashboards(cluster, output_directory, selectors, page_size=None):
+    """
+    Save the selected dashboards to an output directory, along with every
+    visualization and search they depend on. The dashboards, then their
+    visualizations, then the searches, are each fetched with _mget, rather
+    than searching through all the objects of every type.
+
+    :param cluster: cluster details or client
+    :param output_directory: path to output directory
+    :param selectors: names of dashboards, or patterns matching their titles,
+    e.g., Web*
+    :param page_size: number of hits requested per page when matching titles
+    :return: dictionary of the names saved, and the ones that could not be
+    found, by type
+    """
+
+    # Make the output directory
+    if not os.path.isdir(output_directory):
+        os.mkdir(output_directory)
+
+    client = ClusterClient.from_cluster(cluster)
+    summary = dict(
+        (save_type, dict(saved=[], missing=[]))
+        for save_type in SAVED_OBJECT_TYPES
+    )
+
+    names = [name for name in selectors if not is_pattern(name)]
+    patterns = [pattern for pattern in selectors if is_pattern(pattern)]
+    if patterns:
+        for hit in scroll_search(client, 'dashboard', page_size=page_size,
+                                 source=['title']):
+            title = hit.get('_source', {}).get('title', '')
+            if any(fnmatch.fnmatchcase(title, p) for p in patterns):
+                names.append(hit['_id'])
+
+    wanted = dict(
+        dashboard=set(names),
+        visualization=set(),
+        search=set()
+    )
+    logger.info('Exporting dashboards to: {0}'.format(output_directory))
+    for save_type in reversed(SAVED_OBJECT_TYPES):
+        found = set()
+        for hit in mget_objects(client, [(save_type, name)
+                                         for name in sorted(wanted[save_type])]):
+            found.add(hit['_id'])
+            write_object(
+                output_directory,
+                save_type,
+                dict(name=hit['_id'], source=hit['_source'])
             )
-            with open(output_file, 'w') as output_json:
-                json.dump(objects['source'], output_json)
 
-            logger.info('...... file object: {0}'.format(objects['name']))
+            if save_type == 'dashboard':
+                for panel_type, name in parse_panels(hit['_source']):
+                    if panel_type in wanted:
+                        wanted[panel_type].add(name)
+            elif save_type == 'visualization' and \
+                    hit['_source'].get('savedSearchId'):
+                wanted['search'].add(hit['_source']['savedSearchId'])
+
+        summary[save_type]['saved'] = sorted(found)
+        summary[save_type]['missing'] = sorted(wanted[save_type] - found)
+        for name in summary[save_type]['missing']:
+            logger.warning('Missing {0}: {1}'.format(save_type, name))
+
+    return summary
+
+def is_pattern(selector):
+    """
+    Check if a selector is a pattern rather than the name of an object
+
+    :param selector: name or pattern
+    :return: boolean
+    """
+    return any(character in selector for character in '*?[')
 
 def push_object(cluster, push_type, push_name, push_source):
     """
     Push an object to the elasticsearch cluster
 
-    :param cluster: cluster details
+    :param cluster: cluster details or client
     :param push_type: type of the object: dashboard, visualization, search
     :param push_name: name of object
-    :param push_source: source of object
+    :param push_source: source of object, or RawJSON sent as it is
 
     :return: response message from elasticsearch
     """
-    url = 'http://{ip_address}:{port}/{index}/{type}/{name}'.format(
-        ip_address=cluster['ip_address'],
-        port=cluster['port'],
-        index=cluster['index'],
-        type=push_type,
-        name=push_name
-    )
-    response = requests.post(url, data=json.dumps(push_source))
+    client = ClusterClient.from_cluster(cluster)
+    with metrics.phase('push'):
+        response = client.post(
+            client.index_path(push_type, push_name),
+            data=jsoncodec.dumps(push_source)
+        )
     return response
 
-def push_all_from_disk(cluster, input_directory):
+def read_object(data, path, raw=False):
+    """
+    Read a saved object from the JSON it was saved as
+
+    :param data: JSON of the object, as bytes
+    :param path: path of the file the object was saved to
+    :param raw: if the JSON should be passed through as RawJSON, to be sent
+    as it is rather than decoded and encoded again; the object is then named
+    by its file, the id it was saved under, rather than by its title
+    :return: tuple of the name and source of the object
+    """
+    if raw:
+        name = os.path.basename(path)[:-len('.json')]
+        return name, jsoncodec.RawJSON(data.strip())
+
+    push_source = jsoncodec.loads(data)
+    return push_source['title'], push_source
+
+def iter_objects_from_disk(input_directory, raw=False):
     """
     Look at the input_directory for expected folders:
       - search, visualization, dashboard
-    And push any JSON file that exists inside to elasticsearch
+    And read any JSON file that exists inside, in the order they must be
+    loaded
 
-    :param cluster: cluster details
     :param input_directory: directory that contains all types
+    :param raw: if the sources should be passed through as RawJSON
+    :return: generator of (type, name, source)
     """
 
     if not os.path.isdir(input_directory):
@@ -201,7 +807,7 @@ def push_all_from_disk(cluster, input_directory):
 
     logger.info('Using folder: {0}'.format(input_directory))
 
-    for push_type in ['search', 'visualization', 'dashboard']:
+    for push_type in SAVED_OBJECT_TYPES:
         sub_path = '{path}/{sub_path}'.format(
             path=input_directory,
             sub_path=push_type
@@ -215,91 +821,720 @@ def push_all_from_disk(cluster, input_directory):
 
         logger.info('Pushing files for type: {0}'.format(push_type))
         for file_object in files:
-            with open(file_object, 'r') as input_json_file:
-                push_source = json.load(input_json_file)
+            with open(file_object, 'rb') as input_json_file:
+                push_name, push_source = read_object(input_json_file.read(),
+                                                     file_object, raw=raw)
 
-            push_name = push_source['title']
-            response = push_object(
-                cluster=cluster,
-                push_type=push_type,
-                push_name=push_name,
-                push_source=push_source
+            yield push_type, push_name, push_source
+
+def iter_objects_from_bundle(input_file):
+    """
+    Read the objects out of a bundle as a stream, to be loaded without
+    touching the disk
+
+    :param input_file: path of the bundle
+    :return: generator of (type, name, source), in load order
+    """
+    return order_objects(
+        (push_type, push_source['title'], push_source)
+        for push_type, _, push_source in bundle.iter_bundle(input_file)
+    )
+
+def iter_changed_objects(cluster, objects, counts, batch_size=None):
+    """
+    Filter out the objects that the cluster already holds an identical copy
+    of. The current objects are fetched in batches with _mget and their
+    content hashes compared against the ones to push.
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name, source), in load order
+    :param counts: dictionary in which the number of created, updated and
+    unchanged objects is counted
+    :param batch_size: maximum number of objects fetched per request
+    :return: generator of the (type, name, source) to push, in load order
+    """
+    client = ClusterClient.from_cluster(cluster)
+    batch_size = batch_size or config.ES_MGET_SIZE
+    for state in ['created', 'updated', 'unchanged']:
+        counts.setdefault(state, 0)
+
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, batch_size))
+        if not batch:
+            break
+
+        current = dict(
+            ((hit['_type'], hit['_id']), content_hash(hit['_source']))
+            for hit in mget_objects(
+                client,
+                [(push_type, push_name) for push_type, push_name, _ in batch],
+                batch_size=batch_size
             )
+        )
+
+        for push_type, push_name, push_source in batch:
+            digest = current.get((push_type, push_name))
+            if digest is None:
+                counts['created'] += 1
+            elif digest != content_hash(push_source):
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+                continue
+
+            yield push_type, push_name, push_source
+
+def push_objects(cluster, objects):
+    """
+    Push objects to elasticsearch one at a time. Writes that elasticsearch
+    rejects because it is overloaded are retried.
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name, source), in load order
+    :return: dictionary of the number pushed and the errors by object name
+    """
+    client = ClusterClient.from_cluster(cluster)
+    scheduler = WriteScheduler(max_in_flight=1)
+    summary = dict(pushed=0, failed={})
+
+    for push_type, push_name, push_source in objects:
+        response = scheduler.write(
+            push_object,
+            cluster=client,
+            push_type=push_type,
+            push_name=push_name,
+            push_source=push_source
+        )
 
-            logger.info('....... file object: {0}'.format(push_name))
+        logger.info('....... file object: {0}'.format(push_name))
+        if response.status_code >= 300:
+            summary['failed'][push_name] = response.text
+        else:
+            summary['pushed'] += 1
             logger.info('Response from ES: {0}'.format(response))
 
-def s3_upload_file(input_file, s3_bucket, s3_object):
+    return summary
+
+def concurrent_push_objects(cluster, objects, workers=None, scheduler=None):
+    """
+    Push objects to elasticsearch on a pool of threads. The objects of one
+    type do not depend on each other, so they are pushed in parallel, but
+    each type is finished before the next starts, so that the objects they
+    refer to already exist. The number of writes in flight is adapted to
+    what elasticsearch accepts, up to the number of workers.
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name, source), in load order
+    :param workers: maximum number of objects pushed at once
+    :param scheduler: WriteScheduler adapting the writes in flight
+    :return: dictionary of the number pushed, the errors by object name and
+    the statistics of the scheduler
+    """
+    from requests.exceptions import RequestException
+
+    client = ClusterClient.from_cluster(cluster)
+    workers = workers or config.LOAD_WORKERS
+    scheduler = scheduler or WriteScheduler(max_in_flight=workers)
+    summary = dict(pushed=0, failed={})
+
+    for push_type, stage in itertools.groupby(objects, key=lambda o: o[0]):
+        pushed, failed = summary['pushed'], len(summary['failed'])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict(
+                (executor.submit(
+                    scheduler.write,
+                    push_object,
+                    cluster=client,
+                    push_type=push_type,
+                    push_name=push_name,
+                    push_source=push_source
+                ), push_name) for _, push_name, push_source in stage
+            )
+
+            for future in as_completed(futures):
+                push_name = futures[future]
+                try:
+                    response = future.result()
+                except RequestException as error:
+                    summary['failed'][push_name] = str(error)
+                    continue
+
+                if response.status_code >= 300:
+                    summary['failed'][push_name] = response.text
+                else:
+                    summary['pushed'] += 1
+
+        logger.info('Pushed {0} objects of type: {1}, {2} failed'.format(
+            summary['pushed'] - pushed,
+            push_type,
+            len(summary['failed']) - failed
+        ))
+
+    summary['scheduler'] = scheduler.stats()
+    return summary
+
+def iter_bulk_batches(index, objects, batch_size=None, batch_bytes=None):
+    """
+    Group objects into NDJSON bodies for the _bulk API. A batch is bounded by
+    the number of objects and its size in bytes, and never mixes two types,
+    so that the load order is kept
+
+    :param index: name of the index the objects are pushed to
+    :param objects: iterable of (type, name, source)
+    :param batch_size: maximum number of objects in a batch
+    :param batch_bytes: maximum size of a batch in bytes
+    :return: generator of (list of names, NDJSON body)
+    """
+    batch_size = batch_size or config.ES_BULK_SIZE
+    batch_bytes = batch_bytes or config.ES_BULK_BYTES
+
+    names, lines, size, batch_type = [], [], 0, None
+    for push_type, push_name, push_source in objects:
+        action = jsoncodec.dumps({
+            'index': {
+                '_index': index,
+                '_type': push_type,
+                '_id': push_name
+            }
+        })
+        document = jsoncodec.dumps(push_source)
+        # A line of its own in the body, even if the JSON it was saved as
+        # spans many lines
+        if b'\n' in document:
+            document = jsoncodec.dumps(jsoncodec.decoded(push_source))
+        item_size = len(action) + len(document) + 2
+
+        if names and (push_type != batch_type
+                      or len(names) >= batch_size
+                      or size + item_size > batch_bytes):
+            yield names, b''.join(lines)
+            names, lines, size = [], [], 0
+
+        batch_type = push_type
+        names.append(push_name)
+        lines.extend([action, b'\n', document, b'\n'])
+        size += item_size
+
+    if names:
+        yield names, b''.join(lines)
+
+def bulk_push_objects(cluster, objects, batch_size=None, batch_bytes=None):
+    """
+    Push objects to elasticsearch in batches with the _bulk API, and collect
+    the errors reported for each object
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name, source), in load order
+    :param batch_size: maximum number of objects in a batch
+    :param batch_bytes: maximum size of a batch in bytes
+    :return: dictionary of the number pushed and the errors by object name
+    """
+    client = ClusterClient.from_cluster(cluster)
+    summary = dict(pushed=0, failed={})
+
+    batches = iter_bulk_batches(
+        index=client.index,
+        objects=objects,
+        batch_size=batch_size,
+        batch_bytes=batch_bytes
+    )
+    for names, body in batches:
+        with metrics.phase('push'):
+            response = client.post(
+                '_bulk',
+                data=body,
+                headers={'Content-Type': 'application/x-ndjson'}
+            )
+        record_bulk_response(summary, names, response.status_code,
+                             response.text)
+
+        logger.info('Bulk pushed {0} objects'.format(len(names)))
+
+    return summary
+
+def record_bulk_response(summary, names, status_code, text):
+    """
+    Count the objects of a batch pushed with the _bulk API, and collect the
+    errors reported for each of them
+
+    :param summary: dictionary of the number pushed and the errors by object
+    name, updated in place
+    :param names: names of the objects of the batch
+    :param status_code: HTTP status code of the response
+    :param text: body of the response
+    """
+    # The whole batch was refused
+    if status_code >= 300:
+        for name in names:
+            summary['failed'][name] = text
+        return
+
+    items = jsoncodec.loads(text).get('items', [])
+    for name, item in zip(names, items):
+        result = list(item.values())[0]
+        if 'error' in result:
+            summary['failed'][name] = result['error']
+        else:
+            summary['pushed'] += 1
+
+def load_objects(cluster, objects, bulk=False, workers=None,
+                 batch_size=None, batch_bytes=None, skip_unchanged=False):
+    """
+    Load objects into elasticsearch, one at a time, concurrently, or with
+    the _bulk API
+
+    :param cluster: cluster details or client
+    :param objects: iterable of (type, name, source), in load order
+    :param bulk: push the objects with the _bulk API
+    :param workers: push this many objects at once, rather than one at a
+    time
+    :param batch_size: maximum number of objects in a bulk batch
+    :param batch_bytes: maximum size of a bulk batch in bytes
+    :param skip_unchanged: only push the objects missing from the cluster or
+    different to the ones it holds
+    :return: dictionary of the number pushed and the errors by object name,
+    along with the number of created, updated and unchanged objects when
+    skipping unchanged ones, and the statistics of the scheduler when pushing
+    concurrently
+    """
+    client = ClusterClient.from_cluster(cluster)
+
+    counts = {}
+    if skip_unchanged:
+        objects = iter_changed_objects(client, objects, counts)
+    objects = metrics.iter_counted(objects, phase='push')
+
+    if bulk:
+        summary = bulk_push_objects(
+            cluster=client,
+            objects=objects,
+            batch_size=batch_size,
+            batch_bytes=batch_bytes
+        )
+    elif workers:
+        summary = concurrent_push_objects(
+            cluster=client,
+            objects=objects,
+            workers=workers
+        )
+    else:
+        summary = push_objects(cluster=client, objects=objects)
+    summary.update(counts)
+
+    for push_name, error in summary['failed'].items():
+        logger.error('....... failed object: {0}: {1}'.format(push_name, error))
+    logger.info('Pushed {0} objects, {1} failed'.format(
+        summary['pushed'],
+        len(summary['failed'])
+    ))
+    if 'scheduler' in summary:
+        logger.info(
+            '{0} rejections, at {1:.1f} objects/s with {2} in flight'.format(
+                summary['scheduler']['rejected'],
+                summary['scheduler']['rate'],
+                summary['scheduler']['in_flight']
+            )
+        )
+    if skip_unchanged:
+        logger.info('Created {created}, updated {updated}, '
+                    '{unchanged} unchanged'.format(**counts))
+
+    return summary
+
+def push_all_from_disk(cluster, input_directory, skip_unchanged=False):
+    """
+    Look at the input_directory for expected folders:
+      - search, visualization, dashboard
+    And push any JSON file that exists inside to elasticsearch
+
+    :param cluster: cluster details or client
+    :param input_directory: directory that contains all types
+    :param skip_unchanged: only push the objects missing from the cluster or
+    different to the ones it holds
+    :return: dictionary of the number pushed and the errors by object name
+    """
+    return load_objects(
+        cluster=cluster,
+        objects=iter_objects_from_disk(input_directory),
+        skip_unchanged=skip_unchanged
+    )
+
+def concurrent_push_all_from_disk(cluster, input_directory, workers=None,
+                                  skip_unchanged=False):
     """
-    Upload file to S3 storage. Similar to the s3.upload_file, however, that
-    does not work nicely with moto, whereas this function does.
+    Push every JSON file of the input_directory to elasticsearch, with the
+    objects of each type pushed in parallel
 
-    :param input_file: file to upload
-    :param s3_bucket: bucket to upload to
-    :param s3_object: name of the object in the bucket
+    :param cluster: cluster details or client
+    :param input_directory: directory that contains all types
+    :param workers: maximum number of objects pushed at once
+    :param skip_unchanged: only push the objects missing from the cluster or
+    different to the ones it holds
+    :return: dictionary of the number pushed, the errors by object name and
+    the statistics of the scheduler
     """
+    return load_objects(
+        cluster=cluster,
+        objects=iter_objects_from_disk(input_directory),
+        workers=workers or config.LOAD_WORKERS,
+        skip_unchanged=skip_unchanged
+    )
 
-    s3_resource = boto3.resource('s3')
+def bulk_push_all_from_disk(cluster, input_directory, batch_size=None,
+                            batch_bytes=None, skip_unchanged=False):
+    """
+    Push every JSON file of the input_directory to elasticsearch with the
+    _bulk API, rather than one request per object
 
-    with open(input_file, 'rb') as f:
-        binary = f.read()
+    :param cluster: cluster details or client
+    :param input_directory: directory that contains all types
+    :param batch_size: maximum number of objects in a batch
+    :param batch_bytes: maximum size of a batch in bytes
+    :param skip_unchanged: only push the objects missing from the cluster or
+    different to the ones it holds
+    :return: dictionary of the number pushed and the errors by object name
+    """
+    return load_objects(
+        cluster=cluster,
+        objects=iter_objects_from_disk(input_directory),
+        bulk=True,
+        batch_size=batch_size,
+        batch_bytes=batch_bytes,
+        skip_unchanged=skip_unchanged
+    )
 
-    s3_resource.Bucket(s3_bucket).put_object(
-        Key=s3_object,
-        Body=binary
+def snapshot_key(name, codec=None):
+    """
+    Key, in the AWS S3 bucket, of the tarball of a snapshot
+
+    :param name: name of the snapshot, a timestamp, or its full key
+    :param codec: codec the tarball is compressed with
+    :return: key
+    """
+    if any(name.endswith(ext) for ext in archive.EXTENSIONS.values()):
+        return name
+    return '{0}dashboard-{1}{2}'.format(
+        config.S3_SNAPSHOT_PREFIX,
+        name,
+        archive.extension(codec or config.ARCHIVE_CODEC)
     )
 
+def resolve_snapshot(s3_details):
+    """
+    Find the key of the tarball to pull: the snapshot asked for, whatever
+    codec it was compressed with, otherwise the latest one, read from its
+    pointer with a single small GET rather than listing the bucket
+
+    :param s3_details: details about AWS S3
+    :return: key
+    """
+    import boto3
+    from botocore.exceptions import ClientError
+
+    s3_client = boto3.client('s3')
+    name = s3_details.get('snapshot')
+    if name:
+        key = snapshot_key(name)
+        if key == name:
+            return key
+
+        # The extension is not known from the name, so the snapshot is
+        # looked up by its prefix
+        prefix = key[:-len(archive.extension(config.ARCHIVE_CODEC))] + '.'
+        listed = s3_client.list_objects_v2(
+            Bucket=s3_details['bucket'],
+            Prefix=prefix
+        ).get('Contents', [])
+        keys = [item['Key'] for item in listed
+                if item['Key'][len(prefix) - 1:] in
+                archive.EXTENSIONS.values()]
+        if not keys:
+            raise IOError('No snapshot named {0} in {1}'.format(
+                name, s3_details['bucket']))
+        return keys[0]
+
+    try:
+        pointer = s3_client.get_object(
+            Bucket=s3_details['bucket'],
+            Key=config.S3_LATEST_KEY
+        )['Body'].read()
+    except ClientError as error:
+        if error.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+        return config.S3_LEGACY_KEY
+
+    return json.loads(pointer.decode('utf-8'))['key']
+
+def archive_folders(input_directory):
+    """
+    Folders to archive, with their names in the archive. The types are
+    archived in load order, so they can be loaded as they are streamed back
+    out of the archive, and so are the types of each index subtree saved by
+    save_indices.
+
+    :param input_directory: input directory
+    :return: list of (path, name in the archive)
+    """
+    def list_folders(directory):
+        # Listed rather than globbed, as index names start with a dot
+        folders = [os.path.join(directory, name)
+                   for name in os.listdir(directory)]
+        return sorted(
+            [folder for folder in folders if os.path.isdir(folder)],
+            key=load_order
+        )
+
+    def load_order(folder):
+        name = os.path.basename(folder)
+        if name in SAVED_OBJECT_TYPES:
+            return SAVED_OBJECT_TYPES.index(name), name
+        return len(SAVED_OBJECT_TYPES), name
+
+    folders = []
+    for folder in list_folders(input_directory):
+        name = os.path.basename(folder)
+        sub_folders = list_folders(folder)
+        if name not in SAVED_OBJECT_TYPES and sub_folders and all(
+                os.path.basename(sub) in SAVED_OBJECT_TYPES
+                for sub in sub_folders):
+            folders.extend(
+                (sub, '{0}/{1}'.format(name, os.path.basename(sub)))
+                for sub in sub_folders
+            )
+        else:
+            folders.append((folder, name))
+    return folders
+
 def push_to_s3(input_directory, s3_details):
     """
-    Push the files on disk to S3 storage
+    Push the files on disk to S3 storage, as a new timestamped snapshot, and
+    point the latest pointer at it. The tarball is compressed with the codec
+    chosen and streamed straight into a multipart upload, rather than made on
+    disk first.
 
     :param input_directory: input directory
     :param s3_details: details about AWS S3
+    :return: key of the snapshot
     """
-    tar_file = '/tmp/dashboard.tar.gz'
-    folders = glob.glob('{0}/*'.format(input_directory))
-    with tarfile.open(tar_file, 'w:gz') as out_tar:
-        for folder in folders:
-            out_tar.add(folder, arcname=folder.split('/')[-1])
-    logger.info('Made a gzipped tarbarball: {0}'.format(tar_file))
+    import boto3
+    import tarfile
 
-    s3_upload_file(tar_file, s3_details['bucket'], 'dashboard.tar.gz')
+    folders = archive_folders(input_directory)
+    codec = s3_details.get('codec') or config.ARCHIVE_CODEC
+    s3_object = snapshot_key(snapshots.snapshot_name(), codec)
 
     logger.info('Pushing to S3 storage: {0}'.format(s3_details['bucket']))
-    os.remove('/tmp/dashboard.tar.gz')
+    with transfer.MultipartUploadWriter(
+            s3_details['bucket'],
+            s3_object,
+            part_size=s3_details.get('part_size'),
+            concurrency=s3_details.get('concurrency')) as upload:
+        with archive.open_writer(
+                codec,
+                upload,
+                level=s3_details.get('level', config.ARCHIVE_LEVEL)) \
+                as compressed:
+            with metrics.phase('archive'), \
+                    tarfile.open(fileobj=compressed, mode='w|') as out_tar:
+                for folder, arcname in folders:
+                    out_tar.add(folder, arcname=arcname)
+                    metrics.count_objects(
+                        os.path.basename(folder),
+                        len(glob.glob('{0}/*.json'.format(folder)))
+                    )
+    metrics.add_bytes('compressed', upload.bytes, phase='archive')
+
+    logger.info('Streamed a {0} tarball of {1} bytes at {2:.1f} MB/s'.format(
+        codec,
+        upload.stats()['bytes'],
+        upload.stats()['rate']
+    ))
+
+    boto3.client('s3').put_object(
+        Bucket=s3_details['bucket'],
+        Key=config.S3_LATEST_KEY,
+        Body=json.dumps({'key': s3_object}).encode('utf-8')
+    )
+    logger.info('Latest snapshot: {0}'.format(s3_object))
 
-def s3_download_file(s3_bucket, s3_object, output_file):
+    return s3_object
+
+def prune_snapshots(s3_details, keep):
     """
-    Download file from S3 bucket. Similar to s3.download_file except that does
-    not play nicely with moto, this however, does.
+    Delete all but the newest snapshots in S3 storage. The snapshots are
+    listed once, and deleted in batches with delete_objects; the one the
+    latest pointer refers to is always kept.
 
-    :param s3_bucket: bucket to download from
-    :param s3_object: object to download
-    :param output_file: file to download to
+    :param s3_details: details about AWS S3
+    :param keep: number of snapshots to keep
+    :return: list of the keys deleted
     """
+    import boto3
+
+    s3_client = boto3.client('s3')
+    latest = resolve_snapshot(dict(bucket=s3_details['bucket']))
+
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3_details['bucket'],
+                                   Prefix=config.S3_SNAPSHOT_PREFIX):
+        keys.extend(
+            item['Key'] for item in page.get('Contents', [])
+            if item['Key'] != config.S3_LATEST_KEY
+        )
 
-    s3_resource = boto3.resource('s3')
-    body = s3_resource.Object(s3_bucket, s3_object).get()['Body']
-    with open(output_file, 'wb') as f:
-        for chunk in iter(lambda: body.read(1024), b''):
-            f.write(chunk)
+    # Timestamped names sort oldest first
+    keys.sort()
+    expired = [key for key in keys[:max(len(keys) - keep, 0)]
+               if key != latest]
+
+    for start in range(0, len(expired), 1000):
+        s3_client.delete_objects(
+            Bucket=s3_details['bucket'],
+            Delete={
+                'Objects': [{'Key': key}
+                            for key in expired[start:start + 1000]],
+                'Quiet': True
+            }
+        )
+
+    logger.info('Pruned {0} snapshots, keeping {1}'.format(
+        len(expired),
+        len(keys) - len(expired)
+    ))
+    return expired
+
+def open_s3_archive(s3_details):
+    """
+    Open the tarball in S3 storage as a stream, that is read straight from
+    parallel byte-range downloads rather than downloaded to disk first, and
+    decompressed with the codec detected from its first bytes
+
+    :param s3_details: details about AWS S3, with the snapshot to open, the
+    latest by default
+    :return: TarFile, to be iterated over, and the RangedReader it reads
+    """
+    import tarfile
+
+    download = transfer.RangedReader(
+        s3_details['bucket'],
+        resolve_snapshot(s3_details),
+        part_size=s3_details.get('part_size'),
+        concurrency=s3_details.get('concurrency')
+    )
+    tar_file = tarfile.open(
+        fileobj=archive.open_reader(download),
+        mode='r|',
+        bufsize=s3_details.get('read_size') or config.S3_READ_SIZE
+    )
+    return tar_file, download
+
+def is_safe_member(member):
+    """
+    Check that a member of a tarball is a plain file or folder that stays
+    inside the directory it is extracted to
+
+    :param member: TarInfo
+    :return: boolean
+    """
+    if not (member.isfile() or member.isdir()):
+        return False
+    name = os.path.normpath(member.name)
+    return not (os.path.isabs(name) or name.split(os.sep)[0] == '..')
 
 def pull_from_s3(output_directory, s3_details):
     """
-    Pull files from S3 storage and unpack
+    Pull files from S3 storage and unpack them as they are downloaded
 
     :param output_directory: output directory
     :param s3_details: details about AWS S3
     """
 
     logger.info('Pulling file from S3 storage: {0}'.format(s3_details['bucket']))
-    s3_download_file(s3_details['bucket'], 'dashboard.tar.gz', '/tmp/dashboard.tar.gz')
-
     logger.info('Opening tar file to: {0}'.format(output_directory))
-    tar_file = tarfile.open('/tmp/dashboard.tar.gz', 'r')
-    tar_file.extractall(output_directory)
+    tar_file, download = open_s3_archive(s3_details)
+    with download, tar_file, metrics.phase('extract'):
+        for member in tar_file:
+            if not is_safe_member(member):
+                logger.warning('Skipping tar member: {0}'.format(member.name))
+                continue
+            tar_file.extract(member, output_directory)
+            if member.isfile():
+                metrics.count_objects(member.name.split('/')[-2]
+                                      if '/' in member.name else 'other')
+                metrics.add_bytes('disk', member.size)
+
+    logger.info('Downloaded {bytes} bytes at {rate:.1f} MB/s'
+                .format(**download.stats()))
+
+def order_objects(objects):
+    """
+    Put a stream of objects in load order. The objects of a type are
+    contiguous in a tarball, so a type is complete once another starts, and
+    only the objects that arrive before the types they depend on are held
+    back. A stream already in load order is passed straight through.
 
-    os.remove('/tmp/dashboard.tar.gz')
+    :param objects: iterable of (type, name, source)
+    :return: generator of (type, name, source), in load order
+    """
+    held = dict((push_type, []) for push_type in SAVED_OBJECT_TYPES)
+    complete = set()
+    expected = 0
+    current = None
+
+    for objects_tuple in objects:
+        push_type = objects_tuple[0]
+        if push_type != current:
+            if current is not None:
+                complete.add(current)
+            current = push_type
+
+        # Load the objects held back for the types now expected
+        while expected < len(SAVED_OBJECT_TYPES) and \
+                SAVED_OBJECT_TYPES[expected] in complete:
+            expected += 1
+            if expected < len(SAVED_OBJECT_TYPES):
+                for held_tuple in held[SAVED_OBJECT_TYPES[expected]]:
+                    yield held_tuple
+                held[SAVED_OBJECT_TYPES[expected]] = []
+
+        if SAVED_OBJECT_TYPES.index(push_type) <= expected:
+            yield objects_tuple
+        else:
+            held[push_type].append(objects_tuple)
+
+    for push_type in SAVED_OBJECT_TYPES:
+        for held_tuple in held[push_type]:
+            yield held_tuple
+
+def iter_objects_from_s3(s3_details, raw=False):
+    """
+    Read the objects straight out of the tarball in S3 storage, as it
+    is downloaded, without unpacking it to disk
+
+    :param s3_details: details about AWS S3
+    :param raw: if the sources should be passed through as RawJSON
+    :return: generator of (type, name, source), in load order
+    """
+    def iter_members():
+        tar_file, download = open_s3_archive(s3_details)
+        with download, tar_file:
+            for member in tar_file:
+                push_type = member.name.split('/')[0]
+                if not member.isfile() or push_type not in SAVED_OBJECT_TYPES:
+                    continue
+
+                push_name, push_source = read_object(
+                    tar_file.extractfile(member).read(),
+                    member.name,
+                    raw=raw
+                )
+                yield push_type, push_name, push_source
+
+    logger.info('Streaming objects from S3 storage: {0}'
+                .format(s3_details['bucket']))
+    return order_objects(iter_members())
 
 if __name__ == '__main__':
 
@@ -310,7 +1545,7 @@ if __name__ == '__main__':
         '-d',
         '--directory',
         dest='directory',
-        required=True,
+        default=None,
         help='directory to save/load the dashboard',
         type=str
     )
@@ -318,9 +1553,19 @@ if __name__ == '__main__':
         '-a',
         '--action',
         dest='action',
-        choices=['save', 'load'],
+        choices=['save', 'load', 'pack', 'unpack'],
         required=True,
-        help='save/load dashboard to/from file',
+        help='save/load dashboard to/from file, or pack/unpack the directory '
+             'to/from a bundle',
+        type=str
+    )
+    parser.add_argument(
+        '-b',
+        '--bundle',
+        dest='bundle',
+        default=None,
+        help='save/load the dashboard to/from a single NDJSON file rather '
+             'than the directory, compressed if it ends in .gz, .xz or .zst',
         type=str
     )
     parser.add_argument(
@@ -331,6 +1576,75 @@ if __name__ == '__main__':
         action='store_true',
         help='save/load the dashboard to/from AWS S3'
     )
+    parser.add_argument(
+        '--stream',
+        default=False,
+        dest='stream',
+        action='store_true',
+        help='load the dashboard straight out of AWS S3, without unpacking '
+             'it to the directory'
+    )
+    parser.add_argument(
+        '--store',
+        dest='store',
+        default=None,
+        help='save/load the dashboard as a deduplicated snapshot in a store: '
+             's3://bucket/prefix or a local directory',
+        type=str
+    )
+    parser.add_argument(
+        '--snapshot',
+        dest='snapshot',
+        default=None,
+        help='name of the snapshot to load, the latest by default',
+        type=str
+    )
+    parser.add_argument(
+        '--keep',
+        dest='keep',
+        default=None,
+        help='number of snapshots to keep in AWS S3 after saving',
+        type=int
+    )
+    parser.add_argument(
+        '--report',
+        dest='report',
+        default=None,
+        help='write the metrics of each phase of the run to this JSON file',
+        type=str
+    )
+    parser.add_argument(
+        '--prometheus',
+        dest='prometheus',
+        default=None,
+        help='write the metrics of the run to this Prometheus textfile, for '
+             'the textfile collector of the node exporter',
+        type=str
+    )
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        help='profile the run with cProfile, dump the stats to this file, '
+             'and list the slowest functions by cumulative time',
+        type=str
+    )
+    parser.add_argument(
+        '--trace-malloc',
+        default=False,
+        dest='trace_malloc',
+        action='store_true',
+        help='trace allocations, and log the peak memory and top allocation '
+             'sites of each phase'
+    )
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        default=None,
+        help='write a timeline of the phases of the run to this file, as '
+             'Chrome trace-event JSON',
+        type=str
+    )
     parser.add_argument(
         '--cluster-ip',
         dest='cluster_ip',
@@ -352,6 +1666,23 @@ if __name__ == '__main__':
         help='elasticsearch kibana index name',
         type=str
     )
+    parser.add_argument(
+        '--indices',
+        dest='indices',
+        action='append',
+        default=None,
+        help='save every kibana index matching the names or patterns, e.g., '
+             '.kibana_*, each to its own folder of the directory; can be '
+             'repeated or comma-separated',
+        type=str
+    )
+    parser.add_argument(
+        '--index-workers',
+        dest='index_workers',
+        default=config.INDEX_WORKERS,
+        help='number of indices saved at once',
+        type=int
+    )
     parser.add_argument(
         '--s3-bucket',
         dest='s3_bucket',
@@ -359,41 +1690,277 @@ if __name__ == '__main__':
         help='S3 bucket name',
         type=str
     )
+    parser.add_argument(
+        '--s3-part-size',
+        dest='s3_part_size',
+        default=config.S3_PART_SIZE,
+        help='size in bytes of the parts transferred to/from S3',
+        type=int
+    )
+    parser.add_argument(
+        '--s3-concurrency',
+        dest='s3_concurrency',
+        default=config.S3_CONCURRENCY,
+        help='number of parts transferred to/from S3 at once',
+        type=int
+    )
+    parser.add_argument(
+        '--codec',
+        dest='codec',
+        default=config.ARCHIVE_CODEC,
+        choices=archive.available_codecs(),
+        help='compression of the tarball saved to S3; pgz compresses gzip '
+             'in parallel on every core. Loads detect it by themselves',
+        type=str
+    )
+    parser.add_argument(
+        '--compress-level',
+        dest='compress_level',
+        default=config.ARCHIVE_LEVEL,
+        help='compression level, the default of the codec if not given',
+        type=int
+    )
+    parser.add_argument(
+        '--s3-read-size',
+        dest='s3_read_size',
+        default=config.S3_READ_SIZE,
+        help='size in bytes of the reads of archives downloaded from S3',
+        type=int
+    )
+    parser.add_argument(
+        '--page-size',
+        dest='page_size',
+        default=config.ES_PAGE_SIZE,
+        help='number of objects fetched per request when saving',
+        type=int
+    )
+    parser.add_argument(
+        '--pool-size',
+        dest='pool_size',
+        default=config.ES_POOL_SIZE,
+        help='maximum number of kept-alive connections to elasticsearch',
+        type=int
+    )
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        default=config.ES_READ_TIMEOUT,
+        help='seconds to wait for a response from elasticsearch',
+        type=float
+    )
+    parser.add_argument(
+        '--bulk',
+        default=False,
+        dest='bulk',
+        action='store_true',
+        help='load the dashboard with the elasticsearch _bulk API'
+    )
+    parser.add_argument(
+        '--bulk-size',
+        dest='bulk_size',
+        default=config.ES_BULK_SIZE,
+        help='maximum number of objects sent per _bulk request',
+        type=int
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        default=None,
+        help='number of objects pushed at once when loading',
+        type=int
+    )
+    parser.add_argument(
+        '--incremental',
+        default=False,
+        dest='incremental',
+        action='store_true',
+        help='only save the objects that changed since the last save'
+    )
+    parser.add_argument(
+        '--dashboard',
+        dest='dashboards',
+        default=[],
+        action='append',
+        help='only save this dashboard, by name or title pattern, along with '
+             'the objects it depends on; can be repeated',
+        type=str
+    )
+    parser.add_argument(
+        '--raw',
+        default=False,
+        dest='raw',
+        action='store_true',
+        help='load the objects as the JSON they were saved as, rather than '
+             'decoding and encoding them again; each object is loaded under '
+             'the name of its file, the id it was saved under, not its title'
+    )
+    parser.add_argument(
+        '--skip-unchanged',
+        default=False,
+        dest='skip_unchanged',
+        action='store_true',
+        help='only load the objects that differ from the ones in the cluster'
+    )
 
     args = parser.parse_args()
 
+    if args.indices and (args.action != 'save' or args.bundle or
+                         args.dashboards or args.store):
+        parser.error('--indices can only save whole indices to a directory, '
+                     'or to AWS S3')
+    if args.bundle and (args.s3 or args.store):
+        parser.error('--bundle cannot be combined with --s3 or --store')
+    if args.action in ['pack', 'unpack'] and not args.bundle:
+        parser.error('--bundle is required to pack/unpack')
+    if not args.directory and (not args.bundle or
+                               args.action in ['pack', 'unpack']):
+        parser.error('--directory is required')
+
+    configure_logging()
+
+    # The profilers are only imported when one of them is switched on
+    profiler = None
+    if args.profile or args.trace_malloc or args.trace:
+        import atexit
+        import profiling
+
+        profiler = profiling.Profiler(
+            profile=args.profile,
+            trace_malloc=args.trace_malloc,
+            trace=args.trace
+        )
+        try:
+            profiler.start()
+        except ValueError as error:
+            parser.error('--trace-malloc is not supported: {0}'.format(error))
+        atexit.register(profiler.stop)
+
     # Create some dictionaries that are needed
-    cluster = dict(
-        ip_address=args.cluster_ip,
-        port=args.cluster_port,
-        index=args.cluster_index
+    cluster = ClusterClient(
+        cluster=dict(
+            ip_address=args.cluster_ip,
+            port=args.cluster_port,
+            index=args.cluster_index
+        ),
+        pool_size=max(args.pool_size, args.workers or 0,
+                      args.index_workers if args.indices else 0),
+        timeout=(config.ES_CONNECT_TIMEOUT, args.timeout)
     )
 
     s3_details = dict(
         bucket=args.s3_bucket,
+        part_size=args.s3_part_size,
+        concurrency=args.s3_concurrency,
+        read_size=args.s3_read_size,
+        snapshot=args.snapshot,
+        codec=args.codec,
+        level=args.compress_level
     )
 
     # If the user wants to save the dashboard
     if args.action == 'save':
-        save_all_types(
-            cluster=cluster,
-            output_directory=args.directory
-        )
+        if args.indices:
+            save_indices(
+                cluster=cluster,
+                output_directory=args.directory,
+                indices=discover_indices(
+                    cluster=cluster,
+                    patterns=[pattern for patterns in args.indices
+                              for pattern in patterns.split(',')]
+                ),
+                page_size=args.page_size,
+                workers=args.index_workers,
+                incremental=args.incremental
+            )
+        elif args.bundle:
+            save_bundle(
+                cluster=cluster,
+                output_file=args.bundle,
+                page_size=args.page_size
+            )
+        elif args.dashboards:
+            export_dashboards(
+                cluster=cluster,
+                output_directory=args.directory,
+                selectors=args.dashboards,
+                page_size=args.page_size
+            )
+        elif args.incremental:
+            save_changed_types(
+                cluster=cluster,
+                output_directory=args.directory,
+                page_size=args.page_size
+            )
+        else:
+            save_all_types(
+                cluster=cluster,
+                output_directory=args.directory,
+                page_size=args.page_size
+            )
+        # If the dashboard should be snapshot to a store
+        if args.store:
+            snapshots.SnapshotStore(
+                snapshots.open_store(args.store),
+                concurrency=args.s3_concurrency
+            ).save(input_directory=args.directory)
         # If the dashboard should be saved to s3
         if args.s3:
             push_to_s3(
                 input_directory=args.directory,
                 s3_details=s3_details
             )
+            if args.keep:
+                prune_snapshots(s3_details=s3_details, keep=args.keep)
     # If the user wants to load the dashboard
     elif args.action == 'load':
+        # If the dashboard should be loaded from a bundle
+        if args.bundle:
+            objects = iter_objects_from_bundle(args.bundle)
+        # If the dashboard should be restored from a store snapshot
+        elif args.store:
+            snapshots.SnapshotStore(
+                snapshots.open_store(args.store),
+                concurrency=args.s3_concurrency
+            ).restore(output_directory=args.directory, name=args.snapshot)
+            objects = iter_objects_from_disk(args.directory, raw=args.raw)
         # If the dashboard should be loaded from s3
-        if args.s3:
+        elif args.s3 and args.stream:
+            objects = iter_objects_from_s3(s3_details=s3_details,
+                                           raw=args.raw)
+        elif args.s3:
             pull_from_s3(
                 output_directory=args.directory,
                 s3_details=s3_details
             )
-        push_all_from_disk(
+            objects = iter_objects_from_disk(args.directory, raw=args.raw)
+        else:
+            objects = iter_objects_from_disk(args.directory, raw=args.raw)
+
+        load_objects(
             cluster=cluster,
-            input_directory=args.directory
+            objects=objects,
+            bulk=args.bulk,
+            workers=args.workers,
+            batch_size=args.bulk_size,
+            skip_unchanged=args.skip_unchanged
+        )
+    elif args.action == 'pack':
+        pack_bundle(input_directory=args.directory, output_file=args.bundle)
+    elif args.action == 'unpack':
+        unpack_bundle(input_file=args.bundle, output_directory=args.directory)
+
+    if profiler is not None:
+        profiler.stop()
+
+    if args.report or args.prometheus:
+        report = metrics.report(
+            action=args.action,
+            cluster=cluster.base_url,
+            index=args.cluster_index
         )
+        if profiler is not None and profiler.memory is not None:
+            report['memory'] = profiler.memory
+        if args.report:
+            metrics.write_report(args.report, report)
+        if args.prometheus:
+            metrics.write_textfile(args.prometheus, report)
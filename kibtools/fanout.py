@@ -0,0 +1,321 @@
+# encoding: utf-8
+"""
+Fan-out of a dashboard load to many elasticsearch clusters at once
+
+The export is read once, and its _bulk bodies built once, then pushed to every
+cluster concurrently with asyncio, with a limit on the requests in flight to
+each cluster. The clusters do not wait on one another: a slow or unreachable
+cluster only delays, or fails, its own load, so the whole fan-out takes about
+as long as the slowest cluster. Requires Python 3 and aiohttp.
+"""
+
+import sys
+import time
+import random
+import config
+import asyncio
+import logging
+import argparse
+import itertools
+import dashboard
+
+from scheduler import is_rejected_status
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger()
+
+def parse_cluster(spec, index=None):
+    """
+    Parse the details of a cluster given as host[:port][/index]
+
+    :param spec: host, optionally followed by a port and an index
+    :param index: index used if the spec does not name one
+    :return: cluster details
+    """
+    spec, _, spec_index = spec.partition('/')
+    ip_address, _, port = spec.partition(':')
+    return dict(
+        ip_address=ip_address,
+        port=port or '9200',
+        index=spec_index or index or '.kibana'
+    )
+
+def cluster_name(cluster):
+    """
+    Name of a cluster in the reports
+
+    :param cluster: cluster details
+    :return: host:port/index
+    """
+    return '{ip_address}:{port}/{index}'.format(**cluster)
+
+def build_groups(index, objects, batch_size=None, batch_bytes=None):
+    """
+    Build the _bulk bodies of the objects for an index, grouped by type, so
+    that each group is pushed once the previous one is loaded
+
+    :param index: name of the index the objects are pushed to
+    :param objects: list of (type, name, source), in load order
+    :param batch_size: maximum number of objects in a batch
+    :param batch_bytes: maximum size of a batch in bytes
+    :return: list of lists of (list of names, NDJSON body), in load order
+    """
+    groups = []
+    for _, group in itertools.groupby(objects, key=lambda o: o[0]):
+        groups.append(list(dashboard.iter_bulk_batches(
+            index=index,
+            objects=group,
+            batch_size=batch_size,
+            batch_bytes=batch_bytes
+        )))
+    return groups
+
+async def push_batch(session, url, names, body, semaphore, summary):
+    """
+    Push a batch to a cluster, retrying it while the cluster rejects it with
+    a jittered exponential backoff
+
+    :param session: aiohttp session of the cluster
+    :param url: URL of the _bulk API of the cluster
+    :param names: names of the objects of the batch
+    :param body: NDJSON body
+    :param semaphore: limit on the requests in flight to the cluster
+    :param summary: summary of the cluster, updated in place
+    """
+    for attempt in range(config.WRITE_MAX_RETRIES + 1):
+        async with semaphore:
+            started = time.time()
+            async with session.post(url, data=body) as response:
+                status_code = response.status
+                text = await response.text()
+            latency = time.time() - started
+
+        summary['requests'] += 1
+        summary['latency'] += latency
+        summary['max_latency'] = max(summary['max_latency'], latency)
+
+        if not is_rejected_status(status_code, text) or \
+                attempt == config.WRITE_MAX_RETRIES:
+            break
+
+        summary['retries'] += 1
+        await asyncio.sleep(random.uniform(
+            0,
+            min(config.WRITE_MAX_BACKOFF, config.WRITE_BACKOFF * 2 ** attempt)
+        ))
+
+    dashboard.record_bulk_response(summary, names, status_code, text)
+
+async def push_cluster(cluster, groups, concurrency=None, timeout=None):
+    """
+    Push the groups of batches to one cluster, group after group, with the
+    batches of a group sent concurrently
+
+    :param cluster: cluster details
+    :param groups: batches grouped by type, in load order
+    :param concurrency: maximum number of requests in flight to the cluster
+    :param timeout: seconds to wait for the response to a request
+    :return: summary of the cluster: the number pushed, the errors by object
+    name, the requests sent and retried, their mean and maximum latency, the
+    seconds taken, and the error that stopped the load, if any
+    """
+    concurrency = concurrency or config.FANOUT_CONCURRENCY
+    summary = dict(
+        cluster=cluster_name(cluster),
+        pushed=0,
+        failed={},
+        requests=0,
+        retries=0,
+        latency=0.0,
+        max_latency=0.0,
+        seconds=0.0,
+        error=None
+    )
+    url = 'http://{ip_address}:{port}/_bulk'.format(**cluster)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    started = time.time()
+    try:
+        async with aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=concurrency),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=config.ES_CONNECT_TIMEOUT,
+                    sock_read=timeout or config.ES_READ_TIMEOUT
+                ),
+                headers={'Content-Type': 'application/x-ndjson'}) as session:
+            for batches in groups:
+                results = await asyncio.gather(*[
+                    push_batch(session, url, names, body, semaphore, summary)
+                    for names, body in batches
+                ], return_exceptions=True)
+
+                # Stop, rather than load objects whose dependencies failed
+                errors = [r for r in results if isinstance(r, Exception)]
+                if errors:
+                    raise errors[0]
+    except Exception as error:
+        # Whatever fails one cluster, e.g., a response that is not JSON, must
+        # not fail the fan-out to the others
+        summary['error'] = str(error) or error.__class__.__name__
+        logger.warning('Fan-out to {0} failed: {1}'
+                       .format(summary['cluster'], summary['error']))
+
+    summary['seconds'] = time.time() - started
+    if summary['requests']:
+        summary['latency'] /= summary['requests']
+    return summary
+
+def fan_out(clusters, objects, concurrency=None, batch_size=None,
+            batch_bytes=None, timeout=None):
+    """
+    Load the same objects into many clusters concurrently. The objects are
+    read once, and the _bulk bodies built once per index name.
+
+    :param clusters: list of cluster details
+    :param objects: iterable of (type, name, source), in load order
+    :param concurrency: maximum number of requests in flight to each cluster
+    :param batch_size: maximum number of objects in a batch
+    :param batch_bytes: maximum size of a batch in bytes
+    :param timeout: seconds to wait for the response to a request
+    :return: list of the summaries of the clusters, in the order given
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required to fan out to many clusters')
+
+    objects = list(objects)
+    groups = {}
+    for cluster in clusters:
+        if cluster['index'] not in groups:
+            groups[cluster['index']] = build_groups(
+                cluster['index'],
+                objects,
+                batch_size=batch_size,
+                batch_bytes=batch_bytes
+            )
+
+    async def push_all():
+        return await asyncio.gather(*[
+            push_cluster(
+                cluster,
+                groups[cluster['index']],
+                concurrency=concurrency,
+                timeout=timeout
+            )
+            for cluster in clusters
+        ])
+
+    started = time.time()
+    summaries = asyncio.run(push_all())
+
+    for summary in summaries:
+        logger.info('{cluster}: pushed {pushed}, {0} failed, in {seconds:.2f}s, '
+                    '{latency:.3f}s mean latency'.format(len(summary['failed']),
+                                                         **summary))
+    logger.info('Fanned out {0} objects to {1} clusters in {2:.2f}s'.format(
+        len(objects), len(clusters), time.time() - started
+    ))
+    return summaries
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Load a saved dashboard into many clusters at once.'
+    )
+    parser.add_argument(
+        '-d',
+        '--directory',
+        dest='directory',
+        default=None,
+        help='directory the dashboard was saved to',
+        type=str
+    )
+    parser.add_argument(
+        '-b',
+        '--bundle',
+        dest='bundle',
+        default=None,
+        help='bundle the dashboard was saved to, instead of a directory',
+        type=str
+    )
+    parser.add_argument(
+        '-c',
+        '--cluster',
+        dest='clusters',
+        action='append',
+        required=True,
+        help='cluster to load, as host[:port][/index]; can be repeated',
+        type=str
+    )
+    parser.add_argument(
+        '--cluster-index',
+        dest='cluster_index',
+        default='.kibana',
+        help='elasticsearch kibana index name, when a cluster does not give '
+             'one',
+        type=str
+    )
+    parser.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        default=config.FANOUT_CONCURRENCY,
+        help='number of requests in flight to each cluster',
+        type=int
+    )
+    parser.add_argument(
+        '--bulk-size',
+        dest='bulk_size',
+        default=config.ES_BULK_SIZE,
+        help='number of objects sent per _bulk request',
+        type=int
+    )
+    parser.add_argument(
+        '--raw',
+        default=False,
+        dest='raw',
+        action='store_true',
+        help='load the objects as the JSON they were saved as, rather than '
+             'decoding and encoding them again; each object is loaded under '
+             'the name of its file, the id it was saved under, not its title'
+    )
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        default=config.ES_READ_TIMEOUT,
+        help='seconds to wait for elasticsearch to respond',
+        type=float
+    )
+
+    args = parser.parse_args()
+    dashboard.configure_logging()
+
+    if args.bundle:
+        objects = dashboard.iter_objects_from_bundle(args.bundle)
+    elif args.directory:
+        objects = dashboard.iter_objects_from_disk(args.directory,
+                                                   raw=args.raw)
+    else:
+        parser.error('--directory or --bundle is required')
+
+    summaries = fan_out(
+        clusters=[parse_cluster(spec, args.cluster_index)
+                  for spec in args.clusters],
+        objects=objects,
+        concurrency=args.concurrency,
+        batch_size=args.bulk_size,
+        timeout=args.timeout
+    )
+
+    print('{0:<40}{1:>8}{2:>8}{3:>10}{4:>10}  {5}'.format(
+        'cluster', 'pushed', 'failed', 'seconds', 'latency', 'error'
+    ))
+    for summary in summaries:
+        print('{cluster:<40}{pushed:>8}{0:>8}{seconds:>10.2f}{latency:>10.3f}'
+              '  {1}'.format(len(summary['failed']), summary['error'] or '',
+                             **summary))
+
+    if any(summary['failed'] or summary['error'] for summary in summaries):
+        sys.exit(1)
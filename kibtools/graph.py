@@ -0,0 +1,356 @@
+# encoding: utf-8
+"""
+Graph of the references between saved objects
+"""
+
+import os
+import glob
+import json
+import config
+import hashlib
+import jsoncodec
+import argparse
+import dashboard
+
+from collections import defaultdict
+
+# Version of the cache file format
+CACHE_VERSION = 1
+
+def object_key(object_type, name):
+    """
+    Key of an object in the graph
+
+    :param object_type: type of the object: dashboard, visualization, search
+    :param name: name of object
+    :return: type/name
+    """
+    return '{0}/{1}'.format(object_type, name)
+
+def references(object_type, source):
+    """
+    Find the objects a saved object refers to: the panels of a dashboard, and
+    the saved search of a visualization
+
+    :param object_type: type of the object: dashboard, visualization, search
+    :param source: source of object, or RawJSON
+    :return: list of keys
+    """
+    source = jsoncodec.decoded(source)
+    if object_type == 'dashboard':
+        return [
+            object_key(panel_type, panel_name)
+            for panel_type, panel_name in dashboard.parse_panels(source)
+        ]
+    if object_type == 'visualization' and source.get('savedSearchId'):
+        return [object_key('search', source['savedSearchId'])]
+    return []
+
+class SavedObjectGraph(object):
+    """
+    Forward and reverse adjacency maps of the references between saved
+    objects, so that what an object uses, and what uses it, are looked up
+    without re-parsing any of them
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.nodes = set()
+        self.forward = defaultdict(set)
+        self.reverse = defaultdict(set)
+
+    def add(self, object_type, name, source):
+        """
+        Add an object and its references to the graph
+
+        :param object_type: type of the object: dashboard, visualization, search
+        :param name: name of object
+        :param source: source of object
+        """
+        self.add_references(
+            object_key(object_type, name),
+            references(object_type, source)
+        )
+
+    def add_references(self, key, referenced):
+        """
+        Add an object, by its key, and the keys it refers to
+
+        :param key: key of the object
+        :param referenced: keys of the objects it refers to
+        """
+        self.nodes.add(key)
+        for reference in referenced:
+            self.forward[key].add(reference)
+            self.reverse[reference].add(key)
+
+    @classmethod
+    def from_objects(cls, objects):
+        """
+        Build the graph in one pass over objects, e.g., the output of the
+        getters
+
+        :param objects: iterable of (type, name, source)
+        :return: SavedObjectGraph
+        """
+        graph = cls()
+        for object_type, name, source in objects:
+            graph.add(object_type, name, source)
+        return graph
+
+    @classmethod
+    def from_directory(cls, input_directory):
+        """
+        Build the graph from the files of an export on disk
+
+        :param input_directory: directory that contains all types
+        :return: SavedObjectGraph
+        """
+        graph = cls()
+        for path in export_files(input_directory):
+            object_type = os.path.basename(os.path.dirname(path))
+            name = os.path.basename(path)[:-len('.json')]
+            with open(path, 'rb') as input_json_file:
+                graph.add(object_type, name,
+                          jsoncodec.loads(input_json_file.read()))
+        return graph
+
+    def uses(self, object_type, name):
+        """
+        Objects that an object refers to directly
+
+        :param object_type: type of the object: dashboard, visualization, search
+        :param name: name of object
+        :return: set of keys
+        """
+        return set(self.forward.get(object_key(object_type, name), ()))
+
+    def used_by(self, object_type, name):
+        """
+        Objects that refer directly to an object
+
+        :param object_type: type of the object: dashboard, visualization, search
+        :param name: name of object
+        :return: set of keys
+        """
+        return set(self.reverse.get(object_key(object_type, name), ()))
+
+    def dependents(self, object_type, name):
+        """
+        Every object that would be affected by deleting an object, e.g., the
+        dashboards showing a visualization built on a search
+
+        :param object_type: type of the object: dashboard, visualization, search
+        :param name: name of object
+        :return: set of keys
+        """
+        found = set()
+        queue = [object_key(object_type, name)]
+        while queue:
+            for key in self.reverse.get(queue.pop(), ()):
+                if key not in found:
+                    found.add(key)
+                    queue.append(key)
+        return found
+
+    def orphans(self):
+        """
+        Visualizations and searches that nothing refers to
+
+        :return: set of keys
+        """
+        return set(
+            key for key in self.nodes
+            if not key.startswith('dashboard/') and not self.reverse.get(key)
+        )
+
+    def dangling(self):
+        """
+        References to objects that do not exist
+
+        :return: dictionary of the missing keys, by the key referring to them
+        """
+        missing = {}
+        for key, referenced in self.forward.items():
+            absent = referenced - self.nodes
+            if absent:
+                missing[key] = absent
+        return missing
+
+    def to_dict(self):
+        """
+        Compact representation of the graph: the objects are listed once and
+        references are pairs of their positions
+
+        :return: dictionary
+        """
+        keys = sorted(self.nodes | set(self.reverse))
+        position = dict((key, i) for i, key in enumerate(keys))
+        return dict(
+            version=CACHE_VERSION,
+            keys=keys,
+            nodes=sorted(position[key] for key in self.nodes),
+            edges=sorted(
+                [position[key], position[reference]]
+                for key, referenced in self.forward.items()
+                for reference in referenced
+            )
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a graph from its compact representation
+
+        :param data: dictionary
+        :return: SavedObjectGraph
+        """
+        if data.get('version') != CACHE_VERSION:
+            raise ValueError('Unknown graph cache version: {0}'
+                             .format(data.get('version')))
+
+        keys = data['keys']
+        graph = cls()
+        graph.nodes = set(keys[i] for i in data['nodes'])
+        for i, j in data['edges']:
+            graph.forward[keys[i]].add(keys[j])
+            graph.reverse[keys[j]].add(keys[i])
+        return graph
+
+    def save(self, cache_file, signature=None):
+        """
+        Save the graph to a cache file
+
+        :param cache_file: path of the cache file
+        :param signature: signature of the export the graph was built from
+        """
+        data = self.to_dict()
+        data['signature'] = signature
+        with open(cache_file, 'w') as cache_json:
+            json.dump(data, cache_json, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, cache_file):
+        """
+        Load a graph from a cache file
+
+        :param cache_file: path of the cache file
+        :return: SavedObjectGraph
+        """
+        with open(cache_file, 'r') as cache_json:
+            return cls.from_dict(json.load(cache_json))
+
+def export_files(input_directory):
+    """
+    JSON files of every type in an export on disk
+
+    :param input_directory: directory that contains all types
+    :return: list of paths
+    """
+    files = []
+    for object_type in config.SAVED_OBJECT_TYPES:
+        files.extend(sorted(glob.glob(
+            '{0}/{1}/*.json'.format(input_directory, object_type)
+        )))
+    return files
+
+def export_signature(input_directory):
+    """
+    Signature of an export on disk, that changes when any of its files is
+    added, removed or modified, without reading them. Every file counts, so
+    that restoring older files, whose times are earlier than the cache, is
+    noticed too.
+
+    :param input_directory: directory that contains all types
+    :return: digest of the path, size and modification time of every file
+    """
+    digest = hashlib.sha1()
+    for path in export_files(input_directory):
+        stat = os.stat(path)
+        mtime_ns = getattr(stat, 'st_mtime_ns', None) or \
+            int(stat.st_mtime * 1e9)
+        digest.update('{0}\0{1}\0{2}\n'.format(
+            os.path.relpath(path, input_directory), stat.st_size, mtime_ns
+        ).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_graph(input_directory, cache_file):
+    """
+    Load the graph of an export on disk from its cache file, only re-parsing
+    the export when it changed since the cache was written
+
+    :param input_directory: directory that contains all types
+    :param cache_file: path of the cache file
+    :return: SavedObjectGraph
+    """
+    signature = export_signature(input_directory)
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r') as cache_json:
+            data = json.load(cache_json)
+        if data.get('signature') == signature and \
+                data.get('version') == CACHE_VERSION:
+            return SavedObjectGraph.from_dict(data)
+
+    graph = SavedObjectGraph.from_directory(input_directory)
+    graph.save(cache_file, signature=signature)
+    return graph
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Analyse the references between saved objects.'
+    )
+    parser.add_argument(
+        '-d',
+        '--directory',
+        dest='directory',
+        required=True,
+        help='directory the dashboard was saved to',
+        type=str
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache',
+        default=None,
+        help='graph cache file, by default .graph.json in the directory',
+        type=str
+    )
+    parser.add_argument(
+        '--impact',
+        dest='impact',
+        default=None,
+        help='list the objects affected by deleting type/name',
+        type=str
+    )
+    parser.add_argument(
+        '--orphans',
+        default=False,
+        dest='orphans',
+        action='store_true',
+        help='list the visualizations and searches nothing refers to'
+    )
+    parser.add_argument(
+        '--dangling',
+        default=False,
+        dest='dangling',
+        action='store_true',
+        help='list the references to objects that do not exist'
+    )
+
+    args = parser.parse_args()
+
+    graph = load_graph(
+        args.directory,
+        args.cache or os.path.join(args.directory, '.graph.json')
+    )
+
+    if args.impact:
+        for key in sorted(graph.dependents(*args.impact.split('/', 1))):
+            print(key)
+    if args.orphans:
+        for key in sorted(graph.orphans()):
+            print(key)
+    if args.dangling:
+        for key, missing in sorted(graph.dangling().items()):
+            print('{0} -> {1}'.format(key, ', '.join(sorted(missing))))
@@ -0,0 +1,99 @@
+# encoding: utf-8
+"""
+JSON codec of the saved objects
+
+Objects are decoded from the responses of elasticsearch, encoded to disk,
+decoded from disk, and encoded again into the bodies of the requests that
+load them, so JSON takes a visible share of the CPU of a run. The codec uses
+orjson or ujson when one is installed, and the standard library otherwise.
+Documents are encoded to UTF-8 bytes, as they are written to files and
+request bodies as bytes.
+
+A document that is already encoded can be passed through as RawJSON: it is
+written as it is, rather than decoded and encoded again, and only decoded
+when its content is needed.
+"""
+
+import json
+import config
+import importlib
+
+# Libraries of the codecs, the fastest first
+LIBRARIES = ['orjson', 'ujson', 'json']
+
+class RawJSON(bytes):
+    """
+    Document already encoded as JSON, in UTF-8, passed through untouched
+    """
+    pass
+
+def library(name=None):
+    """
+    Import the library of a codec
+
+    :param name: name of the codec: orjson, ujson or json, the fastest one
+    installed by default
+    :return: tuple of the name and module
+    """
+    if name:
+        try:
+            return name, importlib.import_module(name)
+        except ImportError:
+            raise ValueError('Unavailable JSON codec: {0}'.format(name))
+
+    for name in LIBRARIES:
+        try:
+            return name, importlib.import_module(name)
+        except ImportError:
+            continue
+
+NAME, MODULE = library(config.JSON_CODEC)
+
+def loads(data):
+    """
+    Decode a document
+
+    :param data: JSON, as bytes or text
+    :return: decoded document
+    """
+    if NAME == 'json' and isinstance(data, bytes):
+        data = data.decode('utf-8')
+    try:
+        return MODULE.loads(data)
+    except ValueError:
+        # orjson refuses integers larger than 64 bits
+        if NAME == 'json':
+            raise
+        return json.loads(data)
+
+def dumps(document):
+    """
+    Encode a document, in its compact form. RawJSON is returned untouched.
+
+    :param document: document to encode
+    :return: JSON, as UTF-8 bytes
+    """
+    if isinstance(document, RawJSON):
+        return document
+
+    try:
+        if NAME == 'orjson':
+            return MODULE.dumps(document)
+        elif NAME == 'ujson':
+            return MODULE.dumps(document, ensure_ascii=False,
+                                escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, OverflowError):
+        # Integers larger than 64 bits, again
+        pass
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+def decoded(document):
+    """
+    Content of a document that may be passed through as RawJSON
+
+    :param document: decoded document, or RawJSON
+    :return: decoded document
+    """
+    if isinstance(document, RawJSON):
+        return loads(document)
+    return document
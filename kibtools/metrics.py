@@ -0,0 +1,323 @@
+# encoding: utf-8
+"""
+Per-phase metrics of a run, and its report
+
+The work of a run is split into phases: fetch, write, archive, upload,
+download, extract and push. Each records the time spent in it, the objects it
+handled by type, the bytes it moved, and the HTTP requests it sent, with a
+histogram of their latency. Phases are timed where the work is done, in
+whichever thread does it, and the busy time of concurrent work is summed, so
+the time of a phase can exceed the wall time it spans. At the end of a run,
+the metrics are written as a JSON report, and optionally as a Prometheus
+textfile for the node exporter.
+"""
+
+import os
+import json
+import time
+import config
+import datetime
+import threading
+
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Objects told when a block of a phase begins and ends, with begin(name) and
+# end(name, started, finished), e.g., the profilers of the profiling module
+LISTENERS = []
+
+class Metrics(object):
+    """
+    Thread-safe recorder of the metrics of the phases of a run
+    """
+    def __init__(self, buckets=None):
+        """
+        Constructor
+        :param buckets: upper bounds of the latency histogram, in seconds
+        """
+        self.buckets = tuple(buckets or config.METRICS_LATENCY_BUCKETS)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.phases = {}
+
+    def _phase(self, name):
+        """
+        Metrics of a phase, created on first use. Must hold the lock.
+
+        :param name: name of the phase
+        :return: dictionary
+        """
+        if name not in self.phases:
+            self.phases[name] = dict(
+                seconds=0.0,
+                calls=0,
+                first=None,
+                last=None,
+                objects=defaultdict(int),
+                bytes=defaultdict(int),
+                requests=0,
+                errors=0,
+                latency_sum=0.0,
+                latency_buckets=[0] * (len(self.buckets) + 1)
+            )
+        return self.phases[name]
+
+    def current(self):
+        """
+        Phase the calling thread is in
+
+        :return: name of the phase, or other outside any phase
+        """
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else 'other'
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a block of work as part of a phase. The requests sent by the
+        thread inside the block are counted in the phase.
+
+        :param name: name of the phase
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        self.local.stack.append(name)
+        for listener in LISTENERS:
+            listener.begin(name)
+        started = time.time()
+        try:
+            yield
+        finally:
+            finished = time.time()
+            self.local.stack.pop()
+            for listener in LISTENERS:
+                listener.end(name, started, finished)
+            with self.lock:
+                phase = self._phase(name)
+                phase['seconds'] += finished - started
+                phase['calls'] += 1
+                phase['first'] = started if phase['first'] is None \
+                    else min(phase['first'], started)
+                phase['last'] = finished if phase['last'] is None \
+                    else max(phase['last'], finished)
+
+    def count_objects(self, object_type, count=1, phase=None):
+        """
+        Count objects handled by a phase
+
+        :param object_type: type of the objects
+        :param count: number of objects
+        :param phase: name of the phase, the current one by default
+        """
+        with self.lock:
+            self._phase(phase or self.current())['objects'][object_type] += \
+                count
+
+    def add_bytes(self, kind, count, phase=None):
+        """
+        Count bytes moved by a phase
+
+        :param kind: what the bytes are, e.g., sent, received, disk
+        :param count: number of bytes
+        :param phase: name of the phase, the current one by default
+        """
+        with self.lock:
+            self._phase(phase or self.current())['bytes'][kind] += count
+
+    def observe_request(self, seconds, sent=0, received=0, error=False,
+                        phase=None):
+        """
+        Record an HTTP request
+
+        :param seconds: latency of the request
+        :param sent: bytes sent
+        :param received: bytes received
+        :param error: if the request failed
+        :param phase: name of the phase, the current one by default
+        """
+        bucket = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+
+        with self.lock:
+            metrics = self._phase(phase or self.current())
+            metrics['requests'] += 1
+            metrics['errors'] += int(bool(error))
+            metrics['latency_sum'] += seconds
+            metrics['latency_buckets'][bucket] += 1
+            metrics['bytes']['sent'] += sent
+            metrics['bytes']['received'] += received
+
+    def report(self, **extra):
+        """
+        Report of the run so far
+
+        :param extra: other details of the run to report, e.g., the action
+        :return: dictionary
+        """
+        with self.lock:
+            phases = {}
+            for name, metrics in self.phases.items():
+                cumulative, histogram = 0, {}
+                for bound, count in zip(self.buckets + ('+Inf',),
+                                        metrics['latency_buckets']):
+                    cumulative += count
+                    histogram[str(bound)] = cumulative
+                phases[name] = dict(
+                    seconds=metrics['seconds'],
+                    wall=(metrics['last'] - metrics['first'])
+                    if metrics['calls'] else 0.0,
+                    calls=metrics['calls'],
+                    objects=dict(metrics['objects']),
+                    bytes=dict(metrics['bytes']),
+                    requests=dict(
+                        count=metrics['requests'],
+                        errors=metrics['errors'],
+                        latency_sum=metrics['latency_sum'],
+                        latency_buckets=histogram
+                    )
+                )
+
+        report = dict(
+            started=datetime.datetime.utcfromtimestamp(
+                self.started).isoformat() + 'Z',
+            seconds=time.time() - self.started,
+            phases=phases
+        )
+        report.update(extra)
+        return report
+
+def write_report(path, report):
+    """
+    Write a report as JSON
+
+    :param path: path of the report
+    :param report: report of the run
+    """
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+
+def prometheus_lines(report):
+    """
+    Render a report in the Prometheus text format
+
+    :param report: report of the run
+    :return: list of lines
+    """
+    prefix = config.METRICS_PREFIX
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP {0}_{1} {2}'.format(prefix, name, help_text))
+        lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+        for suffix, labels, value in samples:
+            labels = ','.join('{0}="{1}"'.format(k, v) for k, v in labels)
+            lines.append('{0}_{1}{2}{3} {4}'.format(
+                prefix, name, suffix,
+                '{{{0}}}'.format(labels) if labels else '',
+                value
+            ))
+
+    phases = sorted(report['phases'].items())
+    metric('run_seconds', 'gauge', 'Wall time of the run',
+           [('', [], report['seconds'])])
+    metric('run_timestamp_seconds', 'gauge', 'Time the run finished',
+           [('', [], time.time())])
+    metric('phase_seconds', 'gauge', 'Time spent in the phase',
+           [('', [('phase', name)], p['seconds']) for name, p in phases])
+    metric('phase_objects', 'gauge', 'Objects handled by the phase',
+           [('', [('phase', name), ('type', object_type)], count)
+            for name, p in phases
+            for object_type, count in sorted(p['objects'].items())])
+    metric('phase_bytes', 'gauge', 'Bytes moved by the phase',
+           [('', [('phase', name), ('kind', kind)], count)
+            for name, p in phases
+            for kind, count in sorted(p['bytes'].items())])
+    metric('request_errors', 'gauge', 'HTTP requests of the phase that failed',
+           [('', [('phase', name)], p['requests']['errors'])
+            for name, p in phases])
+
+    samples = []
+    for name, p in phases:
+        requests = p['requests']
+        for bound, count in requests['latency_buckets'].items():
+            samples.append(('_bucket', [('phase', name), ('le', bound)],
+                            count))
+        samples.append(('_sum', [('phase', name)], requests['latency_sum']))
+        samples.append(('_count', [('phase', name)], requests['count']))
+    metric('request_duration_seconds', 'histogram',
+           'Latency of the HTTP requests of the phase', samples)
+
+    return lines
+
+def write_textfile(path, report):
+    """
+    Write a report as a Prometheus textfile. It is written to a temporary
+    file first and renamed, so the node exporter never reads it half-written.
+
+    :param path: path of the textfile, ending in .prom
+    :param report: report of the run
+    """
+    temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temporary, 'w') as textfile:
+        textfile.write('\n'.join(prometheus_lines(report)) + '\n')
+    os.rename(temporary, path)
+
+# Metrics of the current run, recorded by the other modules
+METRICS = Metrics()
+
+def reset():
+    """
+    Start recording a new run
+    """
+    global METRICS
+    METRICS = Metrics()
+
+def phase(name):
+    """
+    Time a block of work as part of a phase of the current run
+
+    :param name: name of the phase
+    """
+    return METRICS.phase(name)
+
+def count_objects(object_type, count=1, phase=None):
+    """
+    Count objects handled by a phase of the current run
+    """
+    METRICS.count_objects(object_type, count=count, phase=phase)
+
+def add_bytes(kind, count, phase=None):
+    """
+    Count bytes moved by a phase of the current run
+    """
+    METRICS.add_bytes(kind, count, phase=phase)
+
+def observe_request(seconds, sent=0, received=0, error=False, phase=None):
+    """
+    Record an HTTP request of the current run
+    """
+    METRICS.observe_request(seconds, sent=sent, received=received,
+                            error=error, phase=phase)
+
+def iter_counted(objects, phase):
+    """
+    Count the objects of a stream in a phase of the current run, by type, as
+    they go through
+
+    :param objects: iterable of (type, name, source)
+    :param phase: name of the phase
+    :return: generator of (type, name, source)
+    """
+    for objects_tuple in objects:
+        METRICS.count_objects(objects_tuple[0], phase=phase)
+        yield objects_tuple
+
+def report(**extra):
+    """
+    Report of the current run
+    """
+    return METRICS.report(**extra)
@@ -0,0 +1,295 @@
+# encoding: utf-8
+"""
+Profiling of a run of the command line
+
+Three profilers can be switched on for a run, and cost nothing when they are
+off:
+
+  - cProfile, dumped to a file for pstats or snakeviz, and summarised sorted
+    by cumulative time. Only the main thread is profiled.
+  - tracemalloc, that records the peak of traced memory of each phase of the
+    metrics, and its top allocation sites at the point the phase held the most.
+    It is imported only when switched on, as Python 2 does not have it.
+  - a timeline of the blocks of each phase, in each thread, as Chrome
+    trace-event JSON, to open in chrome://tracing or Perfetto
+
+The memory and timeline profilers listen to the phases of the metrics module.
+"""
+
+import os
+import sys
+import json
+import time
+import config
+import pstats
+import cProfile
+import logging
+import metrics
+import threading
+
+logger = logging.getLogger()
+
+class ChromeTrace(object):
+    """
+    Timeline of the blocks of each phase, in each thread
+    """
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def begin(self, name):
+        """
+        A block of a phase begins: nothing to do until it ends
+        """
+        pass
+
+    def end(self, name, started, finished):
+        """
+        Record a block of a phase as a complete event
+
+        :param name: name of the phase
+        :param started: time the block started
+        :param finished: time the block finished
+        """
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append(dict(
+                name=name,
+                cat='phase',
+                ph='X',
+                ts=started * 1e6,
+                dur=(finished - started) * 1e6,
+                pid=self.pid,
+                tid=thread.ident
+            ))
+
+    def write(self, path):
+        """
+        Write the timeline as Chrome trace-event JSON
+
+        :param path: path of the trace
+        """
+        with self.lock:
+            events = [
+                dict(name='thread_name', ph='M', pid=self.pid, tid=tid,
+                     args=dict(name=name))
+                for tid, name in self.threads.items()
+            ] + self.events
+
+        with open(path, 'w') as trace_file:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'),
+                      trace_file)
+
+class MallocTracker(object):
+    """
+    Peak of traced memory of each phase, and its top allocation sites. When a
+    block of a phase ends, the peak since the previous block of any phase
+    ended is attributed to it, and the peak is reset. The allocation sites
+    are taken from a snapshot whenever the memory held at the end of a block
+    grows by a tenth over the most the phase held so far, so only a handful
+    of snapshots are taken per phase. Before Python 3.9 the peak cannot be
+    reset, so the peak of each phase is unknown.
+    """
+    def __init__(self, frames=None, top=None):
+        """
+        Constructor
+        :param frames: number of frames kept for each allocation
+        :param top: number of allocation sites reported for each phase
+        :raise ValueError: if tracemalloc is not available
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            raise ValueError('Tracing allocations requires Python 3.4 or '
+                             'later')
+        self.tracemalloc = tracemalloc
+        self.frames = frames or config.TRACEMALLOC_FRAMES
+        self.top = top or config.TRACEMALLOC_TOP
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start tracing allocations
+        """
+        self.tracemalloc.start(self.frames)
+
+    def stop(self):
+        """
+        Stop tracing allocations
+        """
+        self.tracemalloc.stop()
+
+    def begin(self, name):
+        """
+        A block of a phase begins: nothing to do until it ends
+        """
+        pass
+
+    def end(self, name, started, finished):
+        """
+        Attribute the peak of traced memory to a phase, and take a snapshot
+        of its allocation sites if it holds more memory than it ever did
+
+        :param name: name of the phase
+        :param started: time the block started
+        :param finished: time the block finished
+        """
+        tracemalloc = self.tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+
+        with self.lock:
+            current, peak = tracemalloc.get_traced_memory()
+            phase = self.phases.setdefault(
+                name,
+                dict(peak=0, held=0, blocks=0, top=[])
+            )
+            phase['blocks'] += 1
+            if hasattr(tracemalloc, 'reset_peak'):
+                phase['peak'] = max(phase['peak'], peak)
+                tracemalloc.reset_peak()
+            else:
+                # The peak of the whole run so far, rather than of the phase
+                phase['peak'] = None
+
+            if current > phase['held'] * 1.1:
+                phase['held'] = current
+                phase['top'] = self.top_sites()
+
+    def top_sites(self):
+        """
+        Top allocation sites of the memory traced now
+
+        :return: list of dictionaries of the site, bytes and allocations
+        """
+        tracemalloc = self.tracemalloc
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+        return [
+            dict(
+                site='{0}:{1}'.format(stat.traceback[0].filename,
+                                      stat.traceback[0].lineno),
+                bytes=stat.size,
+                count=stat.count
+            )
+            for stat in snapshot.statistics('lineno')[:self.top]
+        ]
+
+    def report(self):
+        """
+        Memory of each phase
+
+        :return: dictionary of the peak bytes, or None if unknown, blocks and
+        top allocation sites, by phase
+        """
+        with self.lock:
+            return dict(
+                (name, dict(phase))
+                for name, phase in self.phases.items()
+            )
+
+class Profiler(object):
+    """
+    Runs the profilers switched on for a run of the command line
+    """
+    def __init__(self, profile=None, trace_malloc=False, trace=None,
+                 limit=None):
+        """
+        Constructor
+        :param profile: path to dump the cProfile stats to, if profiling
+        :param trace_malloc: if allocations should be traced
+        :param trace: path to write the Chrome trace of the phases to
+        :param limit: number of functions listed from the cProfile stats
+        """
+        self.profile = profile
+        self.trace_malloc = trace_malloc
+        self.trace = trace
+        self.limit = limit or config.PROFILE_LIMIT
+
+        self.started = None
+        self.profiler = None
+        self.chrome = None
+        self.malloc = None
+        self.memory = None
+
+    @property
+    def enabled(self):
+        """
+        If any profiler is switched on
+        """
+        return bool(self.profile or self.trace_malloc or self.trace)
+
+    def start(self):
+        """
+        Start the profilers switched on
+
+        :raise ValueError: if allocations cannot be traced
+        """
+        if not self.enabled or self.started is not None:
+            return
+        # Before anything starts, as it fails where tracemalloc is missing
+        if self.trace_malloc:
+            self.malloc = MallocTracker()
+        self.started = time.time()
+
+        if self.trace:
+            self.chrome = ChromeTrace()
+            metrics.LISTENERS.append(self.chrome)
+        if self.malloc is not None:
+            self.malloc.start()
+            metrics.LISTENERS.append(self.malloc)
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        """
+        Stop the profilers, and write what they recorded. Stopping more than
+        once does nothing, so it can also be registered with atexit.
+        """
+        if self.started is None:
+            return
+        started, self.started = self.started, None
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            logger.info('Dumped the profile to: {0}'.format(self.profile))
+            pstats.Stats(self.profiler, stream=sys.stderr) \
+                .sort_stats('cumulative') \
+                .print_stats(self.limit)
+            self.profiler = None
+
+        if self.chrome is not None:
+            metrics.LISTENERS.remove(self.chrome)
+            self.chrome.end('run', started, time.time())
+            self.chrome.write(self.trace)
+            logger.info('Wrote the timeline to: {0}'.format(self.trace))
+            self.chrome = None
+
+        if self.malloc is not None:
+            metrics.LISTENERS.remove(self.malloc)
+            self.memory = self.malloc.report()
+            self.malloc.stop()
+            self.malloc = None
+            for name, phase in sorted(self.memory.items()):
+                logger.info('Memory of {0}: peak {1} over {2} blocks'.format(
+                    name,
+                    'unknown' if phase['peak'] is None
+                    else '{0:.1f} MB'.format(phase['peak'] / 1024.0 / 1024.0),
+                    phase['blocks']
+                ))
+                for site in phase['top']:
+                    logger.info('...... {0}: {1:.1f} KB in {2} blocks'.format(
+                        site['site'], site['bytes'] / 1024.0, site['count']
+                    ))
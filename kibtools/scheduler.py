@@ -0,0 +1,170 @@
+# encoding: utf-8
+"""
+Adaptive scheduling of writes to elasticsearch
+"""
+
+import time
+import random
+import config
+import threading
+
+def is_rejected(response):
+    """
+    Check if elasticsearch refused a write because it is overloaded, rather
+    than because of the object itself
+
+    :param response: response from elasticsearch
+    :return: boolean
+    """
+    return is_rejected_status(response.status_code, response.text)
+
+def is_rejected_status(status_code, text):
+    """
+    Check if elasticsearch refused a write because it is overloaded, from the
+    status code and body of its response
+
+    :param status_code: HTTP status code
+    :param text: body of the response
+    :return: boolean
+    """
+    if status_code in (429, 503):
+        return True
+    return 'es_rejected_execution_exception' in text
+
+class WriteScheduler(object):
+    """
+    Schedules writes to elasticsearch, retrying the ones it rejects with a
+    jittered exponential backoff. The number of writes in flight is adapted
+    AIMD-style: it grows by one for every window of accepted writes and is
+    halved on every rejection, so that loads go as fast as the cluster
+    allows without tuning. Writes that fail for another reason, e.g., a
+    mapping error, leave it as it is.
+    """
+    def __init__(self, max_in_flight=None, initial_in_flight=None,
+                 max_retries=None, backoff=None, max_backoff=None):
+        """
+        Constructor
+        :param max_in_flight: maximum number of writes in flight
+        :param initial_in_flight: number of writes in flight to start with
+        :param max_retries: number of retries of a rejected write
+        :param backoff: base of the backoff between retries, in seconds
+        :param max_backoff: maximum backoff between retries, in seconds
+        """
+        self.max_in_flight = max_in_flight or config.LOAD_WORKERS
+        self.limit = float(min(
+            initial_in_flight or config.WRITE_INITIAL_IN_FLIGHT,
+            self.max_in_flight
+        ))
+        self.max_retries = config.WRITE_MAX_RETRIES \
+            if max_retries is None else max_retries
+        self.backoff = config.WRITE_BACKOFF if backoff is None else backoff
+        self.max_backoff = config.WRITE_MAX_BACKOFF \
+            if max_backoff is None else max_backoff
+
+        self.in_flight = 0
+        self.written = 0
+        self.rejected = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until there is room for another write in flight
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            if self.started is None:
+                self.started = time.time()
+
+    def release(self, rejected=False, written=False):
+        """
+        Finish a write in flight, and adapt the number allowed. A write that
+        was neither rejected nor written failed, and leaves it as it is.
+
+        :param rejected: if the write was rejected by elasticsearch
+        :param written: if the write was accepted by elasticsearch
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.finished = time.time()
+            if rejected:
+                self.rejected += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif written:
+                self.written += 1
+                self.limit = min(
+                    float(self.max_in_flight),
+                    self.limit + 1 / self.limit
+                )
+            else:
+                self.failed += 1
+            self.condition.notify_all()
+
+    def wait_time(self, attempt):
+        """
+        Time to wait before retrying a rejected write, with full jitter so
+        that rejected writes do not all retry at once
+
+        :param attempt: number of the attempt that was rejected, from 0
+        :return: seconds
+        """
+        return random.uniform(
+            0,
+            min(self.max_backoff, self.backoff * 2 ** attempt)
+        )
+
+    def write(self, write_function, *args, **kwargs):
+        """
+        Run a write, retrying it while elasticsearch rejects it
+
+        :param write_function: function sending the write, e.g., push_object
+        :param args: arguments of the function
+        :param kwargs: keyword arguments of the function
+        :return: last response from elasticsearch
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                response = write_function(*args, **kwargs)
+            except Exception:
+                self.release()
+                raise
+
+            rejected = is_rejected(response)
+            self.release(
+                rejected=rejected,
+                written=200 <= response.status_code < 300
+            )
+            if not rejected or attempt == self.max_retries:
+                break
+
+            time.sleep(self.wait_time(attempt))
+
+        return response
+
+    @property
+    def rate(self):
+        """
+        Effective rate of accepted writes, per second
+        """
+        if self.started is None or self.finished <= self.started:
+            return 0.0
+        return self.written / (self.finished - self.started)
+
+    def stats(self):
+        """
+        Summary of the writes scheduled so far
+
+        :return: dictionary
+        """
+        return dict(
+            written=self.written,
+            rejected=self.rejected,
+            failed=self.failed,
+            in_flight=int(self.limit),
+            rate=self.rate
+        )
@@ -0,0 +1,208 @@
+# encoding: utf-8
+"""
+Incremental parser of the responses of the _search, scroll and _mget APIs
+
+The body of a page is parsed as it arrives from response.iter_content, and
+each hit is handed on as soon as it is complete, rather than the whole body
+being read as text, decoded into a dictionary, and its hits copied into
+another list. Only the hit being read is held, so the peak memory is bounded
+by the largest object rather than by the page. The scalars of the objects
+around the items are kept as they are read, by their dotted path, e.g.,
+_scroll_id or hits.total.
+
+The structure around the hits is followed token by token, and each hit is
+decoded in one go by the C scanner of the json module, which also finds
+where it ends. A hit cut short by the end of a chunk is decoded again once
+more of it arrived.
+"""
+
+import re
+import json
+import codecs
+import config
+import metrics
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# What can follow the digits of a number decoded so far, e.g., 1. or 1e
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+class StreamParser(object):
+    """
+    Incremental parser of a response holding an array of items, e.g., the
+    hits of a _search, fed with the chunks of its body as they arrive
+    """
+    def __init__(self, path=('hits', 'hits')):
+        """
+        Constructor
+        :param path: keys of the objects leading to the array of items
+        """
+        self.path = list(path)
+        self.fields = {}
+        self.items = 0
+
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.position = 0
+        self.chunks = []
+        self.pending = 0
+        self.wait = 0
+        # List of [bracket, key] of the containers the parser is in
+        self.stack = []
+        self.expect = 'value'
+
+    def feed(self, data):
+        """
+        Parse the next chunk of the body
+
+        :param data: bytes
+        :return: list of the items the chunk completed
+        """
+        text = self.text.decode(data)
+        self.chunks.append(text)
+        self.pending += len(text)
+
+        # An item cut short is decoded again once the text pending is as
+        # long as what there is of it, rather than after every chunk, so
+        # that a huge one is not decoded over and over
+        if self.pending < self.wait:
+            return []
+        return self._parse(final=False)
+
+    def close(self):
+        """
+        Parse what is left once the whole body was fed
+
+        :return: list of the items left
+        :raise ValueError: if the body is not a complete JSON document
+        """
+        self.chunks.append(self.text.decode(b'', True))
+        items = self._parse(final=True)
+        if self.expect != 'end':
+            raise ValueError('Truncated response')
+        return items
+
+    def iterate(self, response, chunk_size=None):
+        """
+        Parse the body of a response as it is read. It is read and parsed in
+        the fetch phase of the metrics, and closed once done.
+
+        :param response: response of requests, sent with stream=True
+        :param chunk_size: bytes read at a time
+        :return: generator of items
+        """
+        chunks = response.iter_content(chunk_size or config.ES_STREAM_CHUNK)
+        try:
+            while True:
+                with metrics.phase('fetch'):
+                    chunk = next(chunks, None)
+                    items = self.close() if chunk is None else self.feed(chunk)
+                for item in items:
+                    yield item
+                if chunk is None:
+                    break
+        finally:
+            response.close()
+
+    def _in_items(self):
+        """
+        If the next value is an item
+        """
+        return self.stack and self.stack[-1][0] == '[' and \
+            [key for _, key in self.stack[:-1]] == self.path
+
+    def _decode(self, position, final):
+        """
+        Decode the value starting at a position of the buffer
+
+        :param position: where the value starts
+        :param final: if no more data will follow
+        :return: tuple of the value and where it ends, or None if it is cut
+        short
+        """
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, position)
+        except ValueError:
+            if final:
+                raise
+            return None
+
+        # A number could go on in the next chunk, even past a . or e that
+        # the number decoded stopped at
+        if not final and self.buffer[position] in '-0123456789' and \
+                NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer):
+            return None
+        return value, end
+
+    def _value(self, value):
+        """
+        Keep a scalar of the objects around the items, but not of arrays
+        """
+        if all(bracket == '{' for bracket, _ in self.stack):
+            self.fields['.'.join(key for _, key in self.stack)] = value
+        self.expect = 'comma' if self.stack else 'end'
+
+    def _parse(self, final):
+        """
+        Parse as much of the text received as possible
+
+        :param final: if no more data will follow
+        :return: list of the items completed
+        """
+        # Only keep what is not parsed yet
+        self.buffer = u''.join([self.buffer[self.position:]] + self.chunks)
+        self.position, self.chunks, self.pending, self.wait = 0, [], 0, 0
+
+        buffer, items = self.buffer, []
+        while True:
+            position = WHITESPACE.match(buffer, self.position).end()
+            if position == len(buffer):
+                self.position = position
+                break
+            token = buffer[position]
+
+            if self.expect == 'comma' and token == ',':
+                self.expect = 'key' if self.stack[-1][0] == '{' else 'value'
+            elif self.expect == 'colon' and token == ':':
+                self.expect = 'value'
+            elif (self.expect == 'comma' and token in '}]') or \
+                    (self.expect == 'key' and token == '}') or \
+                    (self.expect == 'value' and token == ']' and
+                     self.stack and self.stack[-1][0] == '['):
+                # The end of a container, possibly an empty one
+                self.stack.pop()
+                self.expect = 'comma' if self.stack else 'end'
+            elif self.expect == 'value' and self._in_items():
+                item = self._decode(position, final)
+                if item is None:
+                    self.position = position
+                    self.wait = len(buffer) - position
+                    break
+                items.append(item[0])
+                self.items += 1
+                self.position = item[1]
+                self.expect = 'comma'
+                continue
+            elif self.expect == 'value' and token in '{[':
+                self.stack.append([token, None])
+                self.expect = 'key' if token == '{' else 'value'
+            elif self.expect in ('key', 'value') and \
+                    (token == '"' or self.expect == 'value'):
+                value = self._decode(position, final)
+                if value is None:
+                    self.position = position
+                    break
+                if self.expect == 'key':
+                    self.stack[-1][1] = value[0]
+                    self.expect = 'colon'
+                else:
+                    self._value(value[0])
+                self.position = value[1]
+                continue
+            else:
+                raise ValueError('Unexpected {0!r} at {1}'.format(
+                    token, position))
+
+            self.position = position + 1
+
+        return items
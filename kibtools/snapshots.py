@@ -0,0 +1,347 @@
+# encoding: utf-8
+"""
+Content-addressed, deduplicated snapshot store
+
+The JSON of every saved object is stored once, as a blob named after the hash
+of its content, and a snapshot is a small manifest listing the type, name and
+hash of each object it holds. Saving a snapshot only uploads the blobs the
+store does not already have.
+"""
+
+import os
+import glob
+import json
+import config
+import hashlib
+import logging
+import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+def blob_hash(data):
+    """
+    Hash of the content of a blob
+
+    :param data: bytes
+    :return: hexadecimal digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def snapshot_name():
+    """
+    Name of a new snapshot, which sorts in the order they were taken
+
+    :return: UTC timestamp
+    """
+    return datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S.%fZ')
+
+class LocalBlobStore(object):
+    """
+    Store of blobs and manifests in a directory on disk
+    """
+    def __init__(self, path):
+        """
+        Constructor
+        :param path: directory of the store
+        """
+        self.path = path
+
+    def _blob_path(self, digest):
+        """
+        Path of a blob
+        """
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def _manifest_path(self, name):
+        """
+        Path of a manifest
+        """
+        return os.path.join(self.path, 'snapshots', '{0}.json'.format(name))
+
+    def has_blob(self, digest):
+        """
+        Check if the store has a blob
+        """
+        return os.path.isfile(self._blob_path(digest))
+
+    def put_blob(self, digest, data):
+        """
+        Store a blob
+        """
+        path = self._blob_path(digest)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.rename(path + '.tmp', path)
+
+    def get_blob(self, digest):
+        """
+        Read a blob
+        """
+        with open(self._blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def put_manifest(self, name, data):
+        """
+        Store a manifest, or pointer
+        """
+        path = self._manifest_path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def get_manifest(self, name):
+        """
+        Read a manifest, or pointer, None if it does not exist
+        """
+        path = self._manifest_path(name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+class S3BlobStore(object):
+    """
+    Store of blobs and manifests under a prefix of an AWS S3 bucket
+    """
+    def __init__(self, s3_bucket, prefix=None):
+        """
+        Constructor
+        :param s3_bucket: bucket of the store
+        :param prefix: prefix of the keys of the store
+        """
+        self.s3_bucket = s3_bucket
+        self.prefix = prefix or config.STORE_PREFIX
+
+        import boto3
+        self.s3_client = boto3.client('s3')
+
+    def _blob_key(self, digest):
+        """
+        Key of a blob
+        """
+        return '{0}/blobs/{1}/{2}'.format(self.prefix, digest[:2], digest)
+
+    def _manifest_key(self, name):
+        """
+        Key of a manifest
+        """
+        return '{0}/snapshots/{1}.json'.format(self.prefix, name)
+
+    def has_blob(self, digest):
+        """
+        Check if the store has a blob
+        """
+        try:
+            self.s3_client.head_object(
+                Bucket=self.s3_bucket,
+                Key=self._blob_key(digest)
+            )
+        except self.s3_client.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def put_blob(self, digest, data):
+        """
+        Store a blob
+        """
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=self._blob_key(digest),
+            Body=data
+        )
+
+    def get_blob(self, digest):
+        """
+        Read a blob
+        """
+        return self.s3_client.get_object(
+            Bucket=self.s3_bucket,
+            Key=self._blob_key(digest)
+        )['Body'].read()
+
+    def put_manifest(self, name, data):
+        """
+        Store a manifest, or pointer
+        """
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=self._manifest_key(name),
+            Body=data
+        )
+
+    def get_manifest(self, name):
+        """
+        Read a manifest, or pointer, None if it does not exist
+        """
+        try:
+            return self.s3_client.get_object(
+                Bucket=self.s3_bucket,
+                Key=self._manifest_key(name)
+            )['Body'].read()
+        except self.s3_client.exceptions.ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+def open_store(location):
+    """
+    Open the blob store at a location
+
+    :param location: s3://bucket/prefix, or a directory on disk
+    :return: S3BlobStore or LocalBlobStore
+    """
+    if location.startswith('s3://'):
+        s3_bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3BlobStore(s3_bucket, prefix=prefix.strip('/') or None)
+    return LocalBlobStore(location)
+
+class SnapshotStore(object):
+    """
+    Point-in-time snapshots of exports on disk, kept in a blob store
+    """
+    def __init__(self, backend, concurrency=None):
+        """
+        Constructor
+        :param backend: LocalBlobStore or S3BlobStore
+        :param concurrency: number of blobs transferred at once
+        """
+        self.backend = backend
+        self.concurrency = concurrency or config.S3_CONCURRENCY
+
+    def latest(self):
+        """
+        Name of the latest snapshot, read from its pointer
+
+        :return: name, or None if there are no snapshots
+        """
+        pointer = self.backend.get_manifest('latest')
+        return json.loads(pointer.decode('utf-8'))['name'] if pointer else None
+
+    def manifest(self, name):
+        """
+        Read the manifest of a snapshot
+
+        :param name: name of the snapshot
+        :return: dictionary
+        """
+        data = self.backend.get_manifest(name)
+        if data is None:
+            raise IOError('Snapshot does not exist: {0}'.format(name))
+        return json.loads(data.decode('utf-8'))
+
+    def save(self, input_directory, name=None):
+        """
+        Take a snapshot of an export on disk. The blobs listed by the latest
+        snapshot are known to be stored already, the others are only uploaded
+        if the store does not have them.
+
+        :param input_directory: directory that contains all types
+        :param name: name of the snapshot, a timestamp by default
+        :return: dictionary of the manifest, and the number of blobs uploaded
+        """
+        name = name or snapshot_name()
+        latest = self.latest()
+        known = set()
+        if latest:
+            known = set(digest for _, _, digest in
+                        self.manifest(latest)['objects'])
+
+        objects = []
+        missing = {}
+        for object_type in config.SAVED_OBJECT_TYPES:
+            for path in sorted(glob.glob(
+                    '{0}/{1}/*.json'.format(input_directory, object_type))):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = blob_hash(data)
+                objects.append([
+                    object_type,
+                    os.path.basename(path)[:-len('.json')],
+                    digest
+                ])
+                if digest not in known:
+                    missing[digest] = data
+
+        def upload(digest):
+            if self.backend.has_blob(digest):
+                return False
+            self.backend.put_blob(digest, missing[digest])
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            uploaded = sum(executor.map(upload, sorted(missing)))
+
+        manifest = dict(
+            name=name,
+            created=datetime.datetime.utcnow().isoformat() + 'Z',
+            objects=objects
+        )
+        self.backend.put_manifest(name, json.dumps(manifest).encode('utf-8'))
+        self.backend.put_manifest(
+            'latest',
+            json.dumps({'name': name}).encode('utf-8')
+        )
+
+        logger.info('Snapshot {0}: {1} objects, {2} new blobs'.format(
+            name, len(objects), uploaded
+        ))
+        return dict(manifest=manifest, uploaded=uploaded)
+
+    def restore(self, output_directory, name=None):
+        """
+        Restore a snapshot to an export on disk. The objects already in the
+        export that the snapshot does not hold are removed, so that the export
+        is the snapshot and nothing else.
+
+        :param output_directory: path to output directory
+        :param name: name of the snapshot, the latest by default
+        :return: dictionary of the manifest
+        """
+        name = name or self.latest()
+        if name is None:
+            raise IOError('There are no snapshots in the store')
+        manifest = self.manifest(name)
+
+        def object_path(object_type, object_name):
+            return os.path.join(
+                output_directory,
+                object_type,
+                '{0}.json'.format(object_name)
+            )
+
+        for object_type in set(o[0] for o in manifest['objects']):
+            folder = os.path.join(output_directory, object_type)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+        restored = set(object_path(object_type, object_name)
+                       for object_type, object_name, _ in manifest['objects'])
+        for object_type in config.SAVED_OBJECT_TYPES:
+            for path in glob.glob(object_path(object_type, '*')):
+                if path not in restored:
+                    os.remove(path)
+
+        # Nor does the manifest of an incremental save describe it any more
+        saved_manifest = os.path.join(output_directory, config.MANIFEST_FILE)
+        if os.path.isfile(saved_manifest):
+            os.remove(saved_manifest)
+
+        def download(objects):
+            object_type, object_name, digest = objects
+            with open(object_path(object_type, object_name), 'wb') as f:
+                f.write(self.backend.get_blob(digest))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(download, manifest['objects']))
+
+        logger.info('Restored snapshot {0}: {1} objects'.format(
+            name, len(manifest['objects'])
+        ))
+        return manifest
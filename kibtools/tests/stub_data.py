@@ -118,8 +118,26 @@ all_searches = {
     "took": 1
 }
 
+all_types = {
+    "_shards": {
+        "failed": 0,
+        "successful": 1,
+        "total": 1
+    },
+    "hits": {
+        "hits": all_searches["hits"]["hits"] +
+        all_visualizations["hits"]["hits"] +
+        all_dashboards["hits"]["hits"],
+        "max_score": 1.0,
+        "total": 4
+    },
+    "timed_out": False,
+    "took": 1
+}
+
 stub_data = {
     '_search/dashboard': all_dashboards,
     '_search/visualization': all_visualizations,
     '_search/search': all_searches,
+    '_search': all_types,
 }
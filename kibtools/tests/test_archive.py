@@ -0,0 +1,154 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the archive compression codecs
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import io
+import gzip
+import json
+import shutil
+import tarfile
+import archive
+import unittest
+
+class NonSeekable(object):
+    """
+    Stream that can only be read forward, like the body of an S3 object
+    """
+    def __init__(self, data):
+        """
+        Constructor
+        :param data: bytes of the stream
+        """
+        self.stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        """
+        Read from the stream
+        """
+        return self.stream.read(size)
+
+class TestArchive(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    export_path = '{0}/test_out/'.format(os.getcwd())
+
+    def setUp(self):
+        """
+        Generic setup
+        """
+        for object_type in ['search', 'visualization', 'dashboard']:
+            folder = '{0}{1}'.format(self.export_path, object_type)
+            os.makedirs(folder)
+            for i in range(5):
+                with open('{0}/{1}-{2}.json'.format(folder, object_type, i),
+                          'w') as f:
+                    json.dump(dict(title='{0}-{1}'.format(object_type, i)), f)
+
+    def tearDown(self):
+        """
+        Generic teardown
+        """
+        shutil.rmtree(self.export_path)
+
+    def test_round_trip(self):
+        """
+        Tests that a tarball written with each codec is read back with the
+        codec detected
+        """
+        for codec in archive.available_codecs():
+            compressed = io.BytesIO()
+            with archive.open_writer(codec, compressed) as writer:
+                with tarfile.open(fileobj=writer, mode='w|') as out_tar:
+                    out_tar.add(self.export_path, arcname='export')
+            self.assertFalse(compressed.closed)
+
+            compressed.seek(0)
+            self.assertEqual(
+                archive.detect_codec(compressed.getvalue()[:8]),
+                'gz' if codec == 'pgz' else codec
+            )
+            with tarfile.open(fileobj=archive.open_reader(compressed),
+                              mode='r|') as in_tar:
+                names = [member.name for member in in_tar if member.isfile()]
+            self.assertEqual(len(names), 15, msg=codec)
+
+    def test_parallel_gzip_members(self):
+        """
+        Tests that parallel gzip writes its blocks in order, as gzip members
+        that any gzip reader decompresses
+        """
+        data = b''.join(str(i).encode() for i in range(20000))
+        compressed = io.BytesIO()
+        with archive.ParallelGzipWriter(compressed, workers=2,
+                                        block_size=4096) as writer:
+            for i in range(0, len(data), 1000):
+                writer.write(data[i:i + 1000])
+
+        reader = gzip.GzipFile(fileobj=io.BytesIO(compressed.getvalue()))
+        self.assertEqual(reader.read(), data)
+        self.assertEqual(
+            compressed.getvalue().count(b'\x1f\x8b\x08'),
+            -(-len(data) // 4096)
+        )
+
+    def test_gzip_reader(self):
+        """
+        Tests that a gzip stream of many members is read without seeking,
+        however the reads fall across the members
+        """
+        data = b''.join(str(i).encode() for i in range(20000))
+        compressed = io.BytesIO()
+        with archive.ParallelGzipWriter(compressed, workers=2,
+                                        block_size=4096) as writer:
+            writer.write(data)
+
+        for read_size in [1, 7, 4096, 1024 * 1024]:
+            reader = archive.GzipReader(
+                NonSeekable(compressed.getvalue()),
+                read_size=read_size
+            )
+            chunks = iter(lambda: reader.read(1000), b'')
+            self.assertEqual(b''.join(chunks), data)
+
+        reader = archive.open_reader(NonSeekable(compressed.getvalue()[:-10]))
+        with self.assertRaises(EOFError):
+            reader.read()
+
+    def test_open_reader_uncompressed(self):
+        """
+        Tests that a stream that is not compressed is read as it is
+        """
+        reader = archive.open_reader(io.BytesIO(b'plain tarball'))
+        self.assertEqual(reader.read(3), b'pla')
+        self.assertEqual(reader.read(), b'in tarball')
+
+    def test_unavailable_codec(self):
+        """
+        Tests that an unknown codec is refused
+        """
+        with self.assertRaises(ValueError):
+            archive.open_writer('bz2', io.BytesIO())
+
+    def test_benchmark_codecs(self):
+        """
+        Tests that every codec is measured on an export
+        """
+        results = archive.benchmark_codecs(self.export_path)
+        self.assertEqual(
+            [result['codec'] for result in results],
+            archive.available_codecs()
+        )
+        for result in results:
+            self.assertGreater(result['bytes'], 0)
+            self.assertGreater(result['ratio'], 1)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the benchmark harness
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import unittest
+import benchmark
+import subprocess
+import dashboard
+
+from graph import SavedObjectGraph
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    def test_generate_corpus(self):
+        """
+        Tests that the corpus is repeatable, in load order, and that every
+        reference in it points at an object that exists
+        """
+        corpus = benchmark.generate_corpus(objects=100, panels=5)
+
+        self.assertEqual(len(corpus), 100)
+        self.assertEqual(corpus, benchmark.generate_corpus(objects=100,
+                                                           panels=5))
+        self.assertEqual(
+            [object_type for object_type, _, _ in corpus],
+            sorted((object_type for object_type, _, _ in corpus),
+                   key=dashboard.SAVED_OBJECT_TYPES.index)
+        )
+
+        graph = SavedObjectGraph.from_objects(corpus)
+        self.assertEqual(graph.dangling(), {})
+        self.assertTrue(any(graph.uses('dashboard', name)
+                            for _, name, _ in corpus[-20:]))
+
+    def test_parse_importtime(self):
+        """
+        Tests the parsing of the imports reported by -X importtime
+        """
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |   _json',
+            'import time:       300 |        420 | json',
+            'Traceback of something else',
+            'import time:        80 |         80 | config',
+        ])
+        self.assertEqual(benchmark.parse_importtime(output), [
+            ('_json', 120, 120, 1),
+            ('json', 300, 420, 0),
+            ('config', 80, 80, 0),
+        ])
+
+    def test_startup(self):
+        """
+        Tests that importing the command line does not import the modules
+        that only some of its actions need, nor configure logging
+        """
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, logging, dashboard; '
+             'print(" ".join(sorted(sys.modules))); '
+             'print(len(logging.getLogger().handlers))'],
+            cwd=PROJECT_HOME
+        ).decode('utf-8').split('\n')
+        modules = output[0].split()
+        for name in benchmark.HEAVY_MODULES + ('tarfile', 'logging.config'):
+            self.assertNotIn(name, modules)
+        self.assertEqual(output[1], '0')
+
+        startup = benchmark.measure_startup(runs=1)
+        self.assertEqual(startup['heavy'], [])
+        self.assertGreater(startup['wall'], 0)
+        self.assertNotIn('boto3', [name for name, _ in startup['slowest']])
+
+    def test_stub_elasticsearch(self):
+        """
+        Tests that the stub answers the scrolls and pushes of the dashboard
+        """
+        corpus = benchmark.generate_corpus(objects=30)
+        with benchmark.StubElasticsearch(corpus) as stub:
+            saved = dict(dashboard.get_all_types(stub.cluster, page_size=7))
+            self.assertEqual(
+                sum(len(objects) for objects in saved.values()),
+                30
+            )
+            self.assertEqual(stub.requests['search'], 1)
+            self.assertEqual(stub.requests['scroll'], 4)
+            self.assertEqual(stub.requests['clear_scroll'], 1)
+
+            stub.reset()
+            summary = dashboard.load_objects(stub.cluster, corpus, bulk=True)
+            self.assertEqual(summary['pushed'], 30)
+            self.assertEqual(len(stub.objects), 30)
+
+    def test_run_benchmark(self):
+        """
+        Tests that every phase is measured
+        """
+        results = benchmark.run_benchmark(objects=50, workers=2)
+
+        self.assertEqual(
+            [result['phase'] for result in results],
+            ['save_all_types', 'push_all_from_disk', 'push_to_s3',
+             'pull_from_s3']
+        )
+        for result in results:
+            self.assertEqual(result['objects'], 50)
+            self.assertGreater(result['bytes'], 0)
+        self.assertEqual(results[1]['requests'], {'index': 50})
+        self.assertEqual(
+            sum(results[1]['metrics']['push']['objects'].values()),
+            50
+        )
+
+    @unittest.skipUnless(benchmark.reset_peak_rss(),
+                         'the peak RSS cannot be reset')
+    def test_peak_rss_per_phase(self):
+        """
+        Tests that the peak RSS of a phase is not that of an earlier one
+        """
+        size = 200 * 1024 * 1024
+        big = benchmark.measure('big', lambda: len(bytearray(size)), 1)
+        small = benchmark.measure('small', lambda: 0, 1)
+
+        self.assertGreater(big['peak_rss'], size)
+        self.assertLess(small['peak_rss'], big['peak_rss'] - size / 2)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
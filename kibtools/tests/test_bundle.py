@@ -0,0 +1,117 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the NDJSON bundle format
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import io
+import json
+import shutil
+import bundle
+import archive
+import unittest
+import jsoncodec
+
+class TestBundle(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    output_path = '{0}/test_out/'.format(os.getcwd())
+
+    objects = [
+        ('search', 'GET', {'title': 'GET'}),
+        ('visualization', 'GETViz', {'title': 'GETViz', 'kibanaSavedObjectMeta':
+                                     {'searchSourceJSON': '{"a": "\\n"}'}}),
+        ('dashboard', 'GETDash', {'title': u'GETDash é'}),
+    ]
+
+    def setUp(self):
+        """
+        Generic setup
+        """
+        os.mkdir(self.output_path)
+
+    def tearDown(self):
+        """
+        Generic teardown
+        """
+        shutil.rmtree(self.output_path)
+
+    def test_round_trip(self):
+        """
+        Tests that a bundle is read back as it was written, compressed
+        according to its extension
+        """
+        extensions = dict(gz='.ndjson.gz', xz='.ndjson.xz', zst='.ndjson.zst')
+        for codec in [None] + archive.available_codecs():
+            if codec == 'pgz':
+                continue
+            path = '{0}dashboard{1}'.format(
+                self.output_path,
+                extensions.get(codec, '.ndjson')
+            )
+            self.assertEqual(bundle.bundle_codec(path), codec)
+            self.assertEqual(bundle.write_bundle(path, self.objects), 3)
+
+            with open(path, 'rb') as f:
+                head = f.read(8)
+            self.assertEqual(archive.detect_codec(head), codec)
+            self.assertEqual(list(bundle.iter_bundle(path)), self.objects)
+
+    def test_raw(self):
+        """
+        Tests that sources passed through as RawJSON are copied into the
+        bundle, on one line each
+        """
+        path = '{0}dashboard.ndjson'.format(self.output_path)
+        raw = [
+            (object_type, name, jsoncodec.RawJSON(
+                json.dumps(source, indent=2 if object_type == 'search'
+                           else None).encode('utf-8')
+            ))
+            for object_type, name, source in self.objects
+        ]
+        self.assertEqual(bundle.write_bundle(path, raw), 3)
+
+        with open(path) as f:
+            self.assertEqual(len(f.read().splitlines()), 4)
+        self.assertEqual(list(bundle.iter_bundle(path)), self.objects)
+
+    def test_header(self):
+        """
+        Tests that the header is the first line, and that files that are not
+        bundles are refused
+        """
+        path = '{0}dashboard.ndjson'.format(self.output_path)
+        bundle.write_bundle(path, self.objects, index='.kibana')
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 4)
+        header = json.loads(lines[0])
+        self.assertEqual(header['format'], bundle.FORMAT)
+        self.assertEqual(header['index'], '.kibana')
+
+        with open(path, 'w') as f:
+            f.write('{"title": "GET"}\n')
+        with self.assertRaises(ValueError):
+            list(bundle.iter_bundle(path))
+
+        with open(path, 'w') as f:
+            f.write(json.dumps(dict(header, version=bundle.VERSION + 1)))
+        with self.assertRaises(ValueError):
+            list(bundle.iter_bundle(path))
+
+    def test_iter_lines(self):
+        """
+        Tests that lines are split across chunk boundaries
+        """
+        lines = list(bundle.iter_lines(io.BytesIO(b'ab\ncde\n\nf'), size=2))
+        self.assertEqual(lines, [b'ab', b'cde', b'f'])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
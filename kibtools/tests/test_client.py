@@ -0,0 +1,104 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the elasticsearch cluster client
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import re
+import json
+import unittest
+
+from client import ClusterClient
+from httpretty import HTTPretty
+
+class TestClusterClient(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    cluster = dict(
+        ip_address='elasticsearch',
+        port='80',
+        index='.kibana',
+    )
+
+    def test_urls(self):
+        """
+        Tests that the URLs are built from the cluster details
+        """
+        client = ClusterClient(self.cluster)
+
+        self.assertEqual(client.base_url, 'http://elasticsearch:80')
+        self.assertEqual(client.index_url, 'http://elasticsearch:80/.kibana')
+        self.assertEqual(
+            client.url('/_search/scroll'),
+            'http://elasticsearch:80/_search/scroll'
+        )
+        self.assertEqual(
+            client.index_path('search', 'GET'),
+            '.kibana/search/GET'
+        )
+
+    def test_pool_size(self):
+        """
+        Tests that the session pools the requested number of connections
+        """
+        client = ClusterClient(self.cluster, pool_size=4, timeout=3)
+        adapter = client.session.get_adapter(client.base_url)
+
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(client.timeout, 3)
+
+    def test_for_index(self):
+        """
+        Tests that a client for another index shares the pooled session
+        """
+        client = ClusterClient(self.cluster)
+        tenant = client.for_index('.kibana_tenant')
+
+        self.assertIs(tenant.session, client.session)
+        self.assertEqual(tenant.index_path('_search'), '.kibana_tenant/_search')
+        self.assertEqual(tenant.cluster['index'], '.kibana_tenant')
+        self.assertEqual(client.index_path('_search'), '.kibana/_search')
+
+    def test_from_cluster(self):
+        """
+        Tests that an existing client is re-used rather than rebuilt
+        """
+        client = ClusterClient(self.cluster)
+
+        self.assertIs(ClusterClient.from_cluster(client), client)
+        self.assertIsInstance(
+            ClusterClient.from_cluster(self.cluster),
+            ClusterClient
+        )
+
+    def test_request(self):
+        """
+        Tests that requests are sent to the cluster through the session
+        """
+        HTTPretty.register_uri(
+            HTTPretty.POST,
+            re.compile('.*'),
+            body=json.dumps({'msg': 'success'}),
+            content_type='application/json'
+        )
+        HTTPretty.enable()
+        try:
+            with ClusterClient(self.cluster) as client:
+                response = client.post(
+                    client.index_path('search', 'GET'),
+                    data='{}'
+                )
+            request = HTTPretty.last_request
+        finally:
+            HTTPretty.reset()
+            HTTPretty.disable()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.path, '/.kibana/search/GET')
+        self.assertEqual(request.headers['Connection'], 'keep-alive')
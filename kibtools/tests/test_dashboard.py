@@ -13,10 +13,16 @@ import re
 import json
 import glob
 import boto3
+import fnmatch
 import shutil
 import tarfile
+import requests
 import unittest
+import bundle
+import archive
+import metrics
 import dashboard
+import jsoncodec
 
 from moto import mock_s3
 from stub_data import stub_data
@@ -65,11 +71,307 @@ class MockElasticsearch(object):
             content_type='application/json'
         )
 
+        HTTPretty.register_uri(
+            HTTPretty.DELETE,
+            re.compile(regex),
+            body=request_callback,
+            content_type='application/json'
+        )
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        HTTPretty.enable()
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        HTTPretty.reset()
+        HTTPretty.disable()
+
+class MockElasticsearchScroll(object):
+    """
+    Mock of Elasticsearch that serves a list of hits over several scroll pages
+    """
+    def __init__(self, hits, expire=None):
+        """
+        Constructor
+        :param hits: all the hits to serve
+        :param expire: number of hits after which the scroll context expires
+        """
+        self.hits = hits
+        self.requests = []
+        self.cleared = False
+
+        def request_callback(request, uri, headers):
+            """
+            :param request: HTTP request
+            :param uri: URI/URL to send the request
+            :param headers: header of the HTTP request
+            :return:
+            """
+            body = json.loads(request.body)
+            self.requests.append(uri)
+
+            if request.method == 'DELETE':
+                self.cleared = True
+                return 200, headers, json.dumps({'succeeded': True})
+
+            if 'scroll_id' in body:
+                start = int(body['scroll_id'])
+                if expire is not None and start >= expire:
+                    error = {'type': 'search_context_missing_exception'}
+                    return 404, headers, json.dumps({'error': error})
+            else:
+                self.page_size = body['size']
+                start = 0
+
+            end = start + self.page_size
+            page = {
+                '_scroll_id': str(end),
+                'hits': {
+                    'total': len(self.hits),
+                    'hits': self.hits[start:end]
+                }
+            }
+            return 200, headers, json.dumps(page)
+
+        for method in [HTTPretty.POST, HTTPretty.DELETE]:
+            HTTPretty.register_uri(
+                method,
+                re.compile('.*'),
+                body=request_callback,
+                content_type='application/json'
+            )
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        HTTPretty.enable()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        HTTPretty.reset()
+        HTTPretty.disable()
+
+class MockElasticsearchBulk(object):
+    """
+    Mock of the Elasticsearch _bulk API, that fails the objects asked for
+    """
+    def __init__(self, fail=()):
+        """
+        Constructor
+        :param fail: names of the objects to fail
+        """
+        self.bodies = []
+
+        def request_callback(request, uri, headers):
+            """
+            :param request: HTTP request
+            :param uri: URI/URL to send the request
+            :param headers: header of the HTTP request
+            :return:
+            """
+            lines = request.body.decode('utf-8').strip().split('\n')
+            self.bodies.append(lines)
+
+            items = []
+            for action in [json.loads(line) for line in lines[::2]]:
+                result = dict(action['index'], status=201)
+                if result['_id'] in fail:
+                    result['status'] = 400
+                    result['error'] = 'mapper_parsing_exception'
+                items.append({'index': result})
+
+            response = {'errors': len(fail) > 0, 'items': items}
+            return 200, headers, json.dumps(response)
+
+        HTTPretty.register_uri(
+            HTTPretty.POST,
+            re.compile('.*'),
+            body=request_callback,
+            content_type='application/json'
+        )
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        HTTPretty.enable()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        HTTPretty.reset()
+        HTTPretty.disable()
+
+class MockElasticsearchIndex(object):
+    """
+    Mock of an Elasticsearch kibana index holding saved objects, that answers
+    searches, _mget and pushes of objects
+    """
+    def __init__(self, objects):
+        """
+        Constructor
+        :param objects: dictionary of (version, source) keyed by (type, name)
+        """
+        self.objects = objects
+        self.requests = []
+        # Number of hits left out of searches, as by a scroll cut short
+        self.missing = 0
+        self.mget_status = 200
+
+        def hit(key, body):
+            """
+            :param key: (type, name) of the object
+            :param body: body of the request
+            :return: hit of the object
+            """
+            version, source = self.objects[key]
+            found = {'_index': '.kibana', '_type': key[0], '_id': key[1]}
+            if body.get('version', True):
+                found['_version'] = version
+            if body.get('_source', True):
+                found['_source'] = source
+            return found
+
+        def request_callback(request, uri, headers):
+            """
+            :param request: HTTP request
+            :param uri: URI/URL to send the request
+            :param headers: header of the HTTP request
+            :return:
+            """
+            path = request.path.split('?')[0]
+            body = json.loads(request.body)
+            self.requests.append((path, body))
+
+            if path.endswith('/_search'):
+                # A search of /index/type/_search is limited to the type
+                search_type = path.split('/')[2:-1]
+                hits = [hit(key, body) for key in sorted(self.objects)
+                        if not search_type or key[0] == search_type[0]]
+                response = {'hits': {
+                    'total': len(hits),
+                    'hits': hits[:len(hits) - self.missing]
+                }}
+            elif path.endswith('/_mget'):
+                if self.mget_status != 200:
+                    return self.mget_status, headers, json.dumps({})
+                docs = []
+                for doc in body['docs']:
+                    key = (doc['_type'], doc['_id'])
+                    if key in self.objects:
+                        docs.append(dict(hit(key, {}), found=True))
+                    else:
+                        docs.append(dict(doc, found=False))
+                response = {'docs': docs}
+            else:
+                key = tuple(path.split('/')[2:4])
+                version = self.objects.get(key, (0, None))[0] + 1
+                self.objects[key] = (version, body)
+                response = {'_version': version, 'created': version == 1}
+
+            return 200, headers, json.dumps(response)
+
+        HTTPretty.register_uri(
+            HTTPretty.POST,
+            re.compile('.*'),
+            body=request_callback,
+            content_type='application/json'
+        )
+
     def __enter__(self):
         """
         Defines the behaviour for __enter__
         """
         HTTPretty.enable()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        HTTPretty.reset()
+        HTTPretty.disable()
+
+class MockElasticsearchTenants(object):
+    """
+    Mock of an Elasticsearch cluster with a kibana index per tenant, that
+    lists them with _cat/indices and answers searches of each one
+    """
+    def __init__(self, indices, fail=()):
+        """
+        Constructor
+        :param indices: dictionary of lists of (type, name, source), keyed by
+        index
+        :param fail: indices whose searches fail
+        """
+        self.indices = indices
+        self.searched = []
+
+        def request_callback(request, uri, headers):
+            """
+            :param request: HTTP request
+            :param uri: URI/URL to send the request
+            :param headers: header of the HTTP request
+            :return:
+            """
+            path = request.path.split('?')[0]
+            if path.startswith('/_cat/indices/'):
+                patterns = path[len('/_cat/indices/'):].split(',')
+                # The whole request fails if an index it names is missing
+                if any('*' not in p and p not in self.indices
+                       for p in patterns):
+                    return 404, headers, json.dumps({'error': 'missing'})
+                rows = [
+                    {'index': index, 'docs.count': str(len(objects))}
+                    for index, objects in self.indices.items()
+                    if any(fnmatch.fnmatch(index, p) for p in patterns)
+                ]
+                return 200, headers, json.dumps(rows)
+
+            index = path.split('/')[1]
+            self.searched.append(index)
+            if index in fail:
+                return 500, headers, json.dumps({'error': 'failed'})
+
+            hits = [
+                {'_index': index, '_type': object_type, '_id': name,
+                 '_source': source}
+                for object_type, name, source in self.indices[index]
+            ]
+            response = {'hits': {'total': len(hits), 'hits': hits}}
+            return 200, headers, json.dumps(response)
+
+        # Each index has its own stub, as older httpretty shares the request
+        # of a stub between the threads sending to it at once
+        patterns = ['.*://[^/]+/_cat/indices/'] + [
+            '.*://[^/]+/{0}/'.format(re.escape(index)) for index in indices
+        ]
+        for pattern in patterns:
+            for method in [HTTPretty.GET, HTTPretty.POST]:
+                HTTPretty.register_uri(
+                    method,
+                    re.compile(pattern),
+                    body=request_callback,
+                    content_type='application/json'
+                )
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        HTTPretty.enable()
+        return self
 
     def __exit__(self, *args):
         """
@@ -158,37 +460,16 @@ def helper_extract_all(cluster, output_path):
     """
     Runs the extraction from elasticsearch to create files on disk
     """
-    stub_dashboard = dict(
-        status_code=200,
-        response=stub_data['_search/dashboard']
-    )
-    stub_visualization = dict(
-        status_code=200,
-        response=stub_data['_search/visualization']
-    )
-
-    stub_search = dict(
+    stub_all = dict(
         status_code=200,
-        response=stub_data['_search/search']
+        response=stub_data['_search']
     )
 
-    with \
-            MockElasticsearch(
-                response=stub_dashboard,
-                regex='.*dashboard/_search$'
-            ) as MD, \
-            MockElasticsearch(
-                response=stub_visualization,
-                regex='.*visualization/_search$'
-            ) as MV, \
-            MockElasticsearch(
-                response=stub_search,
-                regex='.*search/_search$'
-            ) as MS:
-                dashboard.save_all_types(
-                    cluster=cluster,
-                    output_directory=output_path
-                )
+    with MockElasticsearch(response=stub_all):
+        dashboard.save_all_types(
+            cluster=cluster,
+            output_directory=output_path
+        )
 
 class TestDashboard(unittest.TestCase):
     """
@@ -225,13 +506,49 @@ class TestDashboard(unittest.TestCase):
             response=stub_data['_search/dashboard']
         )
         with MockElasticsearch(stub_response):
-            response = dashboard.get_dashboards(cluster=self.cluster)
+            response = list(dashboard.get_dashboards(cluster=self.cluster))
 
         self.assertEqual(len(response), 2)
         self.assertIn('name', response[0].keys())
         self.assertIn('source', response[0].keys())
         self.assertIn('visualizations', response[0].keys())
 
+    def test_get_dashboard_pages(self):
+        """
+        Tests that all the dashboards are collected over several scroll pages
+        """
+        template = stub_data['_search/dashboard']['hits']['hits'][0]
+        hits = []
+        for i in range(7):
+            hit = json.loads(json.dumps(template))
+            hit['_id'] = 'Dash{0}'.format(i)
+            hits.append(hit)
+
+        with MockElasticsearchScroll(hits) as MS:
+            response = dashboard.get_dashboards(
+                cluster=self.cluster,
+                page_size=3
+            )
+            names = [db['name'] for db in response]
+
+        self.assertEqual(names, [hit['_id'] for hit in hits])
+        # The first search, then two further scroll pages
+        self.assertEqual(len(MS.requests), 4)
+        self.assertTrue(MS.cleared)
+
+    def test_scroll_expired(self):
+        """
+        Tests that a scroll context that expires fails the search, rather than
+        ending it early
+        """
+        hits = [
+            {'_type': 'dashboard', '_id': 'Dash{0}'.format(i), '_source': {}}
+            for i in range(10)
+        ]
+        with MockElasticsearchScroll(hits, expire=2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                list(dashboard.scroll_search(self.cluster, page_size=2))
+
     def test_get_visualizations(self):
         """
         Tests the collection of the Visualizations
@@ -241,7 +558,7 @@ class TestDashboard(unittest.TestCase):
             response=stub_data['_search/visualization']
         )
         with MockElasticsearch(stub_response):
-            response = dashboard.get_visualizations(cluster=self.cluster)
+            response = list(dashboard.get_visualizations(cluster=self.cluster))
 
         self.assertEqual(len(response), 1)
         self.assertIn('name', response[0].keys())
@@ -257,12 +574,36 @@ class TestDashboard(unittest.TestCase):
             response=stub_data['_search/search']
         )
         with MockElasticsearch(stub_response):
-            response = dashboard.get_searches(cluster=self.cluster)
+            response = list(dashboard.get_searches(cluster=self.cluster))
 
         self.assertEqual(len(response), 1)
         self.assertIn('name', response[0].keys())
         self.assertIn('source', response[0].keys())
 
+    def test_get_all_types(self):
+        """
+        Tests the collection of all the types with a single search
+        """
+        stub_response = dict(
+            status_code=200,
+            response=stub_data['_search']
+        )
+        with MockElasticsearch(stub_response):
+            response = dashboard.get_all_types(cluster=self.cluster)
+            path = HTTPretty.last_request.path
+            body = json.loads(HTTPretty.last_request.body)
+
+        self.assertTrue(path.startswith('/.kibana/_search'))
+        self.assertEqual(
+            body['query'],
+            {'terms': {'_type': ['search', 'visualization', 'dashboard']}}
+        )
+        self.assertEqual(len(response['dashboard']), 2)
+        self.assertEqual(len(response['visualization']), 1)
+        self.assertEqual(len(response['search']), 1)
+        self.assertIn('visualizations', response['dashboard'][0].keys())
+        self.assertIn('searches', response['visualization'][0].keys())
+
     def test_save_all_types(self):
         """
         Tests the saving of the dashboard types
@@ -279,6 +620,197 @@ class TestDashboard(unittest.TestCase):
         # Clean up
         shutil.rmtree(output_path)
 
+    def test_save_changed_types(self):
+        """
+        Tests that an incremental save only fetches the objects that are new
+        or changed, and removes the deleted ones
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        objects = {
+            ('search', 'GET'): (1, {'title': 'GET'}),
+            ('visualization', 'GETViz'): (1, {'title': 'GETViz'}),
+            ('dashboard', 'GETDash'): (1, {'title': 'GETDash'}),
+        }
+
+        try:
+            with MockElasticsearchIndex(objects) as MI:
+                first = dashboard.save_changed_types(
+                    cluster=self.cluster,
+                    output_directory=output_path
+                )
+
+                # Nothing changed: a single search of the versions only
+                del MI.requests[:]
+                second = dashboard.save_changed_types(
+                    cluster=self.cluster,
+                    output_directory=output_path
+                )
+                self.assertEqual(len(MI.requests), 1)
+                self.assertEqual(MI.requests[0][1]['_source'], False)
+
+                objects[('search', 'GET')] = (2, {'title': 'GET2'})
+                objects[('search', 'NEW')] = (1, {'title': 'NEW'})
+                del objects[('dashboard', 'GETDash')]
+                del MI.requests[:]
+                third = dashboard.save_changed_types(
+                    cluster=self.cluster,
+                    output_directory=output_path
+                )
+                mget = MI.requests[-1][1]['docs']
+
+            with open('{0}search/GET.json'.format(output_path)) as f:
+                saved = json.load(f)
+            dashboards = glob.glob('{0}dashboard/*'.format(output_path))
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(
+            first,
+            dict(new=3, changed=0, deleted=0, unchanged=0)
+        )
+        self.assertEqual(
+            second,
+            dict(new=0, changed=0, deleted=0, unchanged=3)
+        )
+        self.assertEqual(
+            third,
+            dict(new=1, changed=1, deleted=1, unchanged=1)
+        )
+        self.assertEqual(
+            sorted(doc['_id'] for doc in mget),
+            ['GET', 'NEW']
+        )
+        self.assertEqual(saved, {'title': 'GET2'})
+        self.assertEqual(dashboards, [])
+
+    def test_save_changed_types_failed(self):
+        """
+        Tests that an incremental save does not remove any object when the
+        search of the versions is cut short, nor when _mget fails
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        objects = {
+            ('search', 'GET'): (1, {'title': 'GET'}),
+            ('dashboard', 'GETDash'): (1, {'title': 'GETDash'}),
+        }
+
+        try:
+            with MockElasticsearchIndex(objects) as MI:
+                dashboard.save_changed_types(
+                    cluster=self.cluster,
+                    output_directory=output_path
+                )
+
+                MI.missing = 1
+                with self.assertRaises(IOError):
+                    dashboard.save_changed_types(
+                        cluster=self.cluster,
+                        output_directory=output_path
+                    )
+
+                MI.missing = 0
+                MI.mget_status = 500
+                objects[('search', 'GET')] = (2, {'title': 'GET2'})
+                with self.assertRaises(requests.exceptions.HTTPError):
+                    dashboard.save_changed_types(
+                        cluster=self.cluster,
+                        output_directory=output_path
+                    )
+
+            saved = sorted(glob.glob('{0}*/*.json'.format(output_path)))
+            with open('{0}search/GET.json'.format(output_path)) as f:
+                search = json.load(f)
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(
+            [os.path.relpath(path, output_path) for path in saved],
+            ['dashboard/GETDash.json', 'search/GET.json']
+        )
+        self.assertEqual(search, {'title': 'GET'})
+
+    def test_parse_panels(self):
+        """
+        Tests the parsing of the types and names of the panels
+        """
+        ret = dashboard.parse_panels({
+            'panelsJSON': json.dumps([
+                {'id': 'GETViz', 'type': 'visualization'},
+                {'id': 'GET', 'type': 'search'},
+                {'id': 'Old'},
+            ])
+        })
+
+        self.assertEqual(
+            ret,
+            [('visualization', 'GETViz'), ('search', 'GET'),
+             ('visualization', 'Old')]
+        )
+
+    def test_export_dashboards(self):
+        """
+        Tests that the selected dashboards are saved with the visualizations
+        and searches they depend on, and nothing else
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+
+        def panels(*names):
+            return json.dumps([{'id': n, 'type': t} for t, n in names])
+
+        objects = {
+            ('dashboard', 'D1'): (1, {
+                'title': 'Web 1',
+                'panelsJSON': panels(('visualization', 'V1'),
+                                     ('search', 'S2'))
+            }),
+            ('dashboard', 'D2'): (1, {
+                'title': 'Web 2',
+                'panelsJSON': panels(('visualization', 'V2'),
+                                     ('visualization', 'Gone'))
+            }),
+            ('dashboard', 'D3'): (1, {
+                'title': 'Other',
+                'panelsJSON': panels(('visualization', 'V3'))
+            }),
+            ('visualization', 'V1'): (1, {'title': 'V1',
+                                          'savedSearchId': 'S1'}),
+            ('visualization', 'V2'): (1, {'title': 'V2'}),
+            ('visualization', 'V3'): (1, {'title': 'V3',
+                                          'savedSearchId': 'S3'}),
+            ('search', 'S1'): (1, {'title': 'S1'}),
+            ('search', 'S2'): (1, {'title': 'S2'}),
+            ('search', 'S3'): (1, {'title': 'S3'}),
+        }
+
+        try:
+            with MockElasticsearchIndex(objects) as MI:
+                summary = dashboard.export_dashboards(
+                    cluster=self.cluster,
+                    output_directory=output_path,
+                    selectors=['Web*']
+                )
+                paths = [path for path, body in MI.requests]
+
+            saved = sorted(
+                path.replace(output_path, '')
+                for path in glob.glob('{0}*/*'.format(output_path))
+            )
+        finally:
+            shutil.rmtree(output_path)
+
+        # One search of the dashboard titles, and one _mget per type
+        self.assertEqual(
+            paths,
+            ['/.kibana/dashboard/_search'] + ['/.kibana/_mget'] * 3
+        )
+        self.assertEqual(
+            saved,
+            ['dashboard/D1.json', 'dashboard/D2.json', 'search/S1.json',
+             'search/S2.json', 'visualization/V1.json',
+             'visualization/V2.json']
+        )
+        self.assertEqual(summary['visualization']['missing'], ['Gone'])
+
     def test_push_object(self):
         """
         Tests that you can push an object to elasticsearch
@@ -326,6 +858,344 @@ class TestDashboard(unittest.TestCase):
             # Clean up files
             shutil.rmtree(output_path)
 
+    def test_push_all_from_disk_skip_unchanged(self):
+        """
+        Tests that only the objects missing from, or different to, the ones in
+        the cluster are pushed
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        hits = dict(
+            ((hit['_type'], hit['_source']['title']), hit['_source'])
+            for hit in stub_data['_search']['hits']['hits']
+        )
+        changed = dict(hits[('dashboard', 'GETDash')], description='old')
+        objects = {
+            ('search', 'GET'): (1, hits[('search', 'GET')]),
+            ('visualization', 'GETViz'): (1, hits[('visualization', 'GETViz')]),
+            ('dashboard', 'GETDash'): (1, changed),
+        }
+
+        try:
+            with MockElasticsearchIndex(objects) as MI:
+                summary = dashboard.push_all_from_disk(
+                    cluster=self.cluster,
+                    input_directory=output_path,
+                    skip_unchanged=True
+                )
+                pushed = [
+                    path for path, body in MI.requests
+                    if not path.endswith('_mget')
+                ]
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(summary['pushed'], 2)
+        self.assertEqual(
+            [summary['created'], summary['updated'], summary['unchanged']],
+            [1, 1, 2]
+        )
+        self.assertEqual(
+            sorted(pushed),
+            ['/.kibana/dashboard/GETDash', '/.kibana/dashboard/GETDash2']
+        )
+        self.assertEqual(objects[('dashboard', 'GETDash')][0], 2)
+
+    def test_concurrent_push_all_from_disk(self):
+        """
+        Tests that all types are pushed on a pool of threads, one type after
+        the other
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        paths = []
+
+        def request_callback(request, uri, headers):
+            paths.append(request.path)
+            status = 400 if request.path.endswith('GETDash2') else 201
+            return status, headers, json.dumps({'created': status == 201})
+
+        # Each dashboard has its own stub, as older httpretty shares the
+        # request of a stub between the threads sending to it at once
+        for pattern in ['.*GETDash2$', '.*(?<!GETDash2)$']:
+            HTTPretty.register_uri(
+                HTTPretty.POST,
+                re.compile(pattern),
+                body=request_callback,
+                content_type='application/json'
+            )
+        HTTPretty.enable()
+        try:
+            summary = dashboard.concurrent_push_all_from_disk(
+                cluster=self.cluster,
+                input_directory=output_path,
+                workers=4
+            )
+        finally:
+            HTTPretty.reset()
+            HTTPretty.disable()
+            shutil.rmtree(output_path)
+
+        types = [path.split('/')[2] for path in paths]
+        self.assertEqual(
+            types,
+            ['search', 'visualization', 'dashboard', 'dashboard']
+        )
+        self.assertEqual(summary['pushed'], 3)
+        self.assertEqual(list(summary['failed'].keys()), ['GETDash2'])
+
+    def test_iter_bulk_batches(self):
+        """
+        Tests that bulk batches are bounded and never mix types
+        """
+        source = {'title': 'GET'}
+        objects = [('search', 'S{0}'.format(i), source) for i in range(5)]
+        objects += [('dashboard', 'D0', source)]
+
+        batches = list(dashboard.iter_bulk_batches(
+            index=self.cluster['index'],
+            objects=objects,
+            batch_size=2
+        ))
+        self.assertEqual(
+            [names for names, body in batches],
+            [['S0', 'S1'], ['S2', 'S3'], ['S4'], ['D0']]
+        )
+
+        lines = batches[0][1].decode('utf-8').strip().split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(
+            json.loads(lines[0]),
+            {'index': {'_index': '.kibana', '_type': 'search', '_id': 'S0'}}
+        )
+        self.assertEqual(json.loads(lines[1]), source)
+
+        # A batch is also cut once it would exceed its size in bytes
+        batches = list(dashboard.iter_bulk_batches(
+            index=self.cluster['index'],
+            objects=objects,
+            batch_bytes=len(batches[0][1])
+        ))
+        self.assertEqual(
+            [names for names, body in batches],
+            [['S0', 'S1'], ['S2', 'S3'], ['S4'], ['D0']]
+        )
+
+    def test_bulk_push_all_from_disk(self):
+        """
+        Tests that all types are bulk pushed in order, with errors reported
+        by object name
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        try:
+            with MockElasticsearchBulk(fail=['GETViz']) as MB:
+                summary = dashboard.bulk_push_all_from_disk(
+                    cluster=self.cluster,
+                    input_directory=output_path
+                )
+        finally:
+            shutil.rmtree(output_path)
+
+        types = [
+            json.loads(lines[0])['index']['_type'] for lines in MB.bodies
+        ]
+        self.assertEqual(types, ['search', 'visualization', 'dashboard'])
+        self.assertEqual(summary['pushed'], 3)
+        self.assertEqual(
+            summary['failed'],
+            {'GETViz': 'mapper_parsing_exception'}
+        )
+
+    def test_raw_push_all_from_disk(self):
+        """
+        Tests that objects loaded raw are sent as the JSON they were saved
+        as, one line each in the bulk bodies even if saved over many lines
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        saved = {}
+        for push_type in dashboard.SAVED_OBJECT_TYPES:
+            for name in os.listdir(os.path.join(output_path, push_type)):
+                with open(os.path.join(output_path, push_type, name),
+                          'rb') as f:
+                    saved[(push_type, name)] = f.read()
+        search = json.loads(saved[('search', 'GET.json')].decode('utf-8'))
+
+        # Edited by hand, and saved over many lines
+        with open('{0}search/GET.json'.format(output_path), 'w') as f:
+            json.dump(search, f, indent=2)
+
+        try:
+            objects = list(dashboard.iter_objects_from_disk(output_path,
+                                                            raw=True))
+            with MockElasticsearchBulk() as MB:
+                summary = dashboard.load_objects(
+                    cluster=self.cluster,
+                    objects=objects,
+                    bulk=True
+                )
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(len(objects), len(saved))
+        for push_type, name, source in objects:
+            self.assertIn((push_type, '{0}.json'.format(name)), saved)
+            self.assertIsInstance(source, jsoncodec.RawJSON)
+
+        self.assertEqual(summary['pushed'], len(saved))
+        documents = [
+            (json.loads(action)['index']['_type'], document.encode('utf-8'))
+            for lines in MB.bodies
+            for action, document in zip(lines[::2], lines[1::2])
+        ]
+        self.assertEqual([push_type for push_type, _ in documents],
+                         [push_type for push_type, _, _ in objects])
+        for push_type, document in documents:
+            if push_type == 'search':
+                self.assertEqual(json.loads(document.decode('utf-8')), search)
+            else:
+                self.assertIn(document, saved.values())
+
+    def test_bundle(self):
+        """
+        Tests that a bundle is saved in load order, round trips through the
+        directory layout, and is loaded with the bulk API
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        os.mkdir(output_path)
+        objects = {
+            ('dashboard', 'GETDash'): (1, {'title': 'GETDash'}),
+            ('search', 'GET'): (1, {'title': 'GET'}),
+            ('visualization', 'GETViz'): (1, {'title': 'GETViz',
+                                              'savedSearchId': 'GET'}),
+        }
+
+        try:
+            bundle_file = '{0}dashboard.ndjson.gz'.format(output_path)
+            with MockElasticsearchIndex(objects) as MI:
+                saved = dashboard.save_bundle(
+                    cluster=self.cluster,
+                    output_file=bundle_file
+                )
+            self.assertEqual(saved, 3)
+            self.assertEqual(
+                [path for path, _ in MI.requests],
+                ['/.kibana/search/_search', '/.kibana/visualization/_search',
+                 '/.kibana/dashboard/_search']
+            )
+            with open(bundle_file, 'rb') as f:
+                self.assertEqual(f.read(2), b'\x1f\x8b')
+
+            # Round trip through the directory layout
+            directory = '{0}unpacked/'.format(output_path)
+            dashboard.unpack_bundle(bundle_file, directory)
+            with open(dashboard.object_path(directory, 'visualization',
+                                            'GETViz')) as f:
+                self.assertEqual(json.load(f)['savedSearchId'], 'GET')
+
+            packed_file = '{0}packed.ndjson'.format(output_path)
+            dashboard.pack_bundle(directory, packed_file)
+            self.assertEqual(
+                list(bundle.iter_bundle(packed_file)),
+                list(bundle.iter_bundle(bundle_file))
+            )
+
+            with MockElasticsearchBulk() as MB:
+                summary = dashboard.load_objects(
+                    cluster=self.cluster,
+                    objects=dashboard.iter_objects_from_bundle(packed_file),
+                    bulk=True
+                )
+            self.assertEqual(summary['pushed'], 3)
+            self.assertEqual(
+                [json.loads(body[0])['index']['_type']
+                 for body in MB.bodies],
+                ['search', 'visualization', 'dashboard']
+            )
+        finally:
+            shutil.rmtree(output_path)
+
+    def test_save_indices(self):
+        """
+        Tests that the indices matching patterns are discovered and saved in
+        parallel, each to its own subtree, and archived together for S3
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        indices = {
+            '.kibana_a': [('search', 'GET', {'title': 'GET'}),
+                          ('dashboard', 'GETDash', {'title': 'GETDash',
+                                                    'panelsJSON': '[]'})],
+            '.kibana_b': [('visualization', 'GETViz', {'title': 'GETViz'})],
+            '.kibana_c': [],
+            '.kibana_d': [('search', 'GET', {'title': 'GET'})],
+            'logstash': [('search', 'GET', {'title': 'GET'})],
+        }
+
+        try:
+            with MockElasticsearchTenants(indices, fail=['.kibana_d']) as MT:
+                found = dashboard.discover_indices(
+                    cluster=self.cluster,
+                    patterns=['.kibana_*']
+                )
+                self.assertEqual(
+                    found,
+                    ['.kibana_a', '.kibana_b', '.kibana_d', '.kibana_c']
+                )
+
+                # A missing index does not hide the ones that exist
+                self.assertEqual(
+                    dashboard.discover_indices(
+                        cluster=self.cluster,
+                        patterns=['.kibana_b', '.kibana_missing', '.kibana_c*']
+                    ),
+                    ['.kibana_b', '.kibana_c']
+                )
+
+                summary = dashboard.save_indices(
+                    cluster=self.cluster,
+                    output_directory=output_path,
+                    indices=found,
+                    workers=2
+                )
+            self.assertEqual(summary['saved'],
+                             ['.kibana_a', '.kibana_b', '.kibana_c'])
+            self.assertEqual(list(summary['failed']), ['.kibana_d'])
+            self.assertEqual(sorted(set(MT.searched)), sorted(found))
+
+            with open(dashboard.object_path(
+                    output_path + '.kibana_a', 'dashboard', 'GETDash')) as f:
+                self.assertEqual(json.load(f)['title'], 'GETDash')
+            self.assertTrue(os.path.isfile(dashboard.object_path(
+                output_path + '.kibana_b', 'visualization', 'GETViz')))
+
+            # One archive, with the types of each index in load order
+            self.assertEqual(
+                [name for _, name in dashboard.archive_folders(output_path)],
+                ['.kibana_a/search', '.kibana_a/dashboard',
+                 '.kibana_b/visualization', '.kibana_c', '.kibana_d']
+            )
+            with mock_s3():
+                s3_resource = boto3.resource('s3')
+                s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+                dashboard.push_to_s3(
+                    input_directory=output_path,
+                    s3_details=self.s3_details
+                )
+                shutil.rmtree(output_path)
+                dashboard.pull_from_s3(
+                    output_directory=output_path,
+                    s3_details=self.s3_details
+                )
+            self.assertTrue(os.path.isfile(dashboard.object_path(
+                output_path + '.kibana_a', 'search', 'GET')))
+        finally:
+            shutil.rmtree(output_path)
+
     def test_gzip_and_send_s3(self):
         """
         Tests that a gzip is made and sent to S3 and everything cleaned after
@@ -345,10 +1215,12 @@ class TestDashboard(unittest.TestCase):
                 s3_details=self.s3_details
             )
 
-            # Check there is a gzip in the bucket
+            # Check there is a gzip in the bucket, the latest pointer refers to
+            latest = dashboard.resolve_snapshot(self.s3_details)
+            self.assertTrue(latest.startswith('snapshots/dashboard-'))
             s3_object = s3_resource.Object(
                 self.s3_details['bucket'],
-                'dashboard.tar.gz'
+                latest
             )
 
             keys = s3_object.get().keys()
@@ -396,3 +1268,239 @@ class TestDashboard(unittest.TestCase):
 
         os.remove('/tmp/tmp.tar.gz')
         shutil.rmtree('{0}'.format(output_path))
+
+    def test_order_objects(self):
+        """
+        Tests that a stream of objects is put in load order, holding back only
+        the objects that arrive too early
+        """
+        stream = [
+            ('dashboard', 'D1', {}),
+            ('search', 'S1', {}),
+            ('search', 'S2', {}),
+            ('visualization', 'V1', {}),
+            ('visualization', 'V2', {}),
+        ]
+        ordered = list(dashboard.order_objects(iter(stream)))
+
+        self.assertEqual(
+            [name for _, name, _ in ordered],
+            ['S1', 'S2', 'V1', 'V2', 'D1']
+        )
+
+        # Already in load order, so nothing is held back
+        consumed = []
+
+        def tracked():
+            for objects in stream[1:] + stream[:1]:
+                consumed.append(objects[1])
+                yield objects
+
+        for _, name, _ in dashboard.order_objects(tracked()):
+            self.assertEqual(consumed[-1], name)
+
+    def test_iter_objects_from_s3(self):
+        """
+        Tests that objects are read straight out of the tarball in S3, in
+        load order, and can be loaded without touching the disk
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        # Moto on Python 2.7 turns away the elasticsearch stub, so the
+        # objects are loaded once S3 is no longer mocked
+        with mock_s3():
+            s3_resource = boto3.resource('s3')
+            s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+            try:
+                dashboard.push_to_s3(
+                    input_directory=output_path,
+                    s3_details=self.s3_details
+                )
+            finally:
+                shutil.rmtree(output_path)
+
+            objects = list(dashboard.iter_objects_from_s3(self.s3_details))
+        self.assertEqual(
+            [push_type for push_type, _, _ in objects],
+            ['search', 'visualization', 'dashboard', 'dashboard']
+        )
+        self.assertEqual(objects[0][1], 'GET')
+        self.assertFalse(os.path.isdir(output_path))
+
+        with MockElasticsearchBulk() as MB:
+            summary = dashboard.load_objects(
+                cluster=self.cluster,
+                objects=objects,
+                bulk=True
+            )
+        self.assertEqual(summary['pushed'], 4)
+        self.assertEqual(len(MB.bodies), 3)
+
+    def test_codecs_through_s3(self):
+        """
+        Tests that a tarball pushed with each codec gets the codec's extension
+        and is read back with the codec detected
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        with mock_s3():
+            s3_resource = boto3.resource('s3')
+            s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+            try:
+                for codec in archive.available_codecs():
+                    s3_details = dict(self.s3_details, codec=codec)
+                    s3_object = dashboard.push_to_s3(
+                        input_directory=output_path,
+                        s3_details=s3_details
+                    )
+                    self.assertTrue(
+                        s3_object.endswith(archive.extension(codec)))
+
+                    objects = list(
+                        dashboard.iter_objects_from_s3(s3_details))
+                    self.assertEqual(len(objects), 4, msg=codec)
+            finally:
+                shutil.rmtree(output_path)
+
+    def test_metrics(self):
+        """
+        Tests that every phase of a save to S3, and of a load from it, is
+        measured
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        metrics.reset()
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        try:
+            # Moto on Python 2.7 turns away the elasticsearch stub, so the
+            # objects are loaded once S3 is no longer mocked
+            with mock_s3():
+                s3_resource = boto3.resource('s3')
+                s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+                dashboard.push_to_s3(
+                    input_directory=output_path,
+                    s3_details=self.s3_details
+                )
+                shutil.rmtree(output_path)
+                dashboard.pull_from_s3(
+                    output_directory=output_path,
+                    s3_details=self.s3_details
+                )
+            with MockElasticsearchBulk():
+                dashboard.load_objects(
+                    cluster=self.cluster,
+                    objects=dashboard.iter_objects_from_disk(output_path),
+                    bulk=True
+                )
+        finally:
+            shutil.rmtree(output_path)
+
+        phases = metrics.report()['phases']
+        self.assertEqual(
+            sorted(phases),
+            ['archive', 'download', 'extract', 'fetch', 'push', 'upload',
+             'write']
+        )
+        objects = {'search': 1, 'visualization': 1, 'dashboard': 2}
+        for phase in ['fetch', 'write', 'archive', 'extract', 'push']:
+            self.assertEqual(phases[phase]['objects'], objects, msg=phase)
+
+        self.assertEqual(phases['fetch']['requests']['count'], 1)
+        self.assertGreater(phases['fetch']['bytes']['received'], 0)
+        self.assertEqual(phases['push']['requests']['count'], 3)
+        self.assertEqual(phases['write']['bytes']['disk'],
+                         phases['extract']['bytes']['disk'])
+        self.assertEqual(phases['upload']['bytes']['sent'],
+                         phases['archive']['bytes']['compressed'])
+        self.assertEqual(phases['download']['bytes']['received'],
+                         phases['archive']['bytes']['compressed'])
+
+    def test_is_safe_member(self):
+        """
+        Tests that tar members escaping the output directory are refused
+        """
+        safe = tarfile.TarInfo('search/GET.json')
+        unsafe = tarfile.TarInfo('../search/GET.json')
+        absolute = tarfile.TarInfo('/etc/GET.json')
+        link = tarfile.TarInfo('search/link')
+        link.type = tarfile.SYMTYPE
+
+        self.assertTrue(dashboard.is_safe_member(safe))
+        self.assertFalse(dashboard.is_safe_member(unsafe))
+        self.assertFalse(dashboard.is_safe_member(absolute))
+        self.assertFalse(dashboard.is_safe_member(link))
+
+    def test_snapshot_retention(self):
+        """
+        Tests that every push is a new snapshot, that older ones can still be
+        pulled, and that old snapshots are pruned
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        with mock_s3():
+            s3_resource = boto3.resource('s3')
+            s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+            try:
+                pushed = [
+                    dashboard.push_to_s3(
+                        input_directory=output_path,
+                        s3_details=self.s3_details
+                    ) for _ in range(4)
+                ]
+            finally:
+                shutil.rmtree(output_path)
+
+            self.assertEqual(len(set(pushed)), 4)
+            self.assertEqual(dashboard.resolve_snapshot(self.s3_details),
+                             pushed[-1])
+
+            # Pull an older snapshot, by name
+            name = pushed[1].split('dashboard-')[1][:-len('.tar.gz')]
+            s3_details = dict(self.s3_details, snapshot=name)
+            self.assertEqual(dashboard.resolve_snapshot(s3_details), pushed[1])
+            objects = list(dashboard.iter_objects_from_s3(s3_details))
+            self.assertEqual(len(objects), 4)
+
+            deleted = dashboard.prune_snapshots(self.s3_details, keep=2)
+            self.assertEqual(deleted, pushed[:2])
+
+            keys = sorted(
+                o.key for o in
+                s3_resource.Bucket(self.s3_details['bucket']).objects.all()
+            )
+            self.assertEqual(keys, sorted(pushed[2:] + ['snapshots/latest']))
+
+    @unittest.skipUnless('xz' in archive.available_codecs(),
+                         'lzma is not installed')
+    def test_snapshot_by_name_any_codec(self):
+        """
+        Tests that a snapshot is found by name whatever codec it was
+        compressed with, and that a missing one is reported
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        helper_extract_all(cluster=self.cluster, output_path=output_path)
+
+        with mock_s3():
+            s3_resource = boto3.resource('s3')
+            s3_resource.create_bucket(Bucket=self.s3_details['bucket'])
+            try:
+                pushed = dashboard.push_to_s3(
+                    input_directory=output_path,
+                    s3_details=dict(self.s3_details, codec='xz')
+                )
+            finally:
+                shutil.rmtree(output_path)
+
+            self.assertTrue(pushed.endswith('.tar.xz'))
+            name = pushed.split('dashboard-')[1][:-len('.tar.xz')]
+            s3_details = dict(self.s3_details, snapshot=name)
+            self.assertEqual(dashboard.resolve_snapshot(s3_details), pushed)
+            objects = list(dashboard.iter_objects_from_s3(s3_details))
+            self.assertEqual(len(objects), 4)
+
+            with self.assertRaises(IOError):
+                dashboard.resolve_snapshot(dict(self.s3_details,
+                                                snapshot='19700101T000000Z'))
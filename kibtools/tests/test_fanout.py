@@ -0,0 +1,195 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the fan-out of loads to many clusters
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import unittest
+
+# The fan-out is written with async/await, and the clusters are served by the
+# ThreadingHTTPServer of Python 3.7, neither of which Python 2 can import
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest('the fan-out requires Python 3.7')
+
+import json
+import time
+import config
+import fanout
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeCluster(object):
+    """
+    Elasticsearch _bulk API served over HTTP in a thread, that can be slow,
+    and reject the first requests it receives
+    """
+    def __init__(self, delay=0.0, reject=0, garbage=False):
+        """
+        Constructor
+        :param delay: seconds to wait before answering each request
+        :param reject: number of requests to reject with a 429 first
+        :param garbage: if the requests should be answered with a 200 whose
+        body is not JSON
+        """
+        self.bodies = []
+        self.reject = reject
+        cluster = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(delay)
+
+                with lock:
+                    rejected = cluster.reject > 0
+                    cluster.reject -= 1
+                    if not rejected:
+                        cluster.bodies.append(body)
+
+                if rejected:
+                    status, response = 429, {'error': 'rejected'}
+                else:
+                    lines = body.decode('utf-8').strip().split('\n')
+                    items = [
+                        {'index': dict(json.loads(line)['index'], status=201)}
+                        for line in lines[::2]
+                    ]
+                    status, response = 200, {'errors': False, 'items': items}
+
+                data = json.dumps(response).encode('utf-8')
+                if garbage:
+                    data = b'<html>Bad gateway</html>'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.cluster = dict(
+            ip_address='127.0.0.1',
+            port=str(self.server.server_address[1]),
+            index='.kibana'
+        )
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+@unittest.skipIf(fanout.aiohttp is None, 'aiohttp is not installed')
+class TestFanout(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    objects = [
+        ('search', 'GET', {'title': 'GET'}),
+        ('visualization', 'GETViz', {'title': 'GETViz'}),
+        ('visualization', 'GETViz2', {'title': 'GETViz2'}),
+        ('dashboard', 'GETDash', {'title': 'GETDash'}),
+    ]
+
+    def test_parse_cluster(self):
+        """
+        Tests the parsing of the clusters given on the command line
+        """
+        self.assertEqual(
+            fanout.parse_cluster('es1'),
+            dict(ip_address='es1', port='9200', index='.kibana')
+        )
+        self.assertEqual(
+            fanout.parse_cluster('es2:9201/.kibana-2', index='.other'),
+            dict(ip_address='es2', port='9201', index='.kibana-2')
+        )
+
+    def test_fan_out(self):
+        """
+        Tests that every cluster gets every object in load order, and that the
+        clusters are loaded at the same time rather than one after another
+        """
+        with FakeCluster(delay=0.2) as slow, FakeCluster() as fast, \
+                FakeCluster(delay=0.2) as slower:
+            started = time.time()
+            summaries = fanout.fan_out(
+                clusters=[slow.cluster, fast.cluster, slower.cluster],
+                objects=self.objects,
+                batch_size=1
+            )
+            seconds = time.time() - started
+
+        for summary, cluster in zip(summaries, [slow, fast, slower]):
+            self.assertEqual(summary['pushed'], 4)
+            self.assertEqual(summary['failed'], {})
+            self.assertIsNone(summary['error'])
+            self.assertEqual(summary['requests'], 4)
+            self.assertEqual(
+                [json.loads(body.split(b'\n')[0])['index']['_type']
+                 for body in cluster.bodies][::3],
+                ['search', 'dashboard']
+            )
+
+        # Three groups of 0.2s each for the slow clusters, in parallel
+        self.assertLess(seconds, 1.2)
+        self.assertGreaterEqual(summaries[0]['max_latency'], 0.2)
+        self.assertLess(summaries[1]['seconds'], summaries[0]['seconds'])
+
+    def test_fan_out_retries_and_failures(self):
+        """
+        Tests that rejected batches are retried, and that an unreachable
+        cluster fails without holding up the others
+        """
+        config.WRITE_BACKOFF, backoff = 0.01, config.WRITE_BACKOFF
+        unreachable = dict(ip_address='127.0.0.1', port='1', index='.kibana')
+        try:
+            with FakeCluster(reject=2) as rejecting:
+                summaries = fanout.fan_out(
+                    clusters=[rejecting.cluster, unreachable],
+                    objects=self.objects
+                )
+        finally:
+            config.WRITE_BACKOFF = backoff
+
+        self.assertEqual(summaries[0]['pushed'], 4)
+        self.assertEqual(summaries[0]['retries'], 2)
+        self.assertEqual(summaries[1]['pushed'], 0)
+        self.assertIsNotNone(summaries[1]['error'])
+
+    def test_fan_out_invalid_response(self):
+        """
+        Tests that a cluster answering with a body that is not JSON fails on
+        its own, and the summaries of the other clusters are kept
+        """
+        with FakeCluster(garbage=True) as garbage, FakeCluster() as fine:
+            summaries = fanout.fan_out(
+                clusters=[garbage.cluster, fine.cluster],
+                objects=self.objects
+            )
+
+        self.assertEqual(summaries[0]['pushed'], 0)
+        self.assertIsNotNone(summaries[0]['error'])
+        self.assertEqual(summaries[1]['pushed'], 4)
+        self.assertIsNone(summaries[1]['error'])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
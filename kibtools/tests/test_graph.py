@@ -0,0 +1,148 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the graph of references between saved objects
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import shutil
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from graph import SavedObjectGraph, load_graph
+from stub_data import stub_data
+
+class TestSavedObjectGraph(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    objects = [
+        (hit['_type'], hit['_id'], hit['_source'])
+        for hit in stub_data['_search']['hits']['hits']
+    ] + [
+        ('visualization', 'Unused', {'title': 'Unused'}),
+        ('dashboard', 'Broken', {
+            'title': 'Broken',
+            'panelsJSON': json.dumps([{'id': 'Gone', 'type': 'search'}])
+        }),
+    ]
+
+    def test_lookups(self):
+        """
+        Tests the forward, reverse and transitive lookups
+        """
+        graph = SavedObjectGraph.from_objects(self.objects)
+
+        self.assertEqual(
+            graph.used_by('visualization', 'GETViz'),
+            set(['dashboard/GETDash', 'dashboard/GETDash2'])
+        )
+        self.assertEqual(graph.used_by('search', 'GET'),
+                         set(['visualization/GETViz']))
+        self.assertEqual(graph.uses('visualization', 'GETViz'),
+                         set(['search/GET']))
+        self.assertEqual(
+            graph.dependents('search', 'GET'),
+            set(['visualization/GETViz', 'dashboard/GETDash',
+                 'dashboard/GETDash2'])
+        )
+
+    def test_orphans_and_dangling(self):
+        """
+        Tests that unused objects and missing references are found
+        """
+        graph = SavedObjectGraph.from_objects(self.objects)
+
+        self.assertEqual(graph.orphans(), set(['visualization/Unused']))
+        self.assertEqual(
+            graph.dangling(),
+            {'dashboard/Broken': set(['search/Gone'])}
+        )
+
+    def test_round_trip(self):
+        """
+        Tests that the graph is rebuilt the same from its compact form
+        """
+        graph = SavedObjectGraph.from_objects(self.objects)
+        loaded = SavedObjectGraph.from_dict(
+            json.loads(json.dumps(graph.to_dict()))
+        )
+
+        self.assertEqual(loaded.nodes, graph.nodes)
+        self.assertEqual(dict(loaded.forward), dict(graph.forward))
+        self.assertEqual(dict(loaded.reverse), dict(graph.reverse))
+
+    def test_load_graph(self):
+        """
+        Tests that the graph of an export is cached, and rebuilt once the
+        export changes
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        cache_file = '{0}.graph.json'.format(output_path)
+        for object_type, name, source in self.objects:
+            folder = '{0}{1}'.format(output_path, object_type)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open('{0}/{1}.json'.format(folder, name), 'w') as f:
+                json.dump(source, f)
+
+        try:
+            graph = load_graph(output_path, cache_file)
+            self.assertTrue(os.path.isfile(cache_file))
+            self.assertEqual(graph.orphans(), set(['visualization/Unused']))
+
+            # Served from the cache while the export is unchanged
+            with open(cache_file) as f:
+                signature = json.load(f)['signature']
+            with patch.object(SavedObjectGraph, 'from_directory') as build:
+                cached = load_graph(output_path, cache_file)
+            self.assertFalse(build.called)
+            self.assertEqual(cached.nodes, graph.nodes)
+
+            os.remove('{0}visualization/Unused.json'.format(output_path))
+            rebuilt = load_graph(output_path, cache_file)
+            with open(cache_file) as f:
+                self.assertNotEqual(json.load(f)['signature'], signature)
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(rebuilt.orphans(), set())
+
+    def test_load_graph_restored(self):
+        """
+        Tests that the cache is not used once a file is replaced by an older
+        one of the same size, as when a snapshot is restored
+        """
+        output_path = '{0}/test_out/'.format(os.getcwd())
+        cache_file = '{0}.graph.json'.format(output_path)
+        folder = '{0}dashboard'.format(output_path)
+        os.makedirs(folder)
+        path = '{0}/Dash.json'.format(folder)
+
+        try:
+            # Another file, newer than the one restored
+            with open('{0}/Other.json'.format(folder), 'w') as f:
+                json.dump({}, f)
+            os.utime('{0}/Other.json'.format(folder), (2e9, 2e9))
+            with open(path, 'w') as f:
+                json.dump({'panelsJSON': '[{"id": "VizA"}]'}, f)
+            load_graph(output_path, cache_file)
+
+            with open(path, 'w') as f:
+                json.dump({'panelsJSON': '[{"id": "VizB"}]'}, f)
+            os.utime(path, (0, 0))
+            graph = load_graph(output_path, cache_file)
+        finally:
+            shutil.rmtree(output_path)
+
+        self.assertEqual(graph.uses('dashboard', 'Dash'),
+                         set(['visualization/VizB']))
@@ -0,0 +1,75 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the JSON codec
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import unittest
+import jsoncodec
+
+class TestJSONCodec(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    document = {
+        'title': u'GETDash é',
+        'panelsJSON': '[{"id": "GETViz"}]',
+        'version': 1,
+        'hits': 0.5,
+        'kibanaSavedObjectMeta': {'searchSourceJSON': '{"a": "/\\n"}'},
+    }
+
+    def tearDown(self):
+        """
+        Generic teardown
+        """
+        jsoncodec.NAME, jsoncodec.MODULE = jsoncodec.library()
+
+    def test_codecs(self):
+        """
+        Tests that every codec installed round trips a document through UTF-8
+        bytes, and agrees with the standard library
+        """
+        for name in jsoncodec.LIBRARIES:
+            try:
+                jsoncodec.NAME, jsoncodec.MODULE = jsoncodec.library(name)
+            except ValueError:
+                continue
+
+            encoded = jsoncodec.dumps(self.document)
+            self.assertIsInstance(encoded, bytes)
+            self.assertNotIn(b'\n', encoded)
+            self.assertEqual(json.loads(encoded.decode('utf-8')),
+                             self.document)
+            self.assertEqual(jsoncodec.loads(encoded), self.document)
+            self.assertEqual(jsoncodec.loads(encoded.decode('utf-8')),
+                             self.document)
+
+            # Larger than orjson can handle
+            self.assertEqual(jsoncodec.loads(jsoncodec.dumps({'n': 2 ** 70})),
+                             {'n': 2 ** 70})
+
+        with self.assertRaises(ValueError):
+            jsoncodec.library('simdjson-that-does-not-exist')
+
+    def test_raw(self):
+        """
+        Tests that RawJSON is passed through untouched, and decoded only when
+        its content is needed
+        """
+        data = b'{"title": "GET",  "description": "spaced out"}'
+        raw = jsoncodec.RawJSON(data)
+
+        self.assertIs(jsoncodec.dumps(raw), raw)
+        self.assertEqual(jsoncodec.decoded(raw),
+                         {'title': 'GET', 'description': 'spaced out'})
+        self.assertIs(jsoncodec.decoded(self.document), self.document)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
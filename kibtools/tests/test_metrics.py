@@ -0,0 +1,132 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the metrics of the phases of a run
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import shutil
+import metrics
+import unittest
+import threading
+
+class TestMetrics(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    output_path = '{0}/test_out/'.format(os.getcwd())
+
+    def setUp(self):
+        """
+        Generic setup
+        """
+        os.mkdir(self.output_path)
+
+    def tearDown(self):
+        """
+        Generic teardown
+        """
+        shutil.rmtree(self.output_path)
+
+    def test_phases(self):
+        """
+        Tests that the work and requests of each thread are counted in the
+        phase it is in
+        """
+        recorder = metrics.Metrics(buckets=(0.1, 1))
+
+        def push(i):
+            with recorder.phase('push'):
+                recorder.observe_request(0.05 * i, sent=10, received=5,
+                                         error=i == 3)
+                recorder.count_objects('search')
+
+        threads = [threading.Thread(target=push, args=(i,)) for i in range(4)]
+        with recorder.phase('fetch'):
+            recorder.observe_request(2.0, received=100)
+            recorder.add_bytes('disk', 42)
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        recorder.observe_request(0.5)
+
+        report = recorder.report(action='load')
+        self.assertEqual(report['action'], 'load')
+        self.assertEqual(sorted(report['phases']), ['fetch', 'other', 'push'])
+
+        push = report['phases']['push']
+        self.assertEqual(push['calls'], 4)
+        self.assertEqual(push['objects'], {'search': 4})
+        self.assertEqual(push['bytes'], {'sent': 40, 'received': 20})
+        self.assertEqual(push['requests']['count'], 4)
+        self.assertEqual(push['requests']['errors'], 1)
+        self.assertEqual(
+            push['requests']['latency_buckets'],
+            {'0.1': 3, '1': 4, '+Inf': 4}
+        )
+
+        fetch = report['phases']['fetch']
+        self.assertEqual(fetch['bytes'], {'sent': 0, 'received': 100,
+                                          'disk': 42})
+        self.assertEqual(fetch['requests']['latency_buckets']['1'], 0)
+        self.assertEqual(fetch['requests']['latency_buckets']['+Inf'], 1)
+        self.assertGreaterEqual(report['seconds'], fetch['wall'])
+
+    def test_write(self):
+        """
+        Tests that the report is written as JSON and as a Prometheus textfile
+        """
+        metrics.reset()
+        with metrics.phase('write'):
+            metrics.count_objects('dashboard', 2)
+            metrics.add_bytes('disk', 10)
+        with metrics.phase('push'):
+            metrics.observe_request(0.02, sent=7)
+        list(metrics.iter_counted([('search', 'GET', {})], phase='push'))
+        report = metrics.report(action='save')
+
+        report_path = '{0}report.json'.format(self.output_path)
+        metrics.write_report(report_path, report)
+        with open(report_path) as f:
+            self.assertEqual(
+                json.load(f)['phases']['write']['objects'],
+                {'dashboard': 2}
+            )
+
+        textfile = '{0}kibtools.prom'.format(self.output_path)
+        metrics.write_textfile(textfile, report)
+        self.assertEqual(sorted(os.listdir(self.output_path)),
+                         ['kibtools.prom', 'report.json'])
+        with open(textfile) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('# TYPE kibtools_request_duration_seconds histogram',
+                      lines)
+        self.assertIn(
+            'kibtools_phase_objects{phase="write",type="dashboard"} 2',
+            lines
+        )
+        self.assertIn(
+            'kibtools_phase_objects{phase="push",type="search"} 1',
+            lines
+        )
+        self.assertIn(
+            'kibtools_request_duration_seconds_bucket{phase="push",le="0.025"}'
+            ' 1',
+            lines
+        )
+        self.assertIn(
+            'kibtools_request_duration_seconds_count{phase="write"} 0',
+            lines
+        )
+        self.assertTrue(any(line.startswith('kibtools_run_seconds ')
+                            for line in lines))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
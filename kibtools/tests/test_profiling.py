@@ -0,0 +1,160 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the profiling of runs
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import pstats
+import shutil
+import metrics
+import unittest
+import benchmark
+import profiling
+import threading
+import subprocess
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class TestProfiling(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    output_path = '{0}/test_out/'.format(os.getcwd())
+
+    def setUp(self):
+        """
+        Generic setup
+        """
+        os.mkdir(self.output_path)
+
+    def tearDown(self):
+        """
+        Generic teardown
+        """
+        shutil.rmtree(self.output_path)
+
+    def test_disabled(self):
+        """
+        Tests that nothing listens to the phases when profiling is off
+        """
+        profiler = profiling.Profiler()
+        profiler.start()
+        self.assertFalse(profiler.enabled)
+        self.assertEqual(metrics.LISTENERS, [])
+        profiler.stop()
+        self.assertIsNone(profiler.memory)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_profiler(self):
+        """
+        Tests that the profile, memory of each phase and timeline are recorded
+        """
+        profile = '{0}run.prof'.format(self.output_path)
+        trace = '{0}trace.json'.format(self.output_path)
+        profiler = profiling.Profiler(profile=profile, trace_malloc=True,
+                                      trace=trace, limit=5)
+        profiler.start()
+        self.assertEqual(len(metrics.LISTENERS), 2)
+
+        held = []
+
+        def fetch():
+            with metrics.phase('fetch'):
+                held.append(bytearray(2 * 1024 * 1024))
+
+        thread = threading.Thread(target=fetch, name='fetcher')
+        thread.start()
+        thread.join()
+        for _ in range(3):
+            with metrics.phase('write'):
+                json.dumps(list(range(1000)))
+
+        profiler.stop()
+        profiler.stop()
+        self.assertEqual(metrics.LISTENERS, [])
+
+        self.assertGreater(pstats.Stats(profile).total_calls, 0)
+
+        self.assertEqual(profiler.memory['write']['blocks'], 3)
+        if hasattr(tracemalloc, 'reset_peak'):
+            self.assertGreaterEqual(profiler.memory['fetch']['peak'],
+                                    2 * 1024 * 1024)
+        else:
+            # The peak of a phase cannot be told apart from the earlier ones
+            self.assertIsNone(profiler.memory['fetch']['peak'])
+        self.assertTrue(profiler.memory['fetch']['top'][0]['site']
+                        .endswith('test_profiling.py:{0}'.format(
+                            fetch.__code__.co_firstlineno + 2)))
+
+        with open(trace) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(
+            sorted(e['name'] for e in events if e['ph'] == 'X'),
+            ['fetch', 'run', 'write', 'write', 'write']
+        )
+        self.assertIn('fetcher', [e['args']['name'] for e in events
+                                  if e['ph'] == 'M'])
+
+    def test_no_tracemalloc(self):
+        """
+        Tests that tracing allocations without tracemalloc fails before any
+        profiler starts
+        """
+        profiler = profiling.Profiler(trace_malloc=True, trace='trace.json')
+        with patch.dict(sys.modules, {'tracemalloc': None}):
+            with self.assertRaises(ValueError):
+                profiler.start()
+        self.assertEqual(metrics.LISTENERS, [])
+        self.assertIsNone(profiler.started)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_command_line(self):
+        """
+        Tests the profiling switches of the command line on a save
+        """
+        trace = '{0}trace.json'.format(self.output_path)
+        report = '{0}report.json'.format(self.output_path)
+        corpus = benchmark.generate_corpus(objects=20)
+
+        with benchmark.StubElasticsearch(corpus) as stub:
+            subprocess.check_call([
+                sys.executable,
+                os.path.join(PROJECT_HOME, 'dashboard.py'),
+                '-a', 'save',
+                '-d', '{0}save'.format(self.output_path),
+                '--cluster-ip', stub.cluster['ip_address'],
+                '--cluster-port', stub.cluster['port'],
+                '--profile', '{0}run.prof'.format(self.output_path),
+                '--trace-malloc',
+                '--trace', trace,
+                '--report', report
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        with open(report) as f:
+            report = json.load(f)
+        self.assertEqual(sorted(report['memory']), ['fetch', 'write'])
+        self.assertEqual(sum(report['phases']['write']['objects'].values()),
+                         20)
+        with open(trace) as f:
+            self.assertEqual(
+                len([e for e in json.load(f)['traceEvents']
+                     if e['name'] == 'write']),
+                20
+            )
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,134 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the write scheduler
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import time
+import threading
+import unittest
+
+from scheduler import WriteScheduler, is_rejected
+from concurrent.futures import ThreadPoolExecutor
+
+class StubResponse(object):
+    """
+    Stub of a response from elasticsearch
+    """
+    def __init__(self, status_code, text=''):
+        """
+        Constructor
+        :param status_code: HTTP status code
+        :param text: body of the response
+        """
+        self.status_code = status_code
+        self.text = text
+
+class TestWriteScheduler(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    def test_is_rejected(self):
+        """
+        Tests that overloaded responses are told apart from other errors
+        """
+        self.assertTrue(is_rejected(StubResponse(429)))
+        self.assertTrue(is_rejected(StubResponse(
+            500,
+            '{"error": {"type": "es_rejected_execution_exception"}}'
+        )))
+        self.assertFalse(is_rejected(StubResponse(201)))
+        self.assertFalse(is_rejected(StubResponse(400, 'mapper_parsing')))
+
+    def test_retry_rejected(self):
+        """
+        Tests that rejected writes are retried until they are accepted
+        """
+        scheduler = WriteScheduler(
+            max_in_flight=8,
+            initial_in_flight=8,
+            backoff=0
+        )
+        responses = [StubResponse(201), StubResponse(429), StubResponse(429)]
+        response = scheduler.write(responses.pop)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(scheduler.rejected, 2)
+        self.assertEqual(scheduler.written, 1)
+        # Halved on each rejection, grown on each success
+        self.assertEqual(scheduler.stats()['in_flight'], 2)
+
+    def test_failed_writes(self):
+        """
+        Tests that writes failing for another reason than an overloaded
+        cluster are neither counted as written nor grow the writes in flight
+        """
+        scheduler = WriteScheduler(
+            max_in_flight=8,
+            initial_in_flight=2,
+            backoff=0
+        )
+        for _ in range(10):
+            response = scheduler.write(
+                lambda: StubResponse(400, 'mapper_parsing'))
+        self.assertEqual(response.status_code, 400)
+
+        def write():
+            raise IOError('Connection refused')
+
+        with self.assertRaises(IOError):
+            scheduler.write(write)
+
+        self.assertEqual(scheduler.written, 0)
+        self.assertEqual(scheduler.failed, 11)
+        self.assertEqual(scheduler.stats()['in_flight'], 2)
+        self.assertEqual(scheduler.rate, 0.0)
+
+    def test_give_up(self):
+        """
+        Tests that a write still rejected after every retry is returned
+        """
+        scheduler = WriteScheduler(max_retries=2, backoff=0)
+        calls = []
+
+        def write():
+            calls.append(1)
+            return StubResponse(429)
+
+        response = scheduler.write(write)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(scheduler.written, 0)
+
+    def test_in_flight_limit(self):
+        """
+        Tests that no more writes than allowed are ever in flight, and that
+        the allowance grows while writes are accepted
+        """
+        scheduler = WriteScheduler(max_in_flight=4, initial_in_flight=1)
+        lock = threading.Lock()
+        state = dict(current=0, peak=0)
+
+        def write():
+            with lock:
+                state['current'] += 1
+                state['peak'] = max(state['peak'], state['current'])
+            time.sleep(0.005)
+            with lock:
+                state['current'] -= 1
+            return StubResponse(201)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(50):
+                executor.submit(scheduler.write, write)
+
+        self.assertLessEqual(state['peak'], 4)
+        self.assertEqual(scheduler.stats()['in_flight'], 4)
+        self.assertEqual(scheduler.written, 50)
+        self.assertGreater(scheduler.rate, 0)
@@ -0,0 +1,165 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the incremental parser of search responses
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import unittest
+import searchstream
+
+class MockStreamedResponse(object):
+    """
+    Response of requests, whose body is read in chunks of a given size
+    """
+    def __init__(self, body):
+        """
+        Constructor
+        :param body: bytes of the body
+        """
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        """
+        Iterate over the body in chunks
+        """
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        """
+        Close the response
+        """
+        self.closed = True
+
+class TestSearchStream(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    page = {
+        '_scroll_id': 'c2Nhbi"Ax',
+        'took': 3,
+        'timed_out': False,
+        '_shards': {'total': 1, 'failed': []},
+        'hits': {
+            'total': 3,
+            'max_score': None,
+            'hits': [
+                {'_index': '.kibana', '_type': 'search', '_id': 'GET',
+                 '_score': 1.0, '_source': {
+                     'title': 'GET ]}"',
+                     'panelsJSON': '[{"id": "GETViz"}]'
+                 }},
+                {'_index': '.kibana', '_type': 'dashboard', '_id': u'GETDash é',
+                 '_source': {'title': u'GETDash é', 'n': [1, 2.5, {'a': []}]}},
+                {'_id': 'Empty', '_source': {}},
+            ]
+        }
+    }
+
+    def parse(self, body, chunk_size):
+        """
+        Parse a body fed in chunks
+
+        :param body: bytes of the body
+        :param chunk_size: bytes fed at a time
+        :return: tuple of the items and the parser
+        """
+        parser = searchstream.StreamParser()
+        items = []
+        for i in range(0, len(body), chunk_size):
+            items.extend(parser.feed(body[i:i + chunk_size]))
+        items.extend(parser.close())
+        return items, parser
+
+    def test_chunks(self):
+        """
+        Tests that the hits, and the scalars around them, are the same
+        wherever the chunks of the body are cut, even through a character
+        """
+        for indent, ascii in [(None, True), (2, False)]:
+            body = json.dumps(self.page, indent=indent, ensure_ascii=ascii) \
+                .encode('utf-8')
+            for chunk_size in range(1, 40):
+                items, parser = self.parse(body, chunk_size)
+                self.assertEqual(items, self.page['hits']['hits'])
+                self.assertEqual(parser.items, 3)
+                self.assertEqual(parser.fields, {
+                    '_scroll_id': 'c2Nhbi"Ax',
+                    'took': 3,
+                    'timed_out': False,
+                    '_shards.total': 1,
+                    'hits.total': 3,
+                    'hits.max_score': None
+                })
+
+    def test_numbers(self):
+        """
+        Tests that a float or an exponent cut anywhere by the chunks is read
+        whole, e.g., after its . or e
+        """
+        body = b'{"took": -12, "hits": {"max_score": 1.25, "hits": [' \
+            b'{"_score": -3.5e-7, "n": 2E+10}, 1.0e3, 6]}, "t": 0.5}'
+        for cut in range(1, len(body)):
+            parser = searchstream.StreamParser()
+            items = parser.feed(body[:cut]) + parser.feed(body[cut:]) + \
+                parser.close()
+            self.assertEqual(items, [{'_score': -3.5e-7, 'n': 2E+10}, 1000.0,
+                                     6])
+            self.assertEqual(parser.fields, {
+                'took': -12,
+                'hits.max_score': 1.25,
+                't': 0.5
+            })
+
+    def test_docs(self):
+        """
+        Tests that other arrays of items are found, e.g., the docs of _mget,
+        and that empty ones are parsed
+        """
+        parser = searchstream.StreamParser(path=('docs',))
+        self.assertEqual(
+            parser.feed(b'{"docs": [{"_id": "GET", "found": false}, 1, "s"]}') +
+            parser.close(),
+            [{'_id': 'GET', 'found': False}, 1, 's']
+        )
+
+        parser = searchstream.StreamParser()
+        self.assertEqual(parser.feed(b'{"hits": {"hits": []}}'), [])
+        self.assertEqual(parser.close(), [])
+        self.assertEqual(parser.items, 0)
+
+    def test_malformed(self):
+        """
+        Tests that bodies cut short, or that are not JSON, are refused
+        """
+        for body in [b'', b'{"hits": {"hits": [{"_id": "GET"}',
+                     b'{"hits": {"hits": [{"_id" "GET"}]}}',
+                     b'{"took": 1}}']:
+            parser = searchstream.StreamParser()
+            with self.assertRaises(ValueError):
+                parser.feed(body)
+                parser.close()
+
+    def test_iterate(self):
+        """
+        Tests that a streamed response is parsed as it is read, and closed
+        """
+        response = MockStreamedResponse(json.dumps(self.page).encode('utf-8'))
+        parser = searchstream.StreamParser()
+        hits = parser.iterate(response, chunk_size=100)
+
+        self.assertEqual(next(hits), self.page['hits']['hits'][0])
+        self.assertFalse(response.closed)
+        self.assertEqual(list(hits), self.page['hits']['hits'][1:])
+        self.assertTrue(response.closed)
+        self.assertEqual(parser.fields['_scroll_id'], 'c2Nhbi"Ax')
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the content-addressed snapshot store
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import json
+import glob
+import boto3
+import shutil
+import unittest
+import snapshots
+
+from moto import mock_s3
+
+def helper_make_export(output_path, objects):
+    """
+    Write an export on disk
+
+    :param output_path: directory of the export
+    :param objects: dictionary of sources keyed by (type, name)
+    """
+    for (object_type, name), source in objects.items():
+        folder = '{0}{1}'.format(output_path, object_type)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open('{0}/{1}.json'.format(folder, name), 'w') as f:
+            json.dump(source, f)
+
+class TestSnapshotStore(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    export_path = '{0}/test_out/'.format(os.getcwd())
+    store_path = '{0}/test_store/'.format(os.getcwd())
+    restore_path = '{0}/test_restore/'.format(os.getcwd())
+
+    objects = {
+        ('search', 'GET'): {'title': 'GET'},
+        ('visualization', 'GETViz'): {'title': 'GETViz'},
+        ('dashboard', 'GETDash'): {'title': 'GETDash'},
+        ('dashboard', 'Copy'): {'title': 'GETDash'},
+    }
+
+    def tearDown(self):
+        """
+        Clean up files
+        """
+        for path in [self.export_path, self.store_path, self.restore_path]:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+    def test_open_store(self):
+        """
+        Tests that the store is chosen from its location
+        """
+        local = snapshots.open_store(self.store_path)
+        self.assertIsInstance(local, snapshots.LocalBlobStore)
+
+        with mock_s3():
+            remote = snapshots.open_store('s3://dashboard/history/')
+        self.assertIsInstance(remote, snapshots.S3BlobStore)
+        self.assertEqual(remote.s3_bucket, 'dashboard')
+        self.assertEqual(remote.prefix, 'history')
+
+    def test_deduplicated_snapshots(self):
+        """
+        Tests that identical objects are stored once, and that a snapshot
+        only uploads the blobs that changed
+        """
+        helper_make_export(self.export_path, self.objects)
+        store = snapshots.SnapshotStore(
+            snapshots.LocalBlobStore(self.store_path)
+        )
+
+        first = store.save(self.export_path, name='first')
+        self.assertEqual(first['uploaded'], 3)
+        self.assertEqual(len(first['manifest']['objects']), 4)
+
+        helper_make_export(self.export_path, {
+            ('search', 'GET'): {'title': 'GET', 'description': 'changed'}
+        })
+        second = store.save(self.export_path, name='second')
+        self.assertEqual(second['uploaded'], 1)
+        self.assertEqual(store.latest(), 'second')
+
+        blobs = glob.glob('{0}blobs/*/*'.format(self.store_path))
+        self.assertEqual(len(blobs), 4)
+
+        # Point-in-time restore of the first snapshot, over an export holding
+        # an object it does not
+        helper_make_export(self.restore_path, {
+            ('dashboard', 'Newer'): {'title': 'Newer'}
+        })
+        store.restore(self.restore_path, name='first')
+        with open('{0}search/GET.json'.format(self.restore_path)) as f:
+            self.assertEqual(json.load(f), {'title': 'GET'})
+        self.assertEqual(
+            len(glob.glob('{0}*/*.json'.format(self.restore_path))),
+            4
+        )
+        self.assertFalse(os.path.isfile(
+            '{0}dashboard/Newer.json'.format(self.restore_path)))
+
+    @mock_s3
+    def test_s3_snapshots(self):
+        """
+        Tests that snapshots are saved to, and restored from, S3
+        """
+        s3_resource = boto3.resource('s3')
+        s3_resource.create_bucket(Bucket='dashboard')
+        helper_make_export(self.export_path, self.objects)
+
+        store = snapshots.SnapshotStore(snapshots.open_store('s3://dashboard'))
+        self.assertIsNone(store.latest())
+        store.save(self.export_path)
+        again = store.save(self.export_path)
+        self.assertEqual(again['uploaded'], 0)
+
+        store.restore(self.restore_path)
+        with open('{0}dashboard/Copy.json'.format(self.restore_path)) as f:
+            self.assertEqual(json.load(f), {'title': 'GETDash'})
+
+        keys = [o.key for o in s3_resource.Bucket('dashboard').objects.all()]
+        self.assertEqual(
+            len([key for key in keys if key.startswith('store/blobs/')]),
+            3
+        )
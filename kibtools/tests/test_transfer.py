@@ -0,0 +1,142 @@
+# encoding: utf-8
+"""
+Relevant unit tests for the transfers to and from AWS S3
+"""
+import os
+import sys
+
+PROJECT_HOME = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../'))
+sys.path.append(PROJECT_HOME)
+
+import boto3
+import unittest
+import transfer
+
+from moto import mock_s3
+
+class TestTransfer(unittest.TestCase):
+    """
+    Central unit test class
+    """
+    bucket = 'dashboard'
+
+    def setUp(self):
+        """
+        Create the bucket in a mocked S3
+        """
+        self.mock = mock_s3()
+        self.mock.start()
+        self.s3_resource = boto3.resource('s3')
+        self.s3_resource.create_bucket(Bucket=self.bucket)
+
+    def tearDown(self):
+        """
+        Stop mocking S3
+        """
+        self.mock.stop()
+
+    def read_object(self, s3_object):
+        """
+        Read an object back from the bucket
+        """
+        return self.s3_resource.Object(self.bucket, s3_object)\
+            .get()['Body'].read()
+
+    def test_multipart_upload_writer(self):
+        """
+        Tests that what is written is uploaded in several parts
+        """
+        data = os.urandom(transfer.MIN_PART_SIZE * 2 + 1024)
+
+        with transfer.MultipartUploadWriter(
+                self.bucket, 'large',
+                part_size=transfer.MIN_PART_SIZE,
+                concurrency=2) as upload:
+            for start in range(0, len(data), 1024 * 1024):
+                upload.write(data[start:start + 1024 * 1024])
+
+        self.assertEqual(len(upload.parts), 3)
+        self.assertEqual(upload.bytes, len(data))
+        self.assertEqual(self.read_object('large'), data)
+
+    def test_multipart_upload_writer_small(self):
+        """
+        Tests that an upload smaller than a part is sent in one go
+        """
+        with transfer.MultipartUploadWriter(self.bucket, 'small') as upload:
+            upload.write(b'dashboard')
+
+        self.assertIsNone(upload.upload_id)
+        self.assertEqual(self.read_object('small'), b'dashboard')
+
+    def test_multipart_upload_writer_abort(self):
+        """
+        Tests that the upload is aborted, and nothing stored, on errors
+        """
+        s3_client = boto3.client('s3')
+        try:
+            with transfer.MultipartUploadWriter(self.bucket, 'failed') \
+                    as upload:
+                upload.write(os.urandom(transfer.MIN_PART_SIZE))
+                raise ValueError('interrupted')
+        except ValueError:
+            pass
+
+        uploads = s3_client.list_multipart_uploads(Bucket=self.bucket)
+        self.assertEqual(uploads.get('Uploads', []), [])
+        listing = s3_client.list_objects(Bucket=self.bucket)
+        self.assertEqual(listing.get('Contents', []), [])
+
+    def test_ranged_reader(self):
+        """
+        Tests that byte ranges downloaded in parallel are read back in order
+        """
+        data = os.urandom(1024 * 1024 + 17)
+        self.s3_resource.Bucket(self.bucket).put_object(Key='big', Body=data)
+
+        with transfer.RangedReader(self.bucket, 'big', part_size=100 * 1024,
+                                   concurrency=3) as download:
+            self.assertEqual(download.read(10), data[:10])
+            self.assertLessEqual(len(download.pending), 3)
+            rest = download.read()
+
+        self.assertEqual(rest, data[10:])
+        self.assertEqual(download.read(10), b'')
+        self.assertEqual(download.stats()['bytes'], len(data))
+
+    def test_upload_and_download_file(self):
+        """
+        Tests that a file is uploaded and downloaded back whole, with the rate
+        achieved reported
+        """
+        data = os.urandom(transfer.MIN_PART_SIZE + 1024)
+        input_file = '/tmp/kibtools_upload.bin'
+        output_file = '/tmp/kibtools_download.bin'
+        with open(input_file, 'wb') as f:
+            f.write(data)
+
+        try:
+            upload = transfer.upload_file(
+                input_file,
+                self.bucket,
+                'file',
+                part_size=transfer.MIN_PART_SIZE
+            )
+            download = transfer.download_file(
+                self.bucket,
+                'file',
+                output_file,
+                part_size=1024 * 1024
+            )
+            with open(output_file, 'rb') as f:
+                downloaded = f.read()
+        finally:
+            for path in [input_file, output_file]:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        self.assertEqual(downloaded, data)
+        self.assertEqual(upload['bytes'], len(data))
+        self.assertEqual(download['bytes'], len(data))
+        self.assertGreaterEqual(download['rate'], 0)
@@ -0,0 +1,356 @@
+# encoding: utf-8
+"""
+Transfers to and from AWS S3
+"""
+
+import time
+import config
+import metrics
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Smallest part S3 accepts in a multipart upload, other than the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+def transfer_stats(transferred, started):
+    """
+    Summarise a transfer
+
+    :param transferred: number of bytes transferred
+    :param started: time the transfer started
+    :return: dictionary of the bytes, seconds and MB/s achieved
+    """
+    seconds = time.time() - started
+    return dict(
+        bytes=transferred,
+        seconds=seconds,
+        rate=transferred / 1024.0 / 1024.0 / seconds if seconds > 0 else 0.0
+    )
+
+class MultipartUploadWriter(object):
+    """
+    File-like object that uploads what is written to it to S3 as it goes,
+    with a multipart upload whose parts are sent in parallel. At most one
+    part being filled and one per upload slot are held in memory, whatever
+    the size of the upload, and nothing is written to disk.
+    """
+    def __init__(self, s3_bucket, s3_object, part_size=None, concurrency=None):
+        """
+        Constructor
+        :param s3_bucket: bucket to upload to
+        :param s3_object: name of the object in the bucket
+        :param part_size: size of the parts in bytes
+        :param concurrency: number of parts uploaded at once
+        """
+        self.s3_bucket = s3_bucket
+        self.s3_object = s3_object
+        self.part_size = max(part_size or config.S3_PART_SIZE, MIN_PART_SIZE)
+        concurrency = concurrency or config.S3_CONCURRENCY
+
+        import boto3
+        self.s3_client = boto3.client('s3')
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.bytes = 0
+        self.closed = False
+        self.started = time.time()
+
+    def write(self, data):
+        """
+        Write data to the upload, sending every part that is filled
+
+        :param data: bytes
+        :return: number of bytes written
+        """
+        self.buffer.extend(data)
+        self.bytes += len(data)
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._send_part(part)
+        return len(data)
+
+    def _send_part(self, data):
+        """
+        Queue a part to be uploaded, waiting for a free upload slot so that
+        the parts held in memory stay bounded
+
+        :param data: bytes of the part
+        """
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_object
+            )['UploadId']
+
+        self.slots.acquire()
+        part_number = len(self.parts) + 1
+        self.parts.append(
+            self.executor.submit(self._upload_part, part_number, data)
+        )
+
+    def _upload_part(self, part_number, data):
+        """
+        Upload a part
+
+        :param part_number: number of the part, from 1
+        :param data: bytes of the part
+        :return: dictionary describing the uploaded part
+        """
+        try:
+            with metrics.phase('upload'):
+                started = time.time()
+                response = self.s3_client.upload_part(
+                    Bucket=self.s3_bucket,
+                    Key=self.s3_object,
+                    UploadId=self.upload_id,
+                    PartNumber=part_number,
+                    Body=data
+                )
+                metrics.observe_request(time.time() - started, sent=len(data))
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """
+        Upload what is left and complete the upload. An upload smaller than
+        one part is sent with a single PUT.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            if self.upload_id is None:
+                with metrics.phase('upload'):
+                    started = time.time()
+                    self.s3_client.put_object(
+                        Bucket=self.s3_bucket,
+                        Key=self.s3_object,
+                        Body=bytes(self.buffer)
+                    )
+                    metrics.observe_request(time.time() - started,
+                                            sent=len(self.buffer))
+                return
+
+            if self.buffer:
+                self._send_part(bytes(self.buffer))
+            parts = [part.result() for part in self.parts]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_object,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.buffer = bytearray()
+            self.executor.shutdown()
+
+    def abort(self):
+        """
+        Abort the upload, so that S3 does not keep the parts sent so far
+        """
+        self.closed = True
+        self.executor.shutdown()
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_object,
+                UploadId=self.upload_id
+            )
+            self.upload_id = None
+
+    def stats(self):
+        """
+        Summary of the upload so far
+
+        :return: dictionary of the bytes, seconds and MB/s achieved
+        """
+        return transfer_stats(self.bytes, self.started)
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        return self
+
+    def __exit__(self, exc_type, *args):
+        """
+        Defines the behaviour for __exit__, aborting the upload on errors
+        """
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class RangedReader(object):
+    """
+    File-like object that reads an S3 object with byte-range GETs issued in
+    parallel, and returns them in order. Only as many parts as there are
+    download slots are held in memory ahead of the reader.
+    """
+    def __init__(self, s3_bucket, s3_object, part_size=None, concurrency=None):
+        """
+        Constructor
+        :param s3_bucket: bucket to download from
+        :param s3_object: name of the object in the bucket
+        :param part_size: size of the byte ranges
+        :param concurrency: number of byte ranges downloaded at once
+        """
+        self.s3_bucket = s3_bucket
+        self.s3_object = s3_object
+        self.part_size = part_size or config.S3_PART_SIZE
+        self.concurrency = concurrency or config.S3_CONCURRENCY
+
+        import boto3
+        self.s3_client = boto3.client('s3')
+        head = self.s3_client.head_object(Bucket=s3_bucket, Key=s3_object)
+        self.size = head['ContentLength']
+        self.etag = head['ETag']
+
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.pending = deque()
+        self.next_offset = 0
+        self.buffer = b''
+        self.offset = 0
+        self.bytes = 0
+        self.started = time.time()
+        self._queue_ranges()
+
+    def _queue_ranges(self):
+        """
+        Queue byte ranges until every download slot is busy
+        """
+        while len(self.pending) < self.concurrency and \
+                self.next_offset < self.size:
+            end = min(self.next_offset + self.part_size, self.size) - 1
+            self.pending.append(
+                self.executor.submit(self._get_range, self.next_offset, end)
+            )
+            self.next_offset = end + 1
+
+    def _get_range(self, start, end):
+        """
+        Download a byte range of the object. The ETag is checked so that the
+        parts all come from the same version of the object.
+
+        :param start: first byte
+        :param end: last byte, inclusive
+        :return: bytes
+        """
+        with metrics.phase('download'):
+            started = time.time()
+            data = self.s3_client.get_object(
+                Bucket=self.s3_bucket,
+                Key=self.s3_object,
+                Range='bytes={0}-{1}'.format(start, end),
+                IfMatch=self.etag
+            )['Body'].read()
+            metrics.observe_request(time.time() - started, received=len(data))
+        return data
+
+    def read(self, size=-1):
+        """
+        Read from the object
+
+        :param size: number of bytes to read, all that is left if negative
+        :return: bytes, empty once the whole object was read
+        """
+        chunks = []
+        wanted = size
+        while wanted != 0:
+            if self.offset >= len(self.buffer):
+                if not self.pending:
+                    break
+                self.buffer = self.pending.popleft().result()
+                self.offset = 0
+                self._queue_ranges()
+
+            end = len(self.buffer) if wanted < 0 \
+                else min(len(self.buffer), self.offset + wanted)
+            chunks.append(self.buffer[self.offset:end])
+            if wanted > 0:
+                wanted -= end - self.offset
+            self.offset = end
+
+        data = b''.join(chunks)
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        """
+        Stop downloading
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+
+    def stats(self):
+        """
+        Summary of the download so far
+
+        :return: dictionary of the bytes, seconds and MB/s achieved
+        """
+        return transfer_stats(self.bytes, self.started)
+
+    def __enter__(self):
+        """
+        Defines the behaviour for __enter__
+        """
+        return self
+
+    def __exit__(self, *args):
+        """
+        Defines the behaviour for __exit__
+        """
+        self.close()
+
+def upload_file(input_file, s3_bucket, s3_object, part_size=None,
+                concurrency=None):
+    """
+    Upload a file to S3, with its parts sent in parallel
+
+    :param input_file: file to upload
+    :param s3_bucket: bucket to upload to
+    :param s3_object: name of the object in the bucket
+    :param part_size: size of the parts in bytes
+    :param concurrency: number of parts uploaded at once
+    :return: dictionary of the bytes, seconds and MB/s achieved
+    """
+    with MultipartUploadWriter(s3_bucket, s3_object, part_size=part_size,
+                               concurrency=concurrency) as upload:
+        with open(input_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(upload.part_size), b''):
+                upload.write(chunk)
+
+    return upload.stats()
+
+def download_file(s3_bucket, s3_object, output_file, part_size=None,
+                  concurrency=None):
+    """
+    Download an S3 object to a file, with byte ranges fetched in parallel
+
+    :param s3_bucket: bucket to download from
+    :param s3_object: name of the object in the bucket
+    :param output_file: file to download to
+    :param part_size: size of the byte ranges
+    :param concurrency: number of byte ranges downloaded at once
+    :return: dictionary of the bytes, seconds and MB/s achieved
+    """
+    with RangedReader(s3_bucket, s3_object, part_size=part_size,
+                      concurrency=concurrency) as download:
+        with open(output_file, 'wb') as f:
+            for chunk in iter(lambda: download.read(download.part_size), b''):
+                f.write(chunk)
+
+    return download.stats()